@@ -1,22 +1,133 @@
 using Base.Threads
 using Printf
 using Dates
+using Sockets
 
 include("simulate.jl")
 
-function process_subdirectory(dir_path::String)
+const REGISTRY_PATH = joinpath("runs", "registry")
+const REGISTRY_LOCK_PATH = joinpath("runs", "registry.lock")
+const DISPATCH_SOCKET_PATH = joinpath("runs", "dispatch.sock")
+const QUEUE_PATH = joinpath("runs", "queue")
+const HEALTH_PATH = joinpath("runs", "scanner_health")
+const DURATIONS_PATH = joinpath("runs", "durations")
+const CLOCK_THREAD_CPUTIME_ID = 3
+const POLL_INTERVAL_SECONDS = parse(Float64, get(ENV, "SIM_POLL_INTERVAL", "5"))
+const MAX_CONCURRENT_RUNS = parse(
+    Int, get(ENV, "SIM_MAX_CONCURRENT_RUNS", string(Threads.nthreads(:default)))
+)
+# the scanner exits after this many runs to release memory accumulated over its lifetime
+# and is then restarted by the start script. zero means it is never recycled
+const RECYCLE_AFTER_RUNS = parse(Int, get(ENV, "SIM_RECYCLE_AFTER_RUNS", "0"))
+const STARTED_AT = Dates.now()
+const NR_PROCESSED = Threads.Atomic{Int}(0)
+
+# in-memory view of the run registry, a log of status changes appended by the API and the
+# scanner. only the part of the log added since the last read is parsed, so the cost of a
+# scan is proportional to the number of status changes, not the number of runs. the
+# retention replaces the log with a compacted copy now and then, which is noticed by its
+# changed inode. the waiting runs form a FIFO queue from which the workers take their runs
+mutable struct RunRegistry
+    offset::Int
+    inode::UInt
+    waiting::Vector{String}
+    has_waiting::Threads.Condition
+end
+
+RunRegistry() = RunRegistry(0, 0, String[], Threads.Condition())
+
+function append_duration(run_id::String, waited::Float64, simulated::Float64, success::Bool)
+    # the API reads this log for the metrics of waiting and simulation times
+    line = "$run_id\t$waited\t$simulated\t$success\n"
+    open(DURATIONS_PATH, "a") do file
+        write(file, line)
+    end
+end
+
+function thread_cpu_seconds()
+    # CPU time of the current thread. the simulation hardly yields, so its task stays on
+    # the same thread and this measures the simulation without concurrent runs
+    timespec = Ref{NTuple{2, Int}}((0, 0))
+    ccall(:clock_gettime, Cint, (Cint, Ref{NTuple{2, Int}}), CLOCK_THREAD_CPUTIME_ID, timespec)
+    return timespec[][1] + timespec[][2] / 1e9
+end
+
+function output_size(dir_path::String)
+    return sum(filesize, values(output_files(dir_path)); init=0)
+end
+
+function write_profile(dir_path::String, profile::Dict)
+    # the API serves the profile together with the timeline of the run
+    temp_path = joinpath(dir_path, "profile.json.tmp")
+    open(temp_path, "w") do file
+        JSON.print(file, profile)
+    end
+    mv(temp_path, joinpath(dir_path, "profile.json"), force=true)
+end
+
+function process_subdirectory(dir_path::String, waited::Float64)
     @info "[$(Dates.now())] Started processing: $(dir_path) on thread #$(Threads.threadid())"
-    simulate(dir_path)
+    cpu_started = thread_cpu_seconds()
+    stats = @timed simulate(dir_path)
+    success = stats.value
+    append_duration(basename(dir_path), waited, stats.time, success)
+    write_profile(dir_path, Dict(
+        "wall_seconds" => stats.time,
+        "cpu_seconds" => thread_cpu_seconds() - cpu_started,
+        "gc_seconds" => stats.gctime,
+        "allocated_bytes" => stats.bytes,
+        "max_rss_bytes" => Sys.maxrss(),
+        "output_bytes" => output_size(dir_path),
+        "success" => success
+    ))
+    if success
+        try
+            store_in_result_cache(dir_path)
+        catch e
+            @warn "Could not store results of $(dir_path) in result cache: $e"
+        end
+    end
     set_status(dir_path, "finished")
     @info "[$(Dates.now())] Finished processing: $(dir_path)"
 end
 
+function recycle_due()
+    return RECYCLE_AFTER_RUNS > 0 && NR_PROCESSED[] >= RECYCLE_AFTER_RUNS
+end
+
+function write_heartbeat()
+    # the API reads this to report if the scanner is alive
+    temp_path = HEALTH_PATH * ".tmp"
+    open(temp_path, "w") do file
+        write(file, "$(Dates.now())\n$(NR_PROCESSED[])\n$(STARTED_AT)")
+    end
+    mv(temp_path, HEALTH_PATH, force=true)
+end
+
+function append_to_registry(run_id::String, status::String, timestamp::DateTime)
+    # write the line in one call so concurrent appends do not interleave
+    line = "$run_id\t$status\t$timestamp\n"
+    # the lock is shared between appends and keeps the retention from replacing the
+    # registry during an append
+    with_file_lock(REGISTRY_LOCK_PATH, LOCK_SH) do
+        open(REGISTRY_PATH, "a") do file
+            write(file, line)
+        end
+    end
+end
+
 function set_status(dir_path::String, status::String)
+    timestamp = Dates.now()
     status_path = joinpath(dir_path, "status")
     open(status_path, "w") do file
         write(file, "$status\n")
-        write(file, "$(Dates.now())")
+        write(file, "$timestamp")
     end
+    # the timeline keeps all status changes of the run, same as written by the API
+    open(joinpath(dir_path, "timeline"), "a") do file
+        write(file, "$status\t$timestamp\n")
+    end
+    append_to_registry(basename(dir_path), status, timestamp)
 end
 
 function get_status(dir_path::String)
@@ -33,23 +144,175 @@ function get_status(dir_path::String)
     return status
 end
 
-function scan_loop()
-    @info "Starting scanner with $(Threads.nthreads()) threads and on #$(Threads.threadid())"
+function bootstrap_registry()
+    # runs created before the registry existed are only known by their status file, so
+    # this reads them once to fill the registry
+    @info "No run registry found, building it from the run directories"
+    for dir_path in readdir("./runs", join=true)
+        if isdir(dir_path)
+            append_to_registry(basename(dir_path), get_status(dir_path), Dates.now())
+        end
+    end
+end
+
+function write_queue(waiting::Vector{String})
+    # the API reads the queue to report the queue position of waiting runs. the file is
+    # replaced by renaming so it is never read half-written
+    temp_path = QUEUE_PATH * ".tmp"
+    open(temp_path, "w") do file
+        write(file, join(waiting .* "\n"))
+    end
+    mv(temp_path, QUEUE_PATH, force=true)
+end
+
+function read_registry!(registry::RunRegistry)
+    if !isfile(REGISTRY_PATH)
+        return
+    end
+
+    data, replaced = open(REGISTRY_PATH, "r") do file
+        # a compacted registry holds the latest status of every run, so it is read from
+        # its start and replaces the queue of waiting runs
+        inode = stat(file).inode
+        replaced = inode != registry.inode
+        if replaced
+            registry.inode = inode
+            registry.offset = 0
+        end
+        seek(file, registry.offset)
+        read(file, String), replaced
+    end
+
+    # a line without trailing newline might still be written, so it is read next time
+    last_newline = something(findlast('\n', data), 0)
+    if last_newline == 0 && !replaced
+        return
+    end
+    registry.offset += last_newline
+
+    lock(registry.has_waiting) do
+        if replaced
+            empty!(registry.waiting)
+        end
+        for line in split(data[1:last_newline], '\n', keepempty=false)
+            parts = split(line, '\t')
+            if length(parts) < 2
+                continue
+            end
+            run_id = String(parts[1])
+            status = lowercase(strip(parts[2]))
+            filter!(id -> id != run_id, registry.waiting)
+            if status == "waiting"
+                push!(registry.waiting, run_id)
+            end
+        end
+        write_queue(registry.waiting)
+        notify(registry.has_waiting)
+    end
+end
+
+function next_waiting_run!(registry::RunRegistry)
+    lock(registry.has_waiting) do
+        while isempty(registry.waiting) && !recycle_due()
+            wait(registry.has_waiting)
+        end
+        if recycle_due()
+            return nothing
+        end
+        run_id = popfirst!(registry.waiting)
+        write_queue(registry.waiting)
+        return run_id
+    end
+end
+
+function work(registry::RunRegistry)
+    # each worker processes one run at a time, so the number of workers bounds the number
+    # of concurrent simulations regardless of how many runs are queued
     while true
+        run_id = next_waiting_run!(registry)
+        if run_id === nothing
+            return
+        end
+        dir_path = joinpath("./runs", run_id)
         try
-            for dir_path in readdir("./runs", join=true)
-                if isdir(dir_path)
-                    if get_status(dir_path) == "waiting"
-                        set_status(dir_path, "running")
-                        Threads.@spawn process_subdirectory(dir_path)
-                    end
-                end
+            if isdir(dir_path) && get_status(dir_path) == "waiting"
+                # the status file was last written when the run was queued
+                waited = time() - mtime(joinpath(dir_path, "status"))
+                set_status(dir_path, "running")
+                process_subdirectory(dir_path, waited)
+                Threads.atomic_add!(NR_PROCESSED, 1)
+            end
+        catch e
+            @warn "Error during processing of $(dir_path): $e"
+        end
+        if recycle_due()
+            # wake up idle workers so they can exit too
+            lock(registry.has_waiting) do
+                notify(registry.has_waiting)
             end
+        end
+    end
+end
+
+function wake_up(wakeup::Channel{Bool})
+    # one pending wakeup is enough as a scan handles all runs queued until then
+    if !isready(wakeup)
+        put!(wakeup, true)
+    end
+end
+
+function listen_for_dispatch(wakeup::Channel{Bool})
+    # the API connects to this socket when it queued a run, so it is dispatched right away
+    # instead of after the next poll
+    if ispath(DISPATCH_SOCKET_PATH)
+        rm(DISPATCH_SOCKET_PATH)
+    end
+    server = listen(DISPATCH_SOCKET_PATH)
+    @info "Listening for dispatch notifications on $(DISPATCH_SOCKET_PATH)"
+    while true
+        connection = accept(server)
+        close(connection)
+        wake_up(wakeup)
+    end
+end
+
+function poll(wakeup::Channel{Bool})
+    # fallback for notifications that were missed, e.g. when the scanner was restarted.
+    # this also serves as heartbeat for the health check
+    while true
+        write_heartbeat()
+        wake_up(wakeup)
+        sleep(POLL_INTERVAL_SECONDS)
+    end
+end
+
+function scan_loop()
+    @info "Starting scanner with $(Threads.nthreads()) threads and on #$(Threads.threadid())"
+    @info "Running at most $(MAX_CONCURRENT_RUNS) simulations concurrently"
+    registry = RunRegistry()
+    if !isfile(REGISTRY_PATH)
+        bootstrap_registry()
+    end
+
+    @info "Warming up simulation code"
+    warm_up()
+
+    wakeup = Channel{Bool}(1)
+    errormonitor(@async listen_for_dispatch(wakeup))
+    errormonitor(@async poll(wakeup))
+    # workers are spawned in the default threadpool, so the scanner tasks on the
+    # interactive thread stay responsive while simulations are running
+    workers = [errormonitor(Threads.@spawn work(registry)) for _ in 1:MAX_CONCURRENT_RUNS]
+
+    while !all(istaskdone, workers)
+        take!(wakeup)
+        try
+            read_registry!(registry)
         catch e
             @warn "Error during scanning: $e"
         end
-        sleep(1)
     end
+    @info "Exiting scanner for recycling after $(NR_PROCESSED[]) runs"
 end
 
 scan_loop()
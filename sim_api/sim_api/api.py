@@ -6,16 +6,34 @@ Endpoints:
 
 from __future__ import annotations
 
+import io
+import json
+import time
 import uuid
+import requests
 import yaml
 from pathlib import Path
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file
 from sim_api.util import create_run_dir, get_run_status, run_dir_exists, \
     validate_run_id, validate_uploaded_filename, save_file_for_run, load_file_index, \
-    alias_config_file, update_run_status, parse_key_from_auth_header
+    alias_config_file, update_run_status, parse_key_from_auth_header, notify_scanner, \
+    get_queue_position, get_scanner_health, save_files_for_run, blob_exists, \
+    add_files_to_run, get_file_hashes, store_blob, build_sweep_variants, apply_overrides, \
+    update_runs_status, write_sweep, load_sweep, get_status_mtime, start_from_result_cache, \
+    get_result_cache_info, get_run_timeline, get_run_profile, \
+    is_allowed_transfer_url, import_files_from_urls, export_files_to_urls, \
+    create_upload_session, get_upload_session, write_upload_chunk, finalize_upload_session, \
+    validate_file_hash, get_artifacts, stream_artifacts_zip, set_file_index_cache_size
+from sim_api.retention import read_disk_usage, ARTIFACTS_ARCHIVE_NAME
+from sim_api.metrics import init_metrics, REGISTRY, DURATIONS_LOG
+from sim_api.compression import init_compression
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 APP_ROOT = Path(__file__).resolve().parent.parent
 APP_CONFIG_PATH = APP_ROOT / "api_config.yml"
+STATUS_EVENTS_INTERVAL = 0.5   # seconds between checks for status changes
+STATUS_EVENTS_KEEPALIVE = 15   # seconds between keepalive comments without changes
+FINAL_STATUS_CODES = ("finished", "old")
 
 def api_key_required(function):
     """Decorator for routes that require an API key."""
@@ -48,6 +66,14 @@ with open(APP_CONFIG_PATH, 'r', encoding="utf-8") as config_file:
     for key in app_config:
         app.config[key] = app_config[key]
 
+set_file_index_cache_size(app.config.get("FILE_INDEX_CACHE_SIZE", 1000))
+
+# record metrics of every request
+init_metrics(app)
+
+# decompress gzip encoded requests and compress responses the client accepts compressed
+init_compression(app)
+
 def get_app():
     """Get the global app variable."""
     return app
@@ -72,6 +98,101 @@ def get_run_id():
     create_run_dir(run_id)
     return jsonify({"run_id": run_id}), 200
 
+@app.route("/health", methods=["GET"])
+@api_key_required
+def health():
+    """Endpoint: GET /health
+
+    Request body: None
+
+    Response (JSON):
+        {
+            "scanner": {
+                "healthy": true,                       # if the heartbeat is recent
+                "heartbeat": "2015-01-01T12:00:00.0",  # server time of the last heartbeat
+                "runs_processed": 12,                  # runs since the scanner started
+                "started": "2015-01-01T11:00:00.0"     # server time of the scanner start
+            }
+        }
+
+    The status code is 503 if the scanner is not healthy.
+    """
+    scanner_health = get_scanner_health()
+    return jsonify({"scanner": scanner_health}), 200 if scanner_health["healthy"] else 503
+
+@app.route("/metrics", methods=["GET"])
+@api_key_required
+def metrics():
+    """Endpoint: GET /metrics
+
+    Request body: None
+
+    Response (text): The metrics in the Prometheus text format, which are:
+        - sim_api_request_duration_seconds: histogram of the response time by endpoint,
+            method and status code
+        - sim_api_request_bytes_total and sim_api_response_bytes_total: bytes received and
+            sent by endpoint
+        - sim_api_runs: number of runs by status
+        - sim_api_queue_depth: number of runs waiting for the scanner
+        - sim_api_run_waiting_seconds: histogram of the time runs waited in the queue
+        - sim_api_run_simulation_seconds: histogram of the simulation wall time by outcome
+    """
+    DURATIONS_LOG.read()
+    return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST), 200
+
+@app.route("/disk_usage", methods=["GET"])
+@api_key_required
+def disk_usage():
+    """Endpoint: GET /disk_usage
+
+    Request body: None
+
+    Response (JSON):
+        {
+            "timestamp": "2015-01-01 12:00:00.0", # server time of the calculation, which
+                                                  # happens after each retention pass
+            "blobs": {"files": 12, "bytes": 123456},
+            "result_cache": {"files": 3, "bytes": 1234},
+            "runs": {                             # runs per status code. files linked
+                "finished": {                     # from the blob store are counted there
+                    "runs": 4,
+                    "files": 8,
+                    "bytes": 12345
+                }
+            },
+            "disk": {"total": 1000000, "used": 500000, "free": 500000}
+        }
+
+    The status code is 503 if no retention pass has happened yet.
+    """
+    usage = read_disk_usage()
+    if usage is None:
+        return jsonify({"error": "Disk usage has not been calculated yet"}), 503
+    return jsonify(usage), 200
+
+def result_cache_enabled() -> bool:
+    """Checks if results of simulations are cached, which is configured by a positive
+    `RESULT_CACHE_MAX_SIZE`. The retention evicts the cache down to this size."""
+    return app.config.get("RESULT_CACHE_MAX_SIZE", 0) > 0
+
+def status_payload(run_id: str) -> tuple[dict,int]:
+    """Builds the response payload and HTTP status code for the status of the given run."""
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return {"error": "Run ID is not valid or run is not set up correctly"}, 500
+
+    status_code, status_ts = get_run_status(run_id)
+    if status_code == "unknown":
+        return {"error": "Could not read run status"}, 500
+
+    result_cache_info = get_result_cache_info(run_id)
+    return {
+        "run_id": run_id,
+        "code": status_code,
+        "timestamp": status_ts,
+        "queue_position": get_queue_position(run_id) if status_code == "waiting" else None,
+        "cache_hit": result_cache_info is not None and result_cache_info.get("hit", False)
+    }, 200
+
 @app.route('/run_status/<run_id>', methods=['GET'])
 @api_key_required
 def run_status(run_id):
@@ -86,23 +207,145 @@ def run_status(run_id):
             "code": "new",                                # status code, one of:
                                                           # [new, waiting, running,
                                                           # finished, old]
-            "timestamp": "2015-01-01 12:00:00"            # server time (default UTC), when
+            "timestamp": "2015-01-01 12:00:00",           # server time (default UTC), when
                                                           # the status was written
+            "queue_position": 3                           # position in the queue of
+                                                          # waiting runs, starting at 1,
+                                                          # or null if not queued (yet)
+            "cache_hit": false                            # if the results were taken from
+                                                          # the result cache
+        }
+    """
+    payload, http_code = status_payload(run_id)
+    return jsonify(payload), http_code
+
+@app.route('/run_profile/<run_id>', methods=['GET'])
+@api_key_required
+def run_profile(run_id):
+    """Endpoint: GET /run_profile/<str:run_id>
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the profile is requested
+
+    Response (JSON):
+        {
+            "run_id": "1a2b3c4e5f1a2b3c4e5f1a2b3c4e5f1a",
+            "timeline": [                               # status changes in order
+                {
+                    "status": "waiting",
+                    "timestamp": "2015-01-01 12:00:00", # server time of the change
+                    "duration": 12.5                    # seconds until the next change,
+                },                                      # null for the latest one
+                ...
+            ],
+            "profile": {                    # recorded by the scanner, null if the run was
+                "wall_seconds": 81.2,       # not simulated (yet)
+                "cpu_seconds": 80.9,        # CPU time of the simulating thread
+                "gc_seconds": 0.4,
+                "allocated_bytes": 1234567,
+                "max_rss_bytes": 2345678,   # peak RSS of the scanner process so far
+                "output_bytes": 345678,     # size of the files created by the simulation
+                "success": true
+            }
         }
     """
     if not (validate_run_id(run_id) and run_dir_exists(run_id)):
         return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
 
-    status_code, status_ts = get_run_status(run_id)
-    if status_code == "unknown":
-        return jsonify({"error": "Could not read run status"}), 500
-
-    status_payload = {
+    return jsonify({
         "run_id": run_id,
-        "code": status_code,
-        "timestamp": status_ts
-    }
-    return jsonify(status_payload), 200
+        "timeline": get_run_timeline(run_id),
+        "profile": get_run_profile(run_id)
+    }), 200
+
+@app.route('/run_status', methods=['POST'])
+@api_key_required
+def bulk_run_status():
+    """Endpoint: POST /run_status
+
+    Request body (JSON):
+        {
+            "run_ids": ["..."] # the IDs of the runs to which the status is requested
+        }
+
+    Response (JSON):
+        {
+            "runs": [ # in the order of the given IDs, each the same as for endpoint
+                      # run_status or an object with the run ID and an error
+                {
+                    "run_id": "1a2b3c4e5f1a2b3c4e5f1a2b3c4e5f1a",
+                    "code": "new",
+                    "timestamp": "2015-01-01 12:00:00",
+                    "queue_position": null
+                }
+            ]
+        }
+    """
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return jsonify({"error": "Expected JSON payload."}), 400
+
+    if not isinstance(request_data.get("run_ids"), list):
+        return jsonify({"error": "Missing JSON argument `run_ids`"}), 400
+
+    runs = []
+    for run_id in request_data["run_ids"]:
+        payload, http_code = status_payload(run_id)
+        if http_code != 200:
+            payload = {"run_id": run_id, **payload}
+        runs.append(payload)
+    return jsonify({"runs": runs}), 200
+
+@app.route('/run_status/<run_id>/events', methods=['GET'])
+@api_key_required
+def run_status_events(run_id):
+    """Endpoint: GET /run_status/<str:run_id>/events
+
+    Streams the status of the run as server-sent events. An event is sent immediately and
+    then whenever the status changes. The stream ends when the run reached a final status
+    or after the configured `STATUS_EVENTS_TIMEOUT` (default 60 seconds), after which
+    clients are expected to reconnect or poll. Each open stream holds a worker thread of
+    the server until it ends, so the timeout bounds how long a watching client occupies it.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the status is requested
+
+    Response (text/event-stream): Events of type `status` with data as in the response of
+    endpoint run_status, for example:
+        event: status
+        data: {"run_id": "...", "code": "waiting", "timestamp": "...", "queue_position": 2}
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    timeout = app.config.get("STATUS_EVENTS_TIMEOUT", 60)
+
+    def events():
+        deadline = time.monotonic() + timeout
+        last_sent = time.monotonic()
+        last_mtime = None
+        last_payload = None
+        while time.monotonic() < deadline:
+            # checking the modification time is much cheaper than reading the status.
+            # waiting runs are checked anyway as their queue position may change
+            mtime = get_status_mtime(run_id)
+            if mtime != last_mtime or (last_payload or {}).get("code") == "waiting":
+                last_mtime = mtime
+                payload, _http_code = status_payload(run_id)
+                if payload != last_payload:
+                    last_payload = payload
+                    last_sent = time.monotonic()
+                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+                if payload.get("code") in FINAL_STATUS_CODES:
+                    return
+            if time.monotonic() - last_sent > STATUS_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            time.sleep(STATUS_EVENTS_INTERVAL)
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache"
+    })
 
 @app.route("/upload_file/<run_id>", methods=["POST"])
 @api_key_required
@@ -139,24 +382,232 @@ def upload_file(run_id):
     save_file_for_run(run_id, file)
     return jsonify({"message": "File uploaded successfully"}), 200
 
-@app.route("/download_file/<run_id>", methods=["POST"])
+@app.route("/upload_files/<run_id>", methods=["POST"])
 @api_key_required
-def download_file(run_id):
-    """Endpoint: POST /download_file/<str:run_id>
+def upload_files(run_id):
+    """Endpoint: POST /upload_files/<str:run_id>
+
+    Uploads any number of files in one request and updates the file index once. Either all
+    files are saved or, if any filename is not valid, none of them.
 
     Request arguments:
-        - run_id -> str: The ID of the run of which the file is requested
+        - run_id -> str: The ID of the run to which the files are uploaded
+
+    Request body (form-data):
+        - files: The files to upload, given as multiple parts with the same name
+
+    Response (JSON):
+        {
+            "message": "Files uploaded successfully",
+            "filenames": ["..."] # the names of the uploaded files
+        }
+
+    Error Response (JSON) example:
+        {
+            "error": "No files part in the request"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    files = request.files.getlist("files")
+    if len(files) == 0:
+        return jsonify({"error": "No files part in the request"}), 400
+
+    for file in files:
+        is_valid, msg = validate_uploaded_filename(file.filename)
+        if not is_valid:
+            return jsonify({"error": f"Filename of uploaded file `{file.filename}` is not " +
+                            f"valid: {msg}"}), 400
+
+    save_files_for_run(run_id, files)
+    return jsonify({
+        "message": "Files uploaded successfully",
+        "filenames": [file.filename for file in files]
+    }), 200
+
+@app.route("/upload_sessions/<run_id>", methods=["POST"])
+@api_key_required
+def start_upload_session(run_id):
+    """Endpoint: POST /upload_sessions/<str:run_id>
+
+    Starts a chunked upload of a file, which is too large for a single request. The chunks
+    are sent to endpoint upload_sessions/<run_id>/<upload_id> via PUT, in any order and in
+    parallel, and the upload is completed with endpoint finalize. An interrupted upload is
+    resumed by sending the missing ranges reported by the session status.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the file is uploaded
 
     Request body (JSON):
         {
-            "filename": "..." # The name of the file to download
+            "filename": "profile.csv", # the name of the file
+            "size": 4294967296          # the size of the file in bytes
+        }
+
+    Response (JSON):
+        {
+            "upload_id": "...",       # ID of the upload session
+            "chunk_size": 8388608     # recommended size of the chunks in bytes
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return jsonify({"error": "Expected JSON payload."}), 400
+
+    filename = request_data.get("filename")
+    is_valid, msg = validate_uploaded_filename(filename)
+    if not is_valid:
+        return jsonify({"error": f"Filename of uploaded file is not valid: {msg}"}), 400
+
+    size = request_data.get("size")
+    max_size = app.config.get("MAX_UPLOAD_SIZE", 100 * 1024**3)
+    if not isinstance(size, int) or size < 0 or size > max_size:
+        return jsonify({"error": f"Argument `size` must be an integer up to {max_size}"}), 400
+
+    upload_id = create_upload_session(run_id, filename, size)
+    return jsonify({
+        "upload_id": upload_id,
+        "chunk_size": app.config.get("UPLOAD_CHUNK_SIZE", 8 * 1024**2)
+    }), 200
+
+@app.route("/upload_sessions/<run_id>/<upload_id>", methods=["GET", "PUT"])
+@api_key_required
+def upload_session(run_id, upload_id):
+    """Endpoint: GET|PUT /upload_sessions/<str:run_id>/<str:upload_id>
+
+    GET returns the status of the upload session. PUT writes a chunk of the file.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the file is uploaded
+        - upload_id -> str: The ID of the upload session
+        - offset -> int: (PUT, query) The offset of the chunk in the file
+
+    Request body (PUT): The content of the chunk as application/octet-stream
+
+    Response (JSON):
+        {
+            "filename": "profile.csv",
+            "size": 4294967296,
+            "received": 4286578688,       # number of bytes received so far
+            "missing": [[0, 8388608]]     # ranges of start (inclusive) and end (exclusive)
+        }                                 # offsets that were not received yet
+    """
+    if not (validate_run_id(run_id) and validate_run_id(upload_id)):
+        return jsonify({"error": "Run ID or upload ID is not valid"}), 400
+    if get_upload_session(run_id, upload_id) is None:
+        return jsonify({"error": "Upload session does not exist"}), 404
+
+    if request.method == "PUT":
+        offset = request.args.get("offset", type=int)
+        if offset is None or offset < 0:
+            return jsonify({"error": "Missing or invalid argument `offset`"}), 400
+        try:
+            # chunks without Content-Length, e.g. compressed ones, are read into memory
+            # before they are written, at most the chunk size announced to the client
+            write_upload_chunk(
+                run_id, upload_id, offset, request.stream, request.content_length,
+                app.config.get("UPLOAD_CHUNK_SIZE", 8 * 1024**2)
+            )
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+
+    return jsonify(get_upload_session(run_id, upload_id)), 200
+
+@app.route("/upload_sessions/<run_id>/<upload_id>/finalize", methods=["POST"])
+@api_key_required
+def finalize_upload(run_id, upload_id):
+    """Endpoint: POST /upload_sessions/<str:run_id>/<str:upload_id>/finalize
+
+    Completes the upload session once all chunks were received. The file is added to the
+    run only if its SHA-256 hash matches the given one.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the file is uploaded
+        - upload_id -> str: The ID of the upload session
+
+    Request body (JSON):
+        {
+            "sha256": "..." # hex digest of the SHA-256 hash of the whole file
+        }
+
+    Response (JSON):
+        {
+            "message": "File uploaded successfully"
+        }
+    """
+    if not (validate_run_id(run_id) and validate_run_id(upload_id)):
+        return jsonify({"error": "Run ID or upload ID is not valid"}), 400
+    if get_upload_session(run_id, upload_id) is None:
+        return jsonify({"error": "Upload session does not exist"}), 404
+
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None or not validate_file_hash(request_data.get("sha256")):
+        return jsonify({"error": "Missing or invalid JSON argument `sha256`"}), 400
+
+    success, msg = finalize_upload_session(run_id, upload_id, request_data["sha256"])
+    if not success:
+        return jsonify({"error": msg}), 409
+    return jsonify({"message": "File uploaded successfully"}), 200
+
+@app.route("/known_hashes", methods=["POST"])
+@api_key_required
+def known_hashes():
+    """Endpoint: POST /known_hashes
+
+    Checks which files are already stored by the API, identified by the SHA-256 hash of
+    their content. Known files can be added to runs with endpoint link_files instead of
+    uploading them again.
+
+    Request body (JSON):
+        {
+            "hashes": ["..."] # SHA-256 hex digests of the files
+        }
+
+    Response (JSON):
+        {
+            "known": ["..."] # the given hashes of files that are stored
         }
+    """
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return jsonify({"error": "Expected JSON payload."}), 400
+
+    if not isinstance(request_data.get("hashes"), list):
+        return jsonify({"error": "Missing JSON argument `hashes`"}), 400
 
-    Response (Bytestream): The file content
+    return jsonify({
+        "known": [file_hash for file_hash in request_data["hashes"] if blob_exists(file_hash)]
+    }), 200
+
+@app.route("/link_files/<run_id>", methods=["POST"])
+@api_key_required
+def link_files(run_id):
+    """Endpoint: POST /link_files/<str:run_id>
+
+    Adds already stored files to a run without uploading them again.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the files are added
+
+    Request body (JSON):
+        {
+            "files": {
+                "weather.csv": "..." # maps filenames to the SHA-256 hash of the content
+            }
+        }
+
+    Response (JSON):
+        {
+            "message": "Files linked successfully"
+        }
 
     Error Response (JSON) example:
         {
-            "error": "No such file exists"
+            "error": "Unknown hash for file `weather.csv`"
         }
     """
     if not (validate_run_id(run_id) and run_dir_exists(run_id)):
@@ -166,8 +617,195 @@ def download_file(run_id):
     if request_data is None:
         return jsonify({"error": "Expected JSON payload."}), 400
 
+    files = request_data.get("files")
+    if not isinstance(files, dict) or len(files) == 0:
+        return jsonify({"error": "Missing JSON argument `files`"}), 400
+
+    for filename, file_hash in files.items():
+        is_valid, msg = validate_uploaded_filename(filename)
+        if not is_valid:
+            return jsonify({"error": f"Filename `{filename}` is not valid: {msg}"}), 400
+        if not blob_exists(file_hash):
+            return jsonify({"error": f"Unknown hash for file `{filename}`"}), 400
+
+    # the retention may have collected a blob since it was reported as known, in which
+    # case the client uploads the file instead
+    try:
+        add_files_to_run(run_id, files)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    return jsonify({"message": "Files linked successfully"}), 200
+
+def parse_transfer_request() -> tuple[dict|None,str]:
+    """Parses and checks the JSON payload of endpoints import_from_nextcloud and
+    export_to_nextcloud.
+
+    Returns:
+    -`dict|None`: The payload or None if it is not valid
+    -`str`: The error message if the payload is not valid
+    """
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return None, "Expected JSON payload."
+    if not isinstance(request_data.get("token"), str) or request_data["token"] == "":
+        return None, "Missing JSON argument `token`"
+    files = request_data.get("files")
+    if not (
+        isinstance(files, dict) and len(files) > 0
+        and all(isinstance(url, str) for url in files.values())
+    ):
+        return None, "Argument `files` must map filenames to URLs"
+    return request_data, ""
+
+@app.route("/import_from_nextcloud/<run_id>", methods=["POST"])
+@api_key_required
+def import_from_nextcloud(run_id):
+    """Endpoint: POST /import_from_nextcloud/<str:run_id>
+
+    Downloads files from NextCloud into the run on behalf of a user, so the files do not
+    pass through the webapp. The URLs must start with one of the base URLs in config
+    option `NEXTCLOUD_TRANSFER_BASE_URLS`. Either all files are added or none of them.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the files are added
+
+    Request body (JSON):
+        {
+            "token": "...",  # short-lived access token of the user, which is only used
+                             # for this request and not stored
+            "files": {       # maps filenames to the WebDAV URLs of the files
+                "config.json": "https://nc.example.com/remote.php/dav/files/user/config.json"
+            }
+        }
+
+    Response (JSON):
+        {
+            "message": "Files imported successfully",
+            "filenames": ["config.json"]
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    request_data, msg = parse_transfer_request()
+    if request_data is None:
+        return jsonify({"error": msg}), 400
+
+    for filename, url in request_data["files"].items():
+        is_valid, msg = validate_uploaded_filename(filename)
+        if not is_valid:
+            return jsonify({"error": f"Filename `{filename}` is not valid: {msg}"}), 400
+        if not is_allowed_transfer_url(url, app.config.get("NEXTCLOUD_TRANSFER_BASE_URLS")):
+            return jsonify({"error": f"Transfers from URL of `{filename}` are not allowed"}), 403
+
+    try:
+        import_files_from_urls(
+            run_id, request_data["files"], request_data["token"],
+            app.config.get("NEXTCLOUD_TRANSFER_TIMEOUT", 30)
+        )
+    except requests.RequestException as error:
+        return jsonify({"error": f"Could not download files from NextCloud: {error}"}), 502
+
+    return jsonify({
+        "message": "Files imported successfully",
+        "filenames": list(request_data["files"].keys())
+    }), 200
+
+@app.route("/export_to_nextcloud/<run_id>", methods=["POST"])
+@api_key_required
+def export_to_nextcloud(run_id):
+    """Endpoint: POST /export_to_nextcloud/<str:run_id>
+
+    Uploads files of the run to NextCloud on behalf of a user, so the files do not pass
+    through the webapp. The URLs must start with one of the base URLs in config option
+    `NEXTCLOUD_TRANSFER_BASE_URLS`.
+
+    Request arguments:
+        - run_id -> str: The ID of the run from which the files are uploaded
+
+    Request body (JSON):
+        {
+            "token": "...",  # short-lived access token of the user, which is only used
+                             # for this request and not stored
+            "files": {       # maps filenames in the file index to the target WebDAV URLs
+                "julia_set.png": "https://nc.example.com/remote.php/dav/files/user/julia_set.png"
+            }
+        }
+
+    Response (JSON):
+        {
+            "message": "Files exported successfully",
+            "filenames": ["julia_set.png"]
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    request_data, msg = parse_transfer_request()
+    if request_data is None:
+        return jsonify({"error": msg}), 400
+
+    file_index = load_file_index(run_id)
+    for filename, url in request_data["files"].items():
+        if filename not in file_index["forward"]:
+            return jsonify({"error": f"Cannot find `{filename}` in file index"}), 400
+        if not is_allowed_transfer_url(url, app.config.get("NEXTCLOUD_TRANSFER_BASE_URLS")):
+            return jsonify({"error": f"Transfers to URL of `{filename}` are not allowed"}), 403
+
+    try:
+        export_files_to_urls(
+            run_id, request_data["files"], request_data["token"],
+            app.config.get("NEXTCLOUD_TRANSFER_TIMEOUT", 30),
+            app.config.get("NEXTCLOUD_TRANSFER_WORKERS", 4)
+        )
+    except (OSError, requests.RequestException) as error:
+        return jsonify({"error": f"Could not upload files to NextCloud: {error}"}), 502
+
+    return jsonify({
+        "message": "Files exported successfully",
+        "filenames": list(request_data["files"].keys())
+    }), 200
+
+@app.route("/download_file/<run_id>", methods=["GET", "POST"])
+@api_key_required
+def download_file(run_id):
+    """Endpoint: GET|POST /download_file/<str:run_id>
+
+    The file is streamed from disk in chunks instead of being read into memory. The
+    response carries `Content-Length`, `ETag` and `Last-Modified` headers, so clients can
+    skip re-downloads with `If-None-Match`. For GET requests, HTTP `Range` requests are
+    honoured, which allows resuming interrupted downloads.
+
+    Request arguments:
+        - run_id -> str: The ID of the run of which the file is requested
+
+    Request arguments (query, GET only):
+        - filename -> str: The name of the file to download
+
+    Request body (JSON, POST only):
+        {
+            "filename": "..." # The name of the file to download
+        }
+
+    Response (Bytestream): The file content, or a part of it for range requests
+
+    Error Response (JSON) example:
+        {
+            "error": "No such file exists"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    if request.method == "GET":
+        request_data = request.args
+    else:
+        request_data = request.get_json(force=True, silent=True)
+        if request_data is None:
+            return jsonify({"error": "Expected JSON payload."}), 400
+
     if "filename" not in request_data:
-        return jsonify({"error": "Missing JSON argument `filename`"}), 400
+        return jsonify({"error": "Missing argument `filename`"}), 400
 
     filename = request_data['filename']
     file_index = load_file_index(run_id)
@@ -177,14 +815,155 @@ def download_file(run_id):
     alias = file_index["forward"][filename]
     alias_path = Path(APP_ROOT / "runs" / run_id / alias)
     if not alias_path.exists():
+        if "compacted" in file_index:
+            return jsonify({"error": "Files of old runs have been removed"}), 410
         return jsonify({"error": "Cannot find alias for given `filename`"}), 400
 
-    with open(alias_path, 'rb') as f:
-        content = f.read()
+    # send_file wraps the file for the WSGI server, which streams it in blocks or uses
+    # sendfile if supported, and makes the response conditional on ETag and Range headers
+    return send_file(
+        alias_path,
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=filename,
+        conditional=True,
+        etag=True
+    )
 
-    response = app.response_class(content, mimetype='application/octet-stream')
-    response.headers.set('Content-Disposition', f'attachment; filename={filename}')
-    return response, 200
+@app.route("/artifacts/<run_id>", methods=["GET"])
+@api_key_required
+def artifacts(run_id):
+    """Endpoint: GET /artifacts/<str:run_id>
+
+    Lists the artifacts the run produced, which are all files in its file index that were
+    not uploaded as inputs. Clients can compare the hashes with files they have already,
+    and fetch the others with a single request to endpoint download_artifacts.
+
+    Request arguments:
+        - run_id -> str: The ID of the run of which the artifacts are requested
+
+    Response (JSON):
+        {
+            "run_id": "1a2b3c4e5f1a2b3c4e5f1a2b3c4e5f1a",
+            "artifacts": [
+                {
+                    "filename": "julia_set.png",
+                    "size": 345678,     # in bytes
+                    "sha256": "..."     # hex digest of the content
+                },
+                ...
+            ],
+            "total_size": 345678
+        }
+
+    Error Response (JSON) example:
+        {
+            "error": "Run has not finished yet"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    status_code, _ = get_run_status(run_id)
+    if status_code == "old":
+        return jsonify({"error": "Files of old runs have been removed"}), 410
+    if status_code != "finished":
+        return jsonify({"error": "Run has not finished yet"}), 409
+
+    run_artifacts = get_artifacts(run_id)
+    return jsonify({
+        "run_id": run_id,
+        "artifacts": run_artifacts,
+        "total_size": sum(artifact["size"] for artifact in run_artifacts)
+    }), 200
+
+@app.route("/download_artifacts/<run_id>", methods=["POST"])
+@api_key_required
+def download_artifacts(run_id):
+    """Endpoint: POST /download_artifacts/<str:run_id>
+
+    Streams the selected artifacts of the run as one zip archive, which is built while it
+    is sent. Files that compress well are deflated, others like PNG images are stored.
+
+    Request arguments:
+        - run_id -> str: The ID of the run of which the artifacts are requested
+
+    Request body (JSON):
+        {
+            "filenames": ["julia_set.png"] # (Optional) The artifacts to include, all
+                                           # artifacts if not given
+        }
+
+    Response (Bytestream): The zip archive with the artifacts under their filenames
+
+    Error Response (JSON) example:
+        {
+            "error": "Cannot find artifact `foo.csv`"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        request_data = {}
+    if not isinstance(request_data, dict):
+        return jsonify({"error": "Expected JSON payload."}), 400
+
+    status_code, _ = get_run_status(run_id)
+    if status_code == "old":
+        return jsonify({"error": "Files of old runs have been removed"}), 410
+    if status_code != "finished":
+        return jsonify({"error": "Run has not finished yet"}), 409
+
+    available = [artifact["filename"] for artifact in get_artifacts(run_id)]
+    filenames = request_data.get("filenames", available)
+    if not (isinstance(filenames, list) and all(isinstance(f, str) for f in filenames)):
+        return jsonify({"error": "Argument `filenames` must be a list of strings"}), 400
+    for filename in filenames:
+        if filename not in available:
+            return jsonify({"error": f"Cannot find artifact `{filename}`"}), 400
+
+    return Response(
+        stream_artifacts_zip(run_id, list(dict.fromkeys(filenames))),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={run_id}.zip"}
+    )
+
+@app.route("/download_archive/<run_id>", methods=["GET"])
+@api_key_required
+def download_archive(run_id):
+    """Endpoint: GET /download_archive/<str:run_id>
+
+    Downloads the archive into which the retention compressed the artifacts of an old run,
+    if config option `RETENTION_OLD_RUN_ACTION` is `compress`. The inputs of the run are
+    not part of it.
+
+    Request arguments:
+        - run_id -> str: The ID of the old run
+
+    Response (Bytestream): The gzipped tar archive with the artifacts under their filenames
+
+    Error Response (JSON) example:
+        {
+            "error": "Run has no archive of its artifacts"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    archive_path = Path(APP_ROOT / "runs" / run_id / ARTIFACTS_ARCHIVE_NAME)
+    if not archive_path.exists():
+        return jsonify({"error": "Run has no archive of its artifacts"}), 404
+
+    return send_file(
+        archive_path,
+        mimetype="application/gzip",
+        as_attachment=True,
+        download_name=f"{run_id}.tar.gz",
+        conditional=True,
+        etag=True
+    )
 
 @app.route("/start_simulation/<run_id>", methods=["POST"])
 @api_key_required
@@ -199,9 +978,13 @@ def simulate(run_id):
             "config_file": "resie_input.json" # the filename of the config file
         }
 
+    If a run with the same config and input files was simulated before, its results are
+    taken from the result cache and the run is finished immediately.
+
     Response (JSON):
         {
-            "message": "Queued run for simulation"
+            "message": "Queued run for simulation",
+            "cache_hit": false # if the results were taken from the result cache
         }
 
     Error Response (JSON) example:
@@ -234,5 +1017,169 @@ def simulate(run_id):
         return jsonify({"error": f"Could not load config_file: {msg}"}), 400
     _aliased_path = msg # it's only a message in the error case, otherwise a filepath
 
+    if result_cache_enabled():
+        if start_from_result_cache(run_id, alias):
+            update_run_status(run_id, "finished")
+            return jsonify({"message": "Finished run from cached results", "cache_hit": True}), 200
+
     update_run_status(run_id, "waiting")
-    return jsonify({"message": "Queued run for simulation"}), 200
+    notify_scanner()
+    return jsonify({"message": "Queued run for simulation", "cache_hit": False}), 200
+
+@app.route("/start_sweep/<run_id>", methods=["POST"])
+@api_key_required
+def start_sweep(run_id):
+    """Endpoint: POST /start_sweep/<run_id>
+
+    Starts a parameter sweep based on a run to which the input files have been uploaded.
+    For each variant of the config file a run is created, which shares the input files of
+    the base run. All runs are queued at once. The base run itself is not started.
+
+    Request arguments:
+        - run_id -> str: The ID of the base run
+
+    Request body (JSON):
+        {
+            "config_file": "resie_input.json", # the filename of the base config file
+            "parameters": {                    # (optional) every combination of values
+                "c_re": [-0.7, -0.8],          # results in one variant. names can
+                "c_im": [0.1, 0.2]             # address nested values like `a.b.c`
+            },
+            "overrides": [                     # (optional) additional variants
+                {"c_re": -0.744, "c_im": 0.148}
+            ]
+        }
+
+    Response (JSON):
+        {
+            "sweep_id": "...", # ID of the sweep for endpoint sweep_status
+            "run_ids": ["..."] # IDs of the runs in the order of the variants
+        }
+
+    Error Response (JSON) example:
+        {
+            "error": "Sweep has no variants"
+        }
+    """
+    if not (validate_run_id(run_id) and run_dir_exists(run_id)):
+        return jsonify({"error": "Run ID is not valid or run is not set up correctly"}), 500
+
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return jsonify({"error": "Expected JSON payload."}), 400
+
+    if "config_file" not in request_data:
+        return jsonify({"error": "Missing JSON argument `config_file`"}), 400
+
+    parameters = request_data.get("parameters")
+    overrides = request_data.get("overrides")
+    if parameters is not None and not (
+        isinstance(parameters, dict)
+        and all(isinstance(values, list) for values in parameters.values())
+    ):
+        return jsonify({"error": "Argument `parameters` must map names to lists"}), 400
+    if overrides is not None and not (
+        isinstance(overrides, list)
+        and all(isinstance(override, dict) for override in overrides)
+    ):
+        return jsonify({"error": "Argument `overrides` must be a list of objects"}), 400
+
+    variants = build_sweep_variants(parameters, overrides)
+    if len(variants) == 0:
+        return jsonify({"error": "Sweep has no variants"}), 400
+    max_sweep_size = app.config.get("MAX_SWEEP_SIZE", 1000)
+    if len(variants) > max_sweep_size:
+        return jsonify({"error": f"Sweep has more than {max_sweep_size} variants"}), 400
+
+    config_filename = str(request_data["config_file"])
+    file_index = load_file_index(run_id)
+    if config_filename not in file_index["forward"]:
+        return jsonify({"error": "Cannot find given `config_file` in file index"}), 400
+
+    config_path = Path(APP_ROOT / "runs" / run_id / file_index["forward"][config_filename])
+    try:
+        with open(config_path, "r", encoding="utf-8") as file:
+            base_config = json.load(file)
+    except json.JSONDecodeError as error:
+        return jsonify({"error": f"Config file is not valid JSON: {error}"}), 400
+    if not isinstance(base_config, dict):
+        return jsonify({"error": "Config file must contain a JSON object"}), 400
+
+    # set up all runs before queueing any of them
+    file_hashes = get_file_hashes(run_id)
+    run_ids = []
+    cached_run_ids = []
+    for variant in variants:
+        child_run_id = uuid.uuid4().hex
+        create_run_dir(child_run_id)
+        config = apply_overrides(base_config, variant)
+        config_hash = store_blob(io.BytesIO(json.dumps(config).encode("utf-8")))
+        try:
+            aliases = add_files_to_run(
+                child_run_id, {**file_hashes, config_filename: config_hash}
+            )
+        except ValueError as error:
+            return jsonify({"error": f"Could not add files of base run: {error}"}), 409
+        success, msg = alias_config_file(child_run_id, aliases[config_filename])
+        if not success:
+            return jsonify({"error": f"Could not load config_file: {msg}"}), 400
+        if result_cache_enabled() and start_from_result_cache(
+            child_run_id, aliases[config_filename]
+        ):
+            cached_run_ids.append(child_run_id)
+        run_ids.append(child_run_id)
+
+    sweep_id = uuid.uuid4().hex
+    write_sweep(sweep_id, {
+        "base_run_id": run_id,
+        "config_file": config_filename,
+        "run_ids": run_ids,
+        "variants": variants
+    })
+
+    if len(cached_run_ids) > 0:
+        update_runs_status(cached_run_ids, "finished")
+    queued_run_ids = [child_run_id for child_run_id in run_ids
+                      if child_run_id not in cached_run_ids]
+    if len(queued_run_ids) > 0:
+        update_runs_status(queued_run_ids, "waiting")
+        notify_scanner()
+    return jsonify({"sweep_id": sweep_id, "run_ids": run_ids}), 200
+
+@app.route("/sweep_status/<sweep_id>", methods=["GET"])
+@api_key_required
+def sweep_status(sweep_id):
+    """Endpoint: GET /sweep_status/<sweep_id>
+
+    Request arguments:
+        - sweep_id -> str: The ID of the sweep
+
+    Response (JSON):
+        {
+            "sweep_id": "...",
+            "counts": {           # number of runs per status code
+                "waiting": 10,
+                "running": 2,
+                "finished": 4
+            },
+            "runs": [             # status of each run in the order of the variants
+                {
+                    "run_id": "...",
+                    "code": "finished",
+                    "variant": {"c_re": -0.7, "c_im": 0.1}
+                }
+            ]
+        }
+    """
+    sweep = load_sweep(sweep_id) if validate_run_id(sweep_id) else None
+    if sweep is None:
+        return jsonify({"error": "Sweep ID is not valid"}), 404
+
+    counts = {}
+    runs = []
+    for child_run_id, variant in zip(sweep["run_ids"], sweep["variants"]):
+        status_code, _status_ts = get_run_status(child_run_id)
+        counts[status_code] = counts.get(status_code, 0) + 1
+        runs.append({"run_id": child_run_id, "code": status_code, "variant": variant})
+
+    return jsonify({"sweep_id": sweep_id, "counts": counts, "runs": runs}), 200
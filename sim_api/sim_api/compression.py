@@ -0,0 +1,202 @@
+"""Compression of request and response bodies with gzip.
+
+Request bodies with `Content-Encoding: gzip` are decompressed by a WSGI middleware while
+they are read, so routes see the plain content and uploaded files are stored decompressed.
+The size of the decompressed body is limited by `MAX_CONTENT_LENGTH` like any other body.
+
+Responses are compressed if the client accepts gzip, the body is at least
+`COMPRESSION_MIN_SIZE` bytes and of a type that compresses well, e.g. JSON or CSV. Already
+compressed types like PNG are sent as they are. Range requests and event streams are never
+compressed, as neither works with a compressed body.
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import zlib
+from typing import Iterable, Iterator
+from flask import Flask, Response, request
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+# gzip format instead of the raw zlib format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+CHUNK_SIZE = 64 * 1024
+
+class GzipRequestStream:
+    """File-like object decompressing a gzip compressed stream while it is read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decompressor = zlib.decompressobj(GZIP_WBITS)
+        self.buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to the given number of decompressed bytes, or all if negative."""
+        while size < 0 or len(self.buffer) < size:
+            if self.decompressor.eof:
+                break
+            # the output per step is limited, so highly compressed input does not blow up
+            # memory at once
+            compressed = self.decompressor.unconsumed_tail
+            if not compressed:
+                compressed = self.stream.read(CHUNK_SIZE)
+                if not compressed:
+                    self.buffer += self.decompressor.flush()
+                    break
+            self.buffer += self.decompressor.decompress(compressed, CHUNK_SIZE)
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        """Reads up to and including the next newline."""
+        line = b""
+        while size < 0 or len(line) < size:
+            char = self.read(1)
+            line += char
+            if char in (b"", b"\n"):
+                break
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+def strip_gzip_etags(environ: dict) -> None:
+    """Removes the suffix of ETags of compressed responses from the conditional headers of
+    the given request, so views compare them with the ETag of the uncompressed content,
+    which they know, and answer with 304 or a range for compressed responses too."""
+    for key in ("HTTP_IF_NONE_MATCH", "HTTP_IF_RANGE"):
+        if key in environ:
+            environ[key] = environ[key].replace('-gzip"', '"')
+
+class GzipRequestMiddleware:
+    """WSGI middleware decompressing request bodies with `Content-Encoding: gzip`. It also
+    strips the suffix of compressed ETags from conditional headers, see `strip_gzip_etags`.
+
+    Other encodings are rejected with status code 415. The length of the decompressed body
+    is unknown, so the input is marked as terminated and read until its end."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        strip_gzip_etags(environ)
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ("", "identity"):
+            return self.wsgi_app(environ, start_response)
+        if encoding != "gzip":
+            start_response("415 Unsupported Media Type", [("Content-Type", "application/json")])
+            return [b'{"error": "Unsupported Content-Encoding, only gzip is supported"}']
+
+        compressed_length = int(environ.get("CONTENT_LENGTH") or 0)
+        environ["wsgi.input"] = GzipRequestStream(
+            LimitedInput(environ["wsgi.input"], compressed_length)
+            if compressed_length > 0 else environ["wsgi.input"]
+        )
+        environ["wsgi.input_terminated"] = True
+        environ.pop("CONTENT_LENGTH", None)
+        environ.pop("HTTP_CONTENT_ENCODING", None)
+        return self.wsgi_app(environ, start_response)
+
+class LimitedInput:
+    """Reads at most the given number of bytes from the given stream, which is the length
+    of the compressed body, so reading never blocks on a kept-alive connection."""
+
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to the given number of bytes, or all remaining if negative."""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size > 0 else b""
+        self.remaining -= len(data)
+        return data
+
+def is_compressible_type(mimetype: str) -> bool:
+    """Checks if content of the given type compresses well. Event streams are text, but
+    must not be compressed as they are sent event by event."""
+    if mimetype == "text/event-stream":
+        return False
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+def is_compressible(response: Response) -> bool:
+    """Checks if the type of the response body compresses well. Files are sent as
+    `application/octet-stream`, so their type is guessed from their filename."""
+    mimetype = response.mimetype or ""
+    if mimetype == "application/octet-stream":
+        filename = response.headers.get("Content-Disposition", "").rpartition("filename=")[2]
+        guessed_type, guessed_encoding = mimetypes.guess_type(filename.strip('"'))
+        if guessed_encoding is not None:
+            return False
+        mimetype = guessed_type or ""
+    return is_compressible_type(mimetype)
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresses the given chunks with gzip while they are iterated."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def compress_response(response: Response, min_size: int) -> Response:
+    """Compresses the body of the given response with gzip if the client accepts it and
+    the body is large enough and compressible."""
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code == 304
+        and "gzip" in request.accept_encodings
+        and is_compressible(response)
+    ):
+        # not modified responses carry the ETag of the response the client would get
+        etag, is_weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag + "-gzip", weak=is_weak)
+        return response
+    if (
+        "gzip" not in request.accept_encodings
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or request.headers.get("Range") is not None
+        or (response.content_length is not None and response.content_length < min_size)
+        or not is_compressible(response)
+    ):
+        return response
+
+    if response.direct_passthrough:
+        chunks = response.response
+        response.direct_passthrough = False
+    else:
+        chunks = response.iter_encoded()
+    response.response = gzip_chunks(chunks)
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers.pop("Content-Length", None)
+    # the compressed body differs from the plain one, so it must not share its ETag. the
+    # suffix is stripped from conditional headers of later requests by `strip_gzip_etags`
+    etag, is_weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(etag + "-gzip", weak=is_weak)
+    return response
+
+def init_compression(app: Flask) -> None:
+    """Registers the decompression of requests and compression of responses with the
+    given app. The minimum size of compressed responses is set by `COMPRESSION_MIN_SIZE`."""
+    app.wsgi_app = GzipRequestMiddleware(app.wsgi_app)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config.get("COMPRESSION_MIN_SIZE", 1024))
@@ -0,0 +1,189 @@
+"""Metrics of the simulation API in the Prometheus text format.
+
+Request metrics are recorded by hooks around every request. Metrics of runs are derived
+when they are scraped: the number of runs per status from the run registry, the queue
+depth from the scanner's queue and the time runs spent waiting and simulating from the
+durations log, to which the scanner appends a line for every processed run. Both logs are
+read incrementally, so a scrape does not read the status of every run.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from flask import Flask, g, request
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from sim_api.util import APP_ROOT, QUEUE_PATH, REGISTRY_PATH, validate_run_id
+
+DURATIONS_PATH = APP_ROOT / "runs" / "durations"
+# simulations take from seconds to hours, while requests should take milliseconds
+RUN_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+REGISTRY = CollectorRegistry()
+
+REQUEST_DURATION = Histogram(
+    "sim_api_request_duration_seconds",
+    "Time until the response of a request was returned, by endpoint",
+    ["endpoint", "method", "status"],
+    registry=REGISTRY,
+)
+REQUEST_BYTES = Counter(
+    "sim_api_request_bytes",
+    "Bytes received in request bodies, e.g. uploaded files, by endpoint",
+    ["endpoint"],
+    registry=REGISTRY,
+)
+RESPONSE_BYTES = Counter(
+    "sim_api_response_bytes",
+    "Bytes sent in response bodies with known length, e.g. downloaded files, by endpoint",
+    ["endpoint"],
+    registry=REGISTRY,
+)
+WAITING_DURATION = Histogram(
+    "sim_api_run_waiting_seconds",
+    "Time runs spent in the queue until a worker started them",
+    buckets=RUN_DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+SIMULATION_DURATION = Histogram(
+    "sim_api_run_simulation_seconds",
+    "Wall time of simulations, by outcome",
+    ["outcome"],
+    buckets=RUN_DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+
+class DurationsLog:
+    """Reader of the durations log written by the scanner.
+
+    Only the part of the log added since the last read is parsed and added to the
+    histograms, so every run is observed once per process."""
+
+    def __init__(self):
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def read(self) -> None:
+        """Reads the new lines of the log and observes their durations."""
+        with self.lock:
+            if not DURATIONS_PATH.exists():
+                return
+            with open(DURATIONS_PATH, "rb") as file:
+                file.seek(self.offset)
+                data = file.read()
+
+            # a line without trailing newline might still be written, so it is read next time
+            last_newline = data.rfind(b"\n")
+            if last_newline < 0:
+                return
+            self.offset += last_newline + 1
+
+            for line in data[:last_newline].decode("utf-8").split("\n"):
+                parts = line.split("\t")
+                if len(parts) < 4:
+                    continue
+                try:
+                    waited, simulated = float(parts[1]), float(parts[2])
+                except ValueError:
+                    continue
+                WAITING_DURATION.observe(waited)
+                SIMULATION_DURATION.labels(
+                    "success" if parts[3].strip() == "true" else "failure"
+                ).observe(simulated)
+
+DURATIONS_LOG = DurationsLog()
+
+class RegistryLog:
+    """Reader of the run registry, which keeps the latest status of each run.
+
+    Like the scanner, only the lines added since the last read are parsed. When the
+    retention replaces the registry with a compacted copy, which it notices by the changed
+    inode, the statuses are read anew from its start, which drops the removed runs."""
+
+    def __init__(self):
+        self.offset = 0
+        self.inode = None
+        self.statuses = {}
+        self.lock = threading.Lock()
+
+    def read(self) -> None:
+        """Reads the new lines of the registry and updates the statuses of their runs."""
+        with self.lock:
+            if not REGISTRY_PATH.exists():
+                self.offset, self.inode, self.statuses = 0, None, {}
+                return
+            with open(REGISTRY_PATH, "rb") as file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode != self.inode:
+                    self.offset, self.inode, self.statuses = 0, inode, {}
+                file.seek(self.offset)
+                data = file.read()
+
+            # a line without trailing newline might still be written, so it is read next time
+            last_newline = data.rfind(b"\n")
+            if last_newline < 0:
+                return
+            self.offset += last_newline + 1
+
+            for line in data[:last_newline].decode("utf-8").split("\n"):
+                parts = line.split("\t")
+                if len(parts) < 2 or not validate_run_id(parts[0]):
+                    continue
+                self.statuses[parts[0]] = parts[1]
+
+    def count_statuses(self) -> dict[str, int]:
+        """Reads the new lines of the registry and counts the runs per status."""
+        self.read()
+        counts = {}
+        with self.lock:
+            for status in self.statuses.values():
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+REGISTRY_LOG = RegistryLog()
+
+class RunsCollector:
+    """Collector for metrics derived from the run registry and the queue on every scrape."""
+
+    def collect(self):
+        """Yields the number of runs per status and the queue depth."""
+        counts = REGISTRY_LOG.count_statuses()
+
+        runs = GaugeMetricFamily(
+            "sim_api_runs", "Number of runs by status", labels=["status"]
+        )
+        for status, count in sorted(counts.items()):
+            runs.add_metric([status], count)
+        yield runs
+
+        queue_depth = 0
+        if QUEUE_PATH.exists():
+            with open(QUEUE_PATH, "r", encoding="utf-8") as file:
+                queue_depth = sum(1 for line in file if line.strip() != "")
+        yield GaugeMetricFamily(
+            "sim_api_queue_depth", "Number of runs in the scanner's queue", value=queue_depth
+        )
+
+REGISTRY.register(RunsCollector())
+
+def init_metrics(app: Flask) -> None:
+    """Registers hooks with the given app that record metrics of every request."""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or "unknown"
+        if "request_started" in g:
+            REQUEST_DURATION.labels(
+                endpoint, request.method, str(response.status_code)
+            ).observe(time.perf_counter() - g.request_started)
+        if request.content_length:
+            REQUEST_BYTES.labels(endpoint).inc(request.content_length)
+        if response.content_length:
+            RESPONSE_BYTES.labels(endpoint).inc(response.content_length)
+        return response
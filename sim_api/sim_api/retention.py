@@ -0,0 +1,329 @@
+"""Retention of run directories, blobs and cached results.
+
+Runs accumulate in the runs directory with every call to endpoint get_run_id. This module
+implements the lifecycle of run directories, which is applied periodically by running the
+module as script next to the API and the scanner:
+    - finished runs are marked as `old` after `RETENTION_RUN_TTL` seconds and their
+      artifacts are compressed into one archive or deleted, depending on
+      `RETENTION_OLD_RUN_ACTION`, while the links to their inputs are removed. The
+      status, file index, config file and aliased config of old runs are kept
+    - old runs are removed completely after another `RETENTION_OLD_RUN_TTL` seconds, if it
+      is positive
+    - runs that were never started are removed after `RETENTION_ABANDONED_RUN_TTL` seconds
+      without changes
+    - the result cache is evicted least recently used first down to
+      `RESULT_CACHE_MAX_SIZE` bytes, if it is positive
+    - blobs that are neither linked into a run nor part of a cached result are removed
+    - the run registry is compacted to the latest status of each existing run
+After each pass the disk usage is written to a file, from which endpoint disk_usage
+reads it, as calculating it requires walking all run directories.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import fcntl
+import shutil
+import tarfile
+import time
+import yaml
+from datetime import datetime
+from pathlib import Path
+from sim_api.util import APP_ROOT, BLOBS_PATH, RESULT_CACHE_PATH, REGISTRY_PATH, \
+    REGISTRY_LOCK_PATH, get_run_status, update_run_status, validate_run_id, load_file_index, \
+    file_index_lock, write_file_index, evict_result_cache
+
+APP_CONFIG_PATH = APP_ROOT / "api_config.yml"
+RUNS_PATH = APP_ROOT / "runs"
+DISK_USAGE_PATH = APP_ROOT / "runs" / "disk_usage"
+ARTIFACTS_ARCHIVE_NAME = "artifacts.tar.gz"
+# blobs are stored before they are linked into a run, so younger blobs are never removed
+BLOB_GRACE_SECONDS = 3600
+
+DEFAULT_CONFIG = {
+    "RETENTION_INTERVAL": 3600,
+    "RETENTION_RUN_TTL": 7 * 24 * 3600,
+    "RETENTION_OLD_RUN_ACTION": "compress",
+    "RETENTION_OLD_RUN_TTL": 0,
+    "RETENTION_ABANDONED_RUN_TTL": 24 * 3600,
+    "RESULT_CACHE_MAX_SIZE": 0,
+}
+
+def load_config() -> dict:
+    """Loads the retention options from the API config, using defaults for missing ones."""
+    config = dict(DEFAULT_CONFIG)
+    if APP_CONFIG_PATH.exists():
+        with open(APP_CONFIG_PATH, "r", encoding="utf-8") as file:
+            app_config = yaml.safe_load(file) or {}
+        for key in DEFAULT_CONFIG:
+            if key in app_config:
+                config[key] = app_config[key]
+    return config
+
+def last_change(run_dir: Path) -> float:
+    """Gets the time of the last change of the given run, which is the latest modification
+    of its status or of its directory, which changes when files are added."""
+    times = [run_dir.stat().st_mtime]
+    status_path = run_dir / "status"
+    if status_path.exists():
+        times.append(status_path.stat().st_mtime)
+    return max(times)
+
+def compact_run(run_id: str, action: str) -> int:
+    """Compresses or deletes the artifacts of the given run, which are all files in its
+    file index except the config file and the inputs. The links to the inputs are removed,
+    as their content stays in the blob store while other runs use it. The file index keeps
+    its entries, so the names of the files are still known, but their aliases no longer
+    exist.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`action:str`: Either `compress` to pack the artifacts into an archive, which endpoint
+        download_archive serves, or `delete`
+    Returns:
+    -`int`: The number of bytes freed, not counting files that are still linked elsewhere
+    """
+    run_dir = Path(RUNS_PATH / run_id)
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        inputs = file_index.get("hashes", {})
+        # the config is small and tells what was simulated, so it stays in place
+        files = [
+            (filename, Path(run_dir / alias))
+            for filename, alias in file_index["forward"].items()
+            if alias != file_index.get("config") and Path(run_dir / alias).exists()
+        ]
+        # inputs are hard links to deduplicated blobs, so archiving them would store
+        # another copy of their content
+        artifacts = [(filename, path) for filename, path in files if filename not in inputs]
+
+        if action == "compress" and len(artifacts) > 0:
+            temp_path = Path(run_dir / f"{ARTIFACTS_ARCHIVE_NAME}.tmp")
+            with tarfile.open(temp_path, "w:gz") as archive:
+                for filename, path in artifacts:
+                    archive.add(path, arcname=filename)
+            os.replace(temp_path, Path(run_dir / ARTIFACTS_ARCHIVE_NAME))
+
+        freed = 0
+        for _, path in files:
+            stat_result = path.stat()
+            if stat_result.st_nlink == 1:
+                freed += stat_result.st_size
+            path.unlink()
+
+        file_index["compacted"] = action
+        write_file_index(run_id, file_index)
+
+    # uploads that were never finalized are of no use anymore
+    shutil.rmtree(Path(run_dir / "uploads"), ignore_errors=True)
+    return freed
+
+def collect_blobs(now: float) -> tuple[int,int]:
+    """Removes blobs that are not linked into any run and not part of a cached result.
+
+    Returns:
+    -`int`: The number of removed blobs
+    -`int`: The number of bytes freed
+    """
+    if not BLOBS_PATH.exists():
+        return 0, 0
+
+    cached_hashes = set()
+    if RESULT_CACHE_PATH.exists():
+        for entry_path in RESULT_CACHE_PATH.glob("*.json"):
+            try:
+                with open(entry_path, "r", encoding="utf-8") as file:
+                    cached_hashes.update(json.load(file).get("outputs", {}).values())
+            except (OSError, json.JSONDecodeError):
+                continue
+
+    nr_removed = 0
+    freed = 0
+    for blob_path in BLOBS_PATH.iterdir():
+        if blob_path.name in cached_hashes:
+            continue
+        try:
+            stat_result = blob_path.stat()
+        except FileNotFoundError:
+            continue
+        # the blob store holds the only link, so no run uses the blob. temporary files of
+        # interrupted uploads are removed the same way
+        if stat_result.st_nlink == 1 and now - stat_result.st_mtime > BLOB_GRACE_SECONDS:
+            blob_path.unlink(missing_ok=True)
+            nr_removed += 1
+            freed += stat_result.st_size
+    return nr_removed, freed
+
+def compact_registry() -> int:
+    """Replaces the run registry with a copy holding only the latest line of each run whose
+    directory still exists, in the order of these lines.
+
+    Appends take the registry lock shared, so holding it exclusively keeps them from
+    writing to the registry while it is replaced. The scanner notices the replacement by
+    the changed inode and reads the compacted registry from its start.
+
+    Returns:
+    -`int`: The number of removed lines
+    """
+    if not REGISTRY_PATH.exists():
+        return 0
+
+    with open(REGISTRY_LOCK_PATH, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(REGISTRY_PATH, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+            latest = {}
+            for line in lines:
+                run_id = line.split("\t", 1)[0]
+                # a line without newline is incomplete, which only happens after a crash
+                if not line.endswith("\n") or not validate_run_id(run_id):
+                    continue
+                # the latest line moves to the end, so the queue order of waiting runs
+                # is kept
+                latest.pop(run_id, None)
+                latest[run_id] = line
+            kept = [
+                line for run_id, line in latest.items() if Path(RUNS_PATH / run_id).is_dir()
+            ]
+
+            temp_path = REGISTRY_PATH.with_name(f"{REGISTRY_PATH.name}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write("".join(kept))
+            os.replace(temp_path, REGISTRY_PATH)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return len(lines) - len(kept)
+
+def apply_retention(config: dict, now: float|None = None) -> dict:
+    """Applies one pass of the retention rules to all runs and blobs.
+
+    Args:
+    -`config:dict`: The retention options, see `DEFAULT_CONFIG`
+    -`now:float|None`: (Optional) The current time as timestamp, used for tests
+    Returns:
+    -`dict`: Statistics of the pass
+    """
+    now = time.time() if now is None else now
+    stats = {"marked_old": 0, "removed_old": 0, "removed_abandoned": 0, "bytes_freed": 0}
+    if not RUNS_PATH.exists():
+        return stats
+
+    for run_dir in RUNS_PATH.iterdir():
+        run_id = run_dir.name
+        if not (run_dir.is_dir() and validate_run_id(run_id)):
+            continue
+        try:
+            age = now - last_change(run_dir)
+        except FileNotFoundError:
+            continue
+        status, _ = get_run_status(run_id)
+
+        if status == "new" and age > config["RETENTION_ABANDONED_RUN_TTL"]:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            stats["removed_abandoned"] += 1
+
+        elif status == "finished" and age > config["RETENTION_RUN_TTL"]:
+            stats["bytes_freed"] += compact_run(run_id, config["RETENTION_OLD_RUN_ACTION"])
+            update_run_status(run_id, "old")
+            stats["marked_old"] += 1
+
+        elif (
+            status == "old" and config["RETENTION_OLD_RUN_TTL"] > 0
+            and age > config["RETENTION_OLD_RUN_TTL"]
+        ):
+            shutil.rmtree(run_dir, ignore_errors=True)
+            stats["removed_old"] += 1
+
+    stats["evicted_cache_entries"] = 0
+    if config["RESULT_CACHE_MAX_SIZE"] > 0:
+        stats["evicted_cache_entries"] = evict_result_cache(config["RESULT_CACHE_MAX_SIZE"])
+    nr_blobs, freed = collect_blobs(now)
+    stats["removed_blobs"] = nr_blobs
+    stats["bytes_freed"] += freed
+    stats["registry_lines_removed"] = compact_registry()
+    return stats
+
+def directory_usage(path: Path, seen_inodes: set) -> tuple[int,int]:
+    """Sums up the number and size of the files in the given directory and its
+    subdirectories. Files with an inode in the given set are not counted, so hard links
+    are counted once across calls.
+
+    Returns:
+    -`int`: The number of files
+    -`int`: The total size in bytes
+    """
+    nr_files = 0
+    size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat_result = os.lstat(os.path.join(root, filename))
+            except FileNotFoundError:
+                continue
+            if stat_result.st_ino in seen_inodes:
+                continue
+            seen_inodes.add(stat_result.st_ino)
+            nr_files += 1
+            size += stat_result.st_size
+    return nr_files, size
+
+def get_disk_usage() -> dict:
+    """Calculates the disk usage of runs, blobs and cached results.
+
+    Blobs linked into runs are counted for the blobs only, as they take up space once.
+    """
+    seen_inodes = set()
+    nr_files, size = directory_usage(BLOBS_PATH, seen_inodes)
+    usage = {"blobs": {"files": nr_files, "bytes": size}}
+    nr_files, size = directory_usage(RESULT_CACHE_PATH, seen_inodes)
+    usage["result_cache"] = {"files": nr_files, "bytes": size}
+
+    runs = {}
+    if RUNS_PATH.exists():
+        for run_dir in RUNS_PATH.iterdir():
+            if not (run_dir.is_dir() and validate_run_id(run_dir.name)):
+                continue
+            status, _ = get_run_status(run_dir.name)
+            nr_files, size = directory_usage(run_dir, seen_inodes)
+            status_usage = runs.setdefault(status, {"runs": 0, "files": 0, "bytes": 0})
+            status_usage["runs"] += 1
+            status_usage["files"] += nr_files
+            status_usage["bytes"] += size
+    usage["runs"] = runs
+
+    disk = shutil.disk_usage(APP_ROOT)
+    usage["disk"] = {"total": disk.total, "used": disk.used, "free": disk.free}
+    return usage
+
+def write_disk_usage(usage: dict) -> None:
+    """Writes the given disk usage with the current time for endpoint disk_usage."""
+    temp_path = DISK_USAGE_PATH.with_name(f"{DISK_USAGE_PATH.name}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"timestamp": str(datetime.now()), **usage}, file)
+    os.replace(temp_path, DISK_USAGE_PATH)
+
+def read_disk_usage() -> dict|None:
+    """Reads the disk usage written by the last retention pass, or None if there was none
+    yet."""
+    try:
+        with open(DISK_USAGE_PATH, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def main():
+    """Applies the retention rules periodically."""
+    while True:
+        config = load_config()
+        try:
+            stats = apply_retention(config)
+            print(f"[{datetime.now()}] Retention pass: {stats}", flush=True)
+            write_disk_usage(get_disk_usage())
+        except OSError as error:
+            print(f"[{datetime.now()}] Error during retention pass: {error}", flush=True)
+        time.sleep(config["RETENTION_INTERVAL"])
+
+if __name__ == "__main__":
+    main()
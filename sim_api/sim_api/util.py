@@ -2,19 +2,50 @@
 from __future__ import annotations
 
 import os
+import socket
 import stat
 import json
-import subprocess
-import tempfile
 import uuid
 import re
+import copy
+import fcntl
+import hashlib
+import itertools
+import shutil
+import threading
+import zipfile
+from collections import OrderedDict
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict
+from typing import BinaryIO, Iterator
+from urllib.parse import urlsplit, unquote
+import requests
+from requests.adapters import HTTPAdapter
 from werkzeug.datastructures import FileStorage
+from sim_api.compression import is_compressible_type
 
 APP_ROOT = Path(__file__).resolve().parent.parent
-TIMEOUT_SECONDS = 300  # Hard stop for long‑running sims
+REGISTRY_PATH = APP_ROOT / "runs" / "registry"
+REGISTRY_LOCK_PATH = APP_ROOT / "runs" / "registry.lock"
+DISPATCH_SOCKET_PATH = APP_ROOT / "runs" / "dispatch.sock"
+QUEUE_PATH = APP_ROOT / "runs" / "queue"
+HEALTH_PATH = APP_ROOT / "runs" / "scanner_health"
+BLOBS_PATH = APP_ROOT / "blobs"
+SWEEPS_PATH = APP_ROOT / "sweeps"
+RESULT_CACHE_PATH = APP_ROOT / "result_cache"
+# changes to these files invalidate all cached results
+SIMULATION_CODE_PATHS = [APP_ROOT / "simulate.jl"]
+BLOB_CHUNK_SIZE = 1024 * 1024 # 1 MiB
+
+# parsed file indices by run ID, together with the stat result they were read from, the
+# least recently used first. the number of entries is limited by `_file_index_cache_size`
+_file_index_cache: OrderedDict[str, tuple[tuple[int,int,int], dict]] = OrderedDict()
+_file_index_cache_size = 1000
+_file_index_cache_lock = threading.Lock()
 
 def parse_key_from_auth_header(header: str) -> str:
     """Parses an API from the given value of the authorization header."""
@@ -26,24 +57,71 @@ def parse_key_from_auth_header(header: str) -> str:
         return False
     return parts[1].strip()
 
-def write_temp_json(data: Dict[str, Any]) -> Path:
-    """Write request data to a temp JSON file and return the path."""
-    temp_dir = tempfile.gettempdir()
-    filename = f"sim_input_{uuid.uuid4().hex}.json"
-    file_path = Path(temp_dir) / filename
-    with file_path.open("w", encoding="utf-8") as fp:
-        json.dump(data, fp)
-    return file_path
+@contextmanager
+def registry_lock() -> Iterator[None]:
+    """Holds the lock on the run registry, which appends take shared and the compaction
+    by the retention takes exclusively, so no append is lost while the registry is
+    replaced. The scanner takes the same lock."""
+    with open(REGISTRY_LOCK_PATH, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def append_to_registry(run_id: str, status: str, timestamp: datetime) -> None:
+    """Appends a status change of the given run to the run registry.
+
+    The registry is a log with one tab-separated line per status change. The scanner only
+    reads lines added since its last read, so finding waiting runs does not require
+    reading the status file of every run. Each line is written with a single append,
+    which keeps concurrent writers from interleaving. The retention replaces the registry
+    with a compacted copy now and then."""
+    with registry_lock(), open(REGISTRY_PATH, "a", encoding="utf-8") as file:
+        file.write(f"{run_id}\t{status}\t{timestamp}\n")
 
-def run_simulation(input_file: Path) -> subprocess.CompletedProcess[str]:
-    """Run the Julia simulation subprocess and capture output."""
-    cmd = ["julia", "simulate.jl", str(input_file)]
-    return subprocess.run(cmd, capture_output=True, text=True, timeout=TIMEOUT_SECONDS, check=False)
+def write_status_file(run_id: str, status: str, timestamp: datetime) -> None:
+    """Writes the status file of the given run and appends the status to its timeline.
+
+    The status file only holds the latest status, while the timeline keeps one
+    tab-separated line per status change, so the time spent in each status is known
+    afterwards."""
+    run_dir = Path(APP_ROOT / "runs" / run_id)
+    with open(Path(run_dir / "status"), "w", encoding="utf-8") as file:
+        file.write(f"{status}\n{timestamp}")
+    with open(Path(run_dir / "timeline"), "a", encoding="utf-8") as file:
+        file.write(f"{status}\t{timestamp}\n")
 
 def update_run_status(run_id: str, new_status: str) -> None:
     """Update the status of the given run with the new status."""
-    with open(Path(APP_ROOT / "runs" / run_id / "status"), "w", encoding="utf-8") as file:
-        file.write(f"{new_status}\n{datetime.now()}")
+    timestamp = datetime.now()
+    write_status_file(run_id, new_status, timestamp)
+    append_to_registry(run_id, new_status, timestamp)
+
+def notify_scanner() -> bool:
+    """Notifies the scanner that a run was queued, so it is dispatched without waiting for
+    the next poll.
+
+    Returns False if the scanner could not be reached, in which case the run is picked up
+    by the scanner's polling instead."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1)
+            sock.connect(str(DISPATCH_SOCKET_PATH))
+    except OSError:
+        return False
+    return True
+
+def update_runs_status(run_ids: list[str], new_status: str) -> None:
+    """Update the status of all given runs with the new status.
+
+    All status changes are appended to the registry in one write, so the scanner sees
+    either none or all of them."""
+    timestamp = datetime.now()
+    for run_id in run_ids:
+        write_status_file(run_id, new_status, timestamp)
+    with registry_lock(), open(REGISTRY_PATH, "a", encoding="utf-8") as file:
+        file.write("".join(f"{run_id}\t{new_status}\t{timestamp}\n" for run_id in run_ids))
 
 def create_run_dir(run_id: str) -> None:
     """Creates a run directory for the given run ID."""
@@ -77,6 +155,101 @@ def get_run_status(run_id: str) -> tuple[str,str]:
             return "unknown", "1970-01-01 00:00:00.0"
         return lines[0].strip(), lines[1].strip()
 
+def get_status_mtime(run_id: str) -> int|None:
+    """Gets the modification time of the status file of the given run in nanoseconds."""
+    try:
+        return os.stat(Path(APP_ROOT / "runs" / run_id / "status")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def get_run_timeline(run_id: str) -> list[dict]:
+    """Reads the timeline of status changes of the given run.
+
+    Runs created before timelines were recorded only have their latest status, which is
+    returned as the only entry.
+
+    Returns:
+    -`list[dict]`: The status changes in order with keys `status`, `timestamp` and
+        `duration`, which is the time in seconds until the next change or None for the
+        latest one
+    """
+    timeline = []
+    timeline_path = Path(APP_ROOT / "runs" / run_id / "timeline")
+    if timeline_path.exists():
+        with open(timeline_path, "r", encoding="utf-8") as file:
+            for line in file:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 2:
+                    timeline.append({"status": parts[0], "timestamp": parts[1]})
+    else:
+        status, timestamp = get_run_status(run_id)
+        timeline.append({"status": status, "timestamp": timestamp})
+
+    for entry, next_entry in zip(timeline, timeline[1:] + [None]):
+        entry["duration"] = None
+        if next_entry is not None:
+            try:
+                # the API and the scanner both write ISO timestamps, with and without `T`
+                entry["duration"] = (
+                    datetime.fromisoformat(next_entry["timestamp"])
+                    - datetime.fromisoformat(entry["timestamp"])
+                ).total_seconds()
+            except ValueError:
+                pass
+    return timeline
+
+def get_run_profile(run_id: str) -> dict|None:
+    """Reads the resource profile that the scanner recorded for the simulation of the given
+    run, or None if the run was not simulated (yet)."""
+    try:
+        with open(Path(APP_ROOT / "runs" / run_id / "profile.json"), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def get_queue_position(run_id: str) -> int|None:
+    """Reads the position of the given run in the scanner's queue of waiting runs.
+
+    Returns the 1-based position or None if the run is not in the queue, which is also the
+    case for runs that were queued but not yet seen by the scanner."""
+    if not QUEUE_PATH.exists():
+        return None
+
+    with open(QUEUE_PATH, "r", encoding="utf-8") as file:
+        for position, line in enumerate(file, start=1):
+            if line.strip() == run_id:
+                return position
+    return None
+
+def get_scanner_health() -> dict:
+    """Reads the heartbeat of the scanner and checks if it is recent.
+
+    The scanner writes its heartbeat every poll interval, so a heartbeat older than a few
+    intervals means the scanner is stuck or not running."""
+    health = {"healthy": False, "heartbeat": None, "runs_processed": 0, "started": None}
+    if not HEALTH_PATH.exists():
+        return health
+
+    with open(HEALTH_PATH, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file.readlines()]
+    if len(lines) < 3:
+        return health
+
+    try:
+        heartbeat = datetime.fromisoformat(lines[0])
+        runs_processed = int(lines[1])
+    except ValueError:
+        return health
+
+    poll_interval = float(os.environ.get("SIM_POLL_INTERVAL", "5"))
+    age = (datetime.now() - heartbeat).total_seconds()
+    return {
+        "healthy": age < 3 * poll_interval,
+        "heartbeat": lines[0],
+        "runs_processed": runs_processed,
+        "started": lines[2]
+    }
+
 def validate_uploaded_filename(filename: str) -> tuple[bool,str]:
     """Validates the given filename of a presumably uploaded file.
 
@@ -110,61 +283,831 @@ def validate_uploaded_filename(filename: str) -> tuple[bool,str]:
 
     return True, "Filename appears valid"
 
+@contextmanager
+def file_index_lock(run_id: str) -> Iterator[None]:
+    """Holds the lock on the file index of the given run.
+
+    This must be held for read-modify-write cycles of the index. As it is a file lock, it
+    also excludes other processes, such as the scanner writing output files to the index.
+    """
+    lock_path = Path(APP_ROOT / "runs" / run_id / "file_index.lock")
+    with open(lock_path, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _file_index_stat_key(file_index_path: Path) -> tuple[int,int,int]|None:
+    """Gets the values identifying a version of the file index written to the given path."""
+    try:
+        stat_result = os.stat(file_index_path)
+    except FileNotFoundError:
+        return None
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+def set_file_index_cache_size(size: int) -> None:
+    """Sets the maximum number of parsed file indices kept in memory, removing the least
+    recently used ones beyond it."""
+    global _file_index_cache_size # pylint: disable=global-statement
+    with _file_index_cache_lock:
+        _file_index_cache_size = size
+        while len(_file_index_cache) > max(_file_index_cache_size, 0):
+            _file_index_cache.popitem(last=False)
+
+def _cache_file_index(run_id: str, stat_key: tuple[int,int,int]|None, file_index: dict) -> None:
+    """Adds the given parsed file index to the cache, removing the least recently used
+    entry if the cache is full."""
+    with _file_index_cache_lock:
+        _file_index_cache[run_id] = (stat_key, file_index)
+        _file_index_cache.move_to_end(run_id)
+        while len(_file_index_cache) > max(_file_index_cache_size, 0):
+            _file_index_cache.popitem(last=False)
+
 def load_file_index(run_id: str) -> dict:
-    """Reads the file index for the given run."""
+    """Reads the file index for the given run.
+
+    The parsed index is cached until the file changes, so repeated reads of an unchanged
+    index do not parse the JSON again. The returned dict is a copy and can be modified."""
     file_index_path = Path(APP_ROOT / "runs" / run_id / "file_index.json")
-    if not (file_index_path.exists() and file_index_path.is_file()):
+    stat_key = _file_index_stat_key(file_index_path)
+    if stat_key is None or not file_index_path.is_file():
+        # the run was removed, e.g. by the retention
+        with _file_index_cache_lock:
+            _file_index_cache.pop(run_id, None)
         return {"forward": {}, "reverse": {}}
 
+    with _file_index_cache_lock:
+        cached = _file_index_cache.get(run_id)
+        if cached is not None:
+            _file_index_cache.move_to_end(run_id)
+    if cached is not None and cached[0] == stat_key:
+        return copy.deepcopy(cached[1])
+
     try:
         with open(file_index_path, "r", encoding="utf-8") as file:
             file_index = json.load(file)
     except json.JSONDecodeError:
         return {"forward": {}, "reverse": {}}
 
-    return file_index
+    _cache_file_index(run_id, stat_key, file_index)
+    return copy.deepcopy(file_index)
 
 def write_file_index(run_id: str, file_index: dict) -> None:
-    """Writes the file index for the given run."""
+    """Writes the file index for the given run.
+
+    The index is written to a temporary file first, which then replaces the index, so
+    readers never see a partially written index. Callers modifying the index should hold
+    the lock from `file_index_lock`."""
     file_index_path = Path(APP_ROOT / "runs" / run_id / "file_index.json")
-    with open(file_index_path, "w", encoding="utf-8") as file:
-        json.dump(file_index, file, indent=4)
+    temp_path = file_index_path.with_name(f"file_index.json.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(file_index, file)
+    os.replace(temp_path, file_index_path)
+
+    _cache_file_index(run_id, _file_index_stat_key(file_index_path), copy.deepcopy(file_index))
 
 def save_file_for_run(run_id: str, file: FileStorage) -> str:
     """Saves the given file in the given run in a safe manner by renaming it"""
+    return save_files_for_run(run_id, [file])[0]
+
+def validate_file_hash(file_hash: str) -> bool:
+    """Validates the given file hash, which must be a SHA-256 hex digest."""
+    return (
+        isinstance(file_hash, str)
+        and len(file_hash) == 64
+        and all(c in '0123456789abcdef' for c in file_hash)
+    )
+
+def blob_exists(file_hash: str) -> bool:
+    """Checks if a file with the given hash exists in the blob store."""
+    return validate_file_hash(file_hash) and Path(BLOBS_PATH / file_hash).is_file()
+
+def store_blob(stream: BinaryIO) -> str:
+    """Stores the content of the given stream in the blob store and returns its hash.
+
+    Blobs are stored under their SHA-256 hash, so identical content is only stored once
+    no matter how many runs it is uploaded to. The stream is read in chunks and hashed
+    while it is written to a temporary file, which is discarded if the blob exists already.
+    """
+    os.makedirs(BLOBS_PATH, exist_ok=True)
+    hasher = hashlib.sha256()
+    temp_path = Path(BLOBS_PATH / f"{uuid.uuid4().hex}.tmp")
+    with open(temp_path, "wb") as file:
+        while chunk := stream.read(BLOB_CHUNK_SIZE):
+            hasher.update(chunk)
+            file.write(chunk)
+
+    file_hash = hasher.hexdigest()
+    blob_path = Path(BLOBS_PATH / file_hash)
+    if blob_path.exists():
+        # the blob is about to be linked into a run. touching it keeps the retention from
+        # collecting it in the meantime, as it only collects blobs older than a grace period
+        try:
+            os.utime(blob_path)
+            os.remove(temp_path)
+            return file_hash
+        except FileNotFoundError:
+            pass
+    # blobs are shared between runs, so they must never be modified
+    os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(temp_path, blob_path)
+    return file_hash
+
+def link_blob(file_hash: str, path: Path) -> bool:
+    """Makes the blob with the given hash available at the given path.
+
+    The blob is hard-linked, so it takes up no additional space. If hard links are not
+    possible, the blob is copied instead.
+
+    Returns:
+    -`bool`: False if the blob does not exist, e.g. as the retention collected it since it
+        was reported as known
+    """
+    blob_path = Path(BLOBS_PATH / file_hash)
+    try:
+        os.link(blob_path, path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            shutil.copyfile(blob_path, path)
+        except FileNotFoundError:
+            return False
+    return True
+
+def add_files_to_run(
+    run_id: str, file_hashes: dict[str,str], outputs: bool = False
+) -> dict[str,str]:
+    """Adds the blobs with the given hashes to the given run under the given filenames.
+
+    The file index is updated once for all files and records the hash of each file. Hashes
+    of inputs are recorded under `hashes`, hashes of outputs under `outputs`, so the files
+    are told apart in the manifest of artifacts.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`file_hashes:dict[str,str]`: Maps filenames to the hash of their content, which must
+        exist in the blob store
+    -`outputs:bool`: (Optional) If the files are outputs of the run, e.g. cached results.
+        Defaults to False
+    Returns:
+    -`dict[str,str]`: Maps the filenames to their alias
+    Raises:
+    -`ValueError`: If a blob does not exist (anymore), in which case no file is added
+    """
+    run_dir = Path(APP_ROOT / "runs" / run_id)
+    # the blobs are linked before the file index is updated, so a blob the retention
+    # collected since it was reported as known does not leave a dangling entry behind
+    temp_paths = {}
+    for filename, file_hash in file_hashes.items():
+        temp_path = Path(run_dir / f"{uuid.uuid4().hex}.tmp")
+        if not (validate_file_hash(file_hash) and link_blob(file_hash, temp_path)):
+            for linked_path in temp_paths.values():
+                linked_path.unlink(missing_ok=True)
+            raise ValueError(f"Unknown hash for file `{filename}`")
+        temp_paths[filename] = temp_path
+
+    aliases = {}
+    hashes_key = "outputs" if outputs else "hashes"
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        if hashes_key not in file_index:
+            file_index[hashes_key] = {}
+
+        for filename, file_hash in file_hashes.items():
+            if filename in file_index["forward"]:
+                safe_filename = file_index["forward"][filename]
+            else:
+                safe_filename = uuid.uuid4().hex
+                file_index["forward"][filename] = safe_filename
+                file_index["reverse"][safe_filename] = filename
+            file_index[hashes_key][filename] = file_hash
+            aliases[filename] = safe_filename
+
+        write_file_index(run_id, file_index)
+
+    # renaming the links into place avoids mixing concurrent uploads of the same file
+    for filename, temp_path in temp_paths.items():
+        os.replace(temp_path, Path(run_dir / aliases[filename]))
+
+    return aliases
+
+def get_file_hashes(run_id: str) -> dict[str,str]:
+    """Gets the hashes of all files in the file index of the given run.
+
+    Files saved before the blob store existed have no recorded hash, so they are added to
+    the blob store on the fly."""
     file_index = load_file_index(run_id)
+    file_hashes = {**file_index.get("outputs", {}), **file_index.get("hashes", {})}
+    for filename, alias in file_index["forward"].items():
+        if filename not in file_hashes:
+            with open(Path(APP_ROOT / "runs" / run_id / alias), "rb") as file:
+                file_hashes[filename] = store_blob(file)
+    return file_hashes
 
-    if file.filename in file_index["forward"]:
-        safe_filename = file_index["forward"][file.filename]
-    else:
-        safe_filename = uuid.uuid4().hex
-        file_index["forward"][file.filename] = safe_filename
-        file_index["reverse"][safe_filename] = file.filename
+def save_files_for_run(run_id: str, files: list[FileStorage]) -> list[str]:
+    """Saves the given files in the given run in a safe manner by renaming them.
+
+    The content is stored in the blob store and linked into the run. Returns the aliases
+    of the files in the same order as the given files."""
+    file_hashes = {}
+    for file in files:
+        file_hashes[file.filename] = store_blob(file.stream)
+    aliases = add_files_to_run(run_id, file_hashes)
+    return [aliases[file.filename] for file in files]
+
+def hash_file(path: Path) -> str:
+    """Calculates the SHA-256 hash of the file at the given path, reading it in chunks."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(BLOB_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def get_artifacts(run_id: str) -> list[dict]:
+    """Gets the manifest of the artifacts the given run produced.
+
+    Artifacts are the files of the `reverse` side of the file index that are current and
+    were not uploaded as inputs, which are recorded with their hash. The hashes of outputs
+    written by the scanner are calculated on first request and stored in the file index
+    under `outputs`, as outputs do not change once the run finished.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    Returns:
+    -`list[dict]`: The artifacts sorted by filename, each with keys `filename`, `size` in
+        bytes and `sha256`. Files that no longer exist, e.g. of old runs, are left out
+    """
+    run_dir = Path(APP_ROOT / "runs" / run_id)
+    artifacts = []
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        inputs = file_index.get("hashes", {})
+        output_hashes = file_index.setdefault("outputs", {})
+        nr_hashed = 0
+        for alias, filename in file_index["reverse"].items():
+            # the scanner adds a new alias each time it writes a file, so earlier aliases
+            # of the same filename are stale
+            if filename in inputs or file_index["forward"].get(filename) != alias:
+                continue
+            try:
+                size = Path(run_dir / alias).stat().st_size
+            except FileNotFoundError:
+                continue
+            if filename not in output_hashes:
+                output_hashes[filename] = hash_file(Path(run_dir / alias))
+                nr_hashed += 1
+            artifacts.append({
+                "filename": filename, "size": size, "sha256": output_hashes[filename]
+            })
+        if nr_hashed > 0:
+            write_file_index(run_id, file_index)
+    return sorted(artifacts, key=lambda artifact: artifact["filename"])
+
+class _ZipStream:
+    """Write-only file object collecting what the zip writer writes, so it can be sent in
+    chunks while the archive is built. It has no `tell`, so the archive is written for
+    unseekable output."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        """Collects the given data and returns its length."""
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        """Nothing to flush, as the data is taken by `pop`."""
+
+    def pop(self) -> bytes:
+        """Takes all data written since the last call."""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_artifacts_zip(run_id: str, filenames: list[str]) -> Iterator[bytes]:
+    """Streams the given files of the run as one zip archive, which is built while it is
+    sent, so neither the archive nor a file is held in memory completely.
 
-    write_file_index(run_id, file_index)
+    Files that compress well are deflated, the others, like PNG images, are stored as they
+    are. The CRC-32 of each file in the archive is checked on extraction.
 
-    filepath = Path(APP_ROOT / "runs" / run_id / safe_filename)
-    file.save(filepath)
-    # set as owner-has-write, group-has-read, other-has-read
-    os.chmod(filepath, stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    Args:
+    -`run_id:str`: The ID of the run
+    -`filenames:list[str]`: The names of the files in the file index to add to the archive
+    Returns:
+    -`Iterator[bytes]`: The archive in chunks
+    """
+    file_index = load_file_index(run_id)
+    output = _ZipStream()
+    with zipfile.ZipFile(output, "w") as archive:
+        for filename in filenames:
+            alias_path = Path(APP_ROOT / "runs" / run_id / file_index["forward"][filename])
+            info = zipfile.ZipInfo.from_file(alias_path, arcname=filename)
+            mimetype, encoding = mimetypes.guess_type(filename)
+            if encoding is None and is_compressible_type(mimetype or ""):
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(alias_path, "rb") as file, archive.open(info, "w") as entry:
+                while chunk := file.read(BLOB_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield output.pop()
+            yield output.pop()
+    yield output.pop()
+
+def upload_session_path(run_id: str, upload_id: str) -> Path:
+    """Gets the directory of the given upload session, which is inside the run dir, so the
+    uploaded file can be moved into the blob store without copying it."""
+    return Path(APP_ROOT / "runs" / run_id / "uploads" / upload_id)
+
+def create_upload_session(run_id: str, filename: str, size: int) -> str:
+    """Creates a session for uploading a file of the given size in chunks.
+
+    The file is created with its full size up front, so chunks can be written at their
+    offset in any order and in parallel.
+
+    Returns:
+    -`str`: The ID of the upload session
+    """
+    upload_id = uuid.uuid4().hex
+    session_path = upload_session_path(run_id, upload_id)
+    os.makedirs(session_path)
+    with open(Path(session_path / "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({"filename": filename, "size": size}, file)
+    with open(Path(session_path / "data"), "wb") as file:
+        file.truncate(size)
+    Path(session_path / "received").touch()
+    return upload_id
+
+def merge_ranges(ranges: list[tuple[int,int]]) -> list[tuple[int,int]]:
+    """Merges the given ranges of start (inclusive) and end (exclusive) offsets into a
+    sorted list of ranges that neither overlap nor touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def get_upload_session(run_id: str, upload_id: str) -> dict|None:
+    """Gets the state of the given upload session.
+
+    Returns:
+    -`dict|None`: The filename, size, number of received bytes and the missing ranges as
+        lists of start (inclusive) and end (exclusive) offset, or None if there is no such
+        session
+    """
+    session_path = upload_session_path(run_id, upload_id)
+    try:
+        with open(Path(session_path / "meta.json"), "r", encoding="utf-8") as file:
+            session = json.load(file)
+        with open(Path(session_path / "received"), "r", encoding="utf-8") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return None
+
+    ranges = []
+    for line in lines:
+        parts = line.split("\t")
+        if len(parts) == 2:
+            ranges.append((int(parts[0]), int(parts[0]) + int(parts[1])))
+    received = merge_ranges(ranges)
+
+    missing = []
+    position = 0
+    for start, end in received + [(session["size"], session["size"])]:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+
+    return {
+        **session,
+        "received": sum(end - start for start, end in received),
+        "missing": missing
+    }
+
+def write_upload_chunk(
+    run_id: str, upload_id: str, offset: int, stream: BinaryIO, length: int|None,
+    max_buffered: int
+) -> int:
+    """Writes the content of the given stream at the given offset of the uploaded file.
+
+    Chunks are checked against the size of the file before anything is written, so a
+    rejected chunk never overwrites ranges that were received before. If the length of the
+    chunk is known, the stream is written in blocks as it is read, so the chunk is never
+    held in memory or spooled completely. Otherwise, e.g. for compressed chunks, it is
+    read into memory first, up to the given number of bytes. The range is recorded as
+    received only once it was written completely, so an interrupted chunk is reported as
+    missing and can be sent again.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`upload_id:str`: The ID of the upload session
+    -`offset:int`: The offset of the chunk in the file
+    -`stream:BinaryIO`: The content of the chunk
+    -`length:int|None`: The length of the chunk, e.g. from header `Content-Length`, or None
+        if it is not known
+    -`max_buffered:int`: The maximum size of chunks of unknown length
+    Returns:
+    -`int`: The number of bytes written
+    Raises:
+    -`ValueError`: If the chunk exceeds the size of the file, or the maximum size of chunks
+        of unknown length
+    """
+    session = get_upload_session(run_id, upload_id)
+    session_path = upload_session_path(run_id, upload_id)
+    if length is None:
+        blocks = []
+        buffered = 0
+        while block := stream.read(min(BLOB_CHUNK_SIZE, max_buffered + 1 - buffered)):
+            blocks.append(block)
+            buffered += len(block)
+            if buffered > max_buffered:
+                raise ValueError("Chunk without length exceeds the chunk size")
+        stream = BytesIO(b"".join(blocks))
+        length = buffered
+    if offset + length > session["size"]:
+        raise ValueError("Chunk exceeds the size of the file")
+
+    written = 0
+    file_descriptor = os.open(Path(session_path / "data"), os.O_WRONLY)
+    try:
+        # reading at most the checked length keeps a longer body from being written
+        while written < length and (
+            block := stream.read(min(BLOB_CHUNK_SIZE, length - written))
+        ):
+            os.pwrite(file_descriptor, block, offset + written)
+            written += len(block)
+    finally:
+        os.close(file_descriptor)
+
+    if written > 0:
+        # one append per chunk, so chunks written in parallel do not interleave
+        with open(Path(session_path / "received"), "a", encoding="utf-8") as file:
+            file.write(f"{offset}\t{written}\n")
+    return written
+
+def finalize_upload_session(run_id: str, upload_id: str, file_hash: str) -> tuple[bool,str]:
+    """Completes the given upload session by checking the hash of the uploaded file and
+    moving it into the blob store, from which it is linked into the run.
+
+    Returns:
+    -`bool`: If the upload was completed
+    -`str`: The error message if it was not
+    """
+    session = get_upload_session(run_id, upload_id)
+    if len(session["missing"]) > 0:
+        return False, f"Upload is missing {session['size'] - session['received']} bytes"
+
+    session_path = upload_session_path(run_id, upload_id)
+    data_path = Path(session_path / "data")
+    hasher = hashlib.sha256()
+    with open(data_path, "rb") as file:
+        while block := file.read(BLOB_CHUNK_SIZE):
+            hasher.update(block)
+    if hasher.hexdigest() != file_hash:
+        return False, "Hash of uploaded file does not match"
+
+    os.makedirs(BLOBS_PATH, exist_ok=True)
+    if not blob_exists(file_hash):
+        # blobs are shared between runs, so they must never be modified
+        os.chmod(data_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(data_path, Path(BLOBS_PATH / file_hash))
+    try:
+        add_files_to_run(run_id, {session["filename"]: file_hash})
+    except ValueError as error:
+        return False, str(error)
+    shutil.rmtree(session_path, ignore_errors=True)
+    return True, ""
+
+def is_allowed_transfer_url(url: str, allowed_base_urls: list[str]) -> bool:
+    """Checks if files may be transferred from or to the given URL on behalf of a user.
+
+    The URL must start with one of the allowed base URLs, e.g. the WebDAV root of the
+    NextCloud instance of the webapp, so the delegated token of a user is never sent
+    elsewhere. Paths with `.` or `..` segments are rejected, as they could leave the base.
+    """
+    parts = urlsplit(str(url))
+    if parts.scheme not in ("http", "https"):
+        return False
+    if any(segment in (".", "..") for segment in unquote(parts.path).split("/")):
+        return False
+    for base_url in allowed_base_urls or []:
+        # the base must end at a path boundary, otherwise it also matches other hosts
+        base_url = str(base_url).rstrip("/") + "/"
+        if base_url != "/" and str(url).startswith(base_url):
+            return True
+    return False
+
+def import_files_from_urls(
+    run_id: str, urls: dict[str,str], token: str, timeout: float
+) -> dict[str,str]:
+    """Downloads the files from the given URLs into the blob store and adds them to the run.
+
+    The downloads are authorized with the given token, which is not stored. Either all
+    files are added to the run or, if any download fails, none of them.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`urls:dict[str,str]`: Maps filenames to the URLs from which to download them
+    -`token:str`: The bearer token for the downloads
+    -`timeout:float`: The timeout in seconds for connecting and for each read
+    Returns:
+    -`dict[str,str]`: Maps the filenames to their alias
+    Raises:
+    -`requests.RequestException`: If a download fails
+    """
+    file_hashes = {}
+    with requests.Session() as transfer_session:
+        transfer_session.headers["Authorization"] = "Bearer " + token
+        for filename, url in urls.items():
+            with transfer_session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                file_hashes[filename] = store_blob(response.raw)
+    return add_files_to_run(run_id, file_hashes)
+
+def export_files_to_urls(
+    run_id: str, urls: dict[str,str], token: str, timeout: float, max_workers: int = 1
+) -> None:
+    """Uploads the given files of the run to the given URLs.
+
+    The uploads are authorized with the given token, which is not stored. The files are
+    streamed from the run dir, so they are never held in memory completely.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`urls:dict[str,str]`: Maps filenames in the file index of the run to the URLs to which
+        to upload them
+    -`token:str`: The bearer token for the uploads
+    -`timeout:float`: The timeout in seconds for connecting and for each read
+    -`max_workers:int`: (Optional) The number of files uploaded in parallel. Defaults to 1
+    Raises:
+    -`KeyError`: If a file is not in the file index
+    -`requests.RequestException`: If an upload fails
+    """
+    file_index = load_file_index(run_id)
+    alias_paths = {
+        filename: Path(APP_ROOT / "runs" / run_id / file_index["forward"][filename])
+        for filename in urls
+    }
+    with requests.Session() as transfer_session:
+        transfer_session.headers["Authorization"] = "Bearer " + token
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        transfer_session.mount("https://", adapter)
+        transfer_session.mount("http://", adapter)
 
-    return safe_filename
+        def upload(filename: str) -> None:
+            with open(alias_paths[filename], "rb") as file:
+                response = transfer_session.put(urls[filename], data=file, timeout=timeout)
+            response.raise_for_status()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # consuming the results raises the first error of any upload
+            list(executor.map(upload, urls))
+
+def alias_references(value, forward: dict):
+    """Replaces references to files in the given parsed JSON value by their alias.
+
+    A string value is a reference if it equals the name of a file in the file index or if
+    it is a path of which a component does. Only string values are checked, so keys and
+    numbers are never rewritten, and each string is looked up in the index once instead
+    of searching the config for every file in the index.
+
+    Args:
+    -`value`: The parsed JSON value, which is not modified
+    -`forward:dict`: The forward part of the file index, mapping filenames to aliases
+    Returns:
+    -`Any`: A copy of the value with references replaced
+    """
+    if isinstance(value, dict):
+        return {key: alias_references(item, forward) for key, item in value.items()}
+    if isinstance(value, list):
+        return [alias_references(item, forward) for item in value]
+    if isinstance(value, str):
+        if value in forward:
+            return forward[value]
+        # filenames cannot contain slashes, so splitting keeps them intact
+        return "/".join(forward.get(part, part) for part in value.split("/"))
+    return value
 
 def alias_config_file(run_id: str, alias_filename) -> tuple[bool,str]:
     """Creates a copy of the given config file where all references to files are replaced
-    by their alias."""
+    by their alias. The alias of the config file is recorded in the file index under
+    `config`, so the retention keeps it when it compacts the run."""
     alias_path = Path(APP_ROOT / "runs" / run_id / alias_filename)
     if not alias_path.exists():
         return False, "Could not find alias file"
 
     with open(alias_path, "r", encoding="utf-8") as file:
-        content = file.read()
+        try:
+            config = json.load(file)
+        except json.JSONDecodeError as error:
+            return False, f"Config file is not valid JSON: {error}"
+
+    with file_index_lock(run_id):
         file_index = load_file_index(run_id)
-        for original in file_index["forward"]:
-            content = content.replace(original, file_index["forward"][original])
+        file_index["config"] = alias_filename
+        write_file_index(run_id, file_index)
+    aliased_config = alias_references(config, file_index["forward"])
 
     aliased_config_path = Path(APP_ROOT / "runs" / run_id / "aliased_config.json")
     with open(aliased_config_path, "w", encoding="utf-8") as file:
-        file.write(content)
+        json.dump(aliased_config, file, ensure_ascii=False)
 
     return True, aliased_config_path
+
+def result_cache_key(run_id: str, config_alias: str) -> str:
+    """Calculates the key under which the results of the given run are cached.
+
+    The key is the hash of the config with all references to files replaced by the hash of
+    their content, so it does not depend on filenames or aliases, and of the simulation
+    code. Runs with the same key produce the same outputs.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`config_alias:str`: The alias of the config file of the run
+    Returns:
+    -`str`: The cache key
+    """
+    with open(Path(APP_ROOT / "runs" / run_id / config_alias), "r", encoding="utf-8") as file:
+        config = json.load(file)
+    content_refs = {
+        filename: f"sha256:{file_hash}"
+        for filename, file_hash in get_file_hashes(run_id).items()
+    }
+
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(
+        alias_references(config, content_refs), sort_keys=True, separators=(",", ":")
+    ).encode("utf-8"))
+    for code_path in SIMULATION_CODE_PATHS:
+        if code_path.exists():
+            hasher.update(code_path.read_bytes())
+    return hasher.hexdigest()
+
+def load_cached_result(cache_key: str) -> dict|None:
+    """Loads the entry of the result cache with the given key.
+
+    Entries are written by the scanner after a simulation finished and map the filenames
+    of the outputs to their hash in the blob store. Loading an entry marks it as recently
+    used for the eviction.
+
+    Returns:
+    -`dict|None`: The entry or None if there is no complete entry for the key
+    """
+    entry_path = Path(RESULT_CACHE_PATH / f"{cache_key}.json")
+    try:
+        with open(entry_path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if not all(blob_exists(file_hash) for file_hash in entry.get("outputs", {}).values()):
+        return None
+    os.utime(entry_path)
+    return entry
+
+def start_from_result_cache(run_id: str, config_alias: str) -> bool:
+    """Looks up the results of the given run in the result cache and adds them to the run
+    if they exist.
+
+    The cache key and whether the results were found are written to the file
+    `result_cache.json` in the run dir. The scanner adds the outputs of runs without
+    cached results to the cache under this key once the simulation finished.
+
+    Args:
+    -`run_id:str`: The ID of the run
+    -`config_alias:str`: The alias of the config file of the run
+    Returns:
+    -`bool`: True if the results were cached and added to the run, which then does not need
+        to be simulated
+    """
+    cache_key = result_cache_key(run_id, config_alias)
+    entry = load_cached_result(cache_key)
+    if entry is not None:
+        try:
+            add_files_to_run(run_id, entry["outputs"], outputs=True)
+        except ValueError:
+            # an output was evicted in the meantime, so the run is simulated
+            entry = None
+
+    info_path = Path(APP_ROOT / "runs" / run_id / "result_cache.json")
+    with open(info_path, "w", encoding="utf-8") as file:
+        json.dump({"key": cache_key, "hit": entry is not None}, file)
+    return entry is not None
+
+def get_result_cache_info(run_id: str) -> dict|None:
+    """Gets the cache key and hit flag written when the run was started, or None if the
+    result cache was not used for the run."""
+    info_path = Path(APP_ROOT / "runs" / run_id / "result_cache.json")
+    try:
+        with open(info_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def evict_result_cache(max_size: int) -> int:
+    """Removes the least recently used entries of the result cache until the outputs of the
+    remaining entries take up at most the given number of bytes.
+
+    Blobs of removed entries are deleted unless they are still used elsewhere, which is
+    the case if other hard links to them exist or other entries refer to them.
+
+    Returns:
+    -`int`: The number of removed entries
+    """
+    if not RESULT_CACHE_PATH.exists():
+        return 0
+
+    entries = []
+    total_size = 0
+    for entry_path in RESULT_CACHE_PATH.glob("*.json"):
+        try:
+            with open(entry_path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            mtime = entry_path.stat().st_mtime
+        except (OSError, json.JSONDecodeError):
+            continue
+        entries.append((mtime, entry_path, entry))
+        total_size += entry.get("size", 0)
+
+    if total_size <= max_size:
+        return 0
+
+    entries.sort(key=lambda item: item[0])
+    removed_hashes = set()
+    nr_removed = 0
+    for _, entry_path, entry in entries:
+        if total_size <= max_size:
+            break
+        entry_path.unlink(missing_ok=True)
+        removed_hashes.update(entry.get("outputs", {}).values())
+        total_size -= entry.get("size", 0)
+        nr_removed += 1
+
+    kept_hashes = set()
+    for _, entry_path, entry in entries[nr_removed:]:
+        kept_hashes.update(entry.get("outputs", {}).values())
+    for file_hash in removed_hashes - kept_hashes:
+        blob_path = Path(BLOBS_PATH / file_hash)
+        try:
+            if blob_path.stat().st_nlink == 1:
+                blob_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    return nr_removed
+
+def build_sweep_variants(parameters: dict|None, overrides: list|None) -> list[dict]:
+    """Builds the overrides for each run of a parameter sweep.
+
+    Args:
+    -`parameters:dict|None`: Maps parameter names to lists of values. Every combination of
+        values results in one variant.
+    -`overrides:list|None`: Dicts mapping parameter names to values, each being one
+        variant. These are added after the variants from `parameters`.
+    Returns:
+    -`list[dict]`: The overrides of each variant
+    """
+    variants = []
+    if parameters:
+        names = list(parameters.keys())
+        for values in itertools.product(*(parameters[name] for name in names)):
+            variants.append(dict(zip(names, values)))
+    if overrides:
+        variants.extend(overrides)
+    return variants
+
+def apply_overrides(config: dict, overrides: dict) -> dict:
+    """Applies the given overrides to a copy of the given config.
+
+    Parameter names can address nested values by joining keys with periods, for example
+    `components.boiler.power`. Missing intermediate objects are created.
+    """
+    config = copy.deepcopy(config)
+    for name, value in overrides.items():
+        keys = str(name).split(".")
+        target = config
+        for key in keys[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        target[keys[-1]] = value
+    return config
+
+def write_sweep(sweep_id: str, sweep: dict) -> None:
+    """Writes the description of the given sweep."""
+    os.makedirs(SWEEPS_PATH, exist_ok=True)
+    with open(Path(SWEEPS_PATH / f"{sweep_id}.json"), "w", encoding="utf-8") as file:
+        json.dump(sweep, file)
+
+def load_sweep(sweep_id: str) -> dict|None:
+    """Reads the description of the given sweep or returns None if it does not exist."""
+    sweep_path = Path(SWEEPS_PATH / f"{sweep_id}.json")
+    if not sweep_path.is_file():
+        return None
+    with open(sweep_path, "r", encoding="utf-8") as file:
+        return json.load(file)
@@ -46,21 +46,40 @@ function plot_julia_set(sx, sy, values::Array{UInt8, 2}, working_dir::String)
     mv(joinpath(working_dir, alias * ".png"), joinpath(working_dir, alias))
 end
 
-function simulate(working_dir)
+function simulate(working_dir; resolution=5000)::Bool
     config_file = joinpath(working_dir, "aliased_config.json")
     if !isfile(config_file)
         println("Error: Could not find config file '$config_file'")
-        return
+        return false
     end
 
     try
         config = JSON.parsefile(config_file)
         c = Float64(config["c_re"]) + Float64(config["c_im"]) * 1im
-        plot_julia_set(3.0, 2.0, julia_set(3.0, 2.0, 5000, 5000, c), working_dir)
+        plot_julia_set(
+            3.0, 2.0, julia_set(3.0, 2.0, resolution, resolution, c), working_dir
+        )
     catch e
         println("Error: Could not parse JSON in config file: $e")
-        return
+        return false
     end
 
     println("Success: Simulation complete")
+    return true
+end
+
+
+function warm_up()
+    # runs a tiny simulation in a temporary directory, so the JIT compilation of the
+    # simulation and plotting code happens once when the scanner starts and not in the
+    # first run
+    working_dir = mktempdir()
+    open(joinpath(working_dir, "aliased_config.json"), "w") do f
+        JSON.print(f, Dict("c_re" => -0.744, "c_im" => 0.148))
+    end
+    open(joinpath(working_dir, "file_index.json"), "w") do f
+        JSON.print(f, Dict("forward" => Dict(), "reverse" => Dict()))
+    end
+    simulate(working_dir; resolution=10)
+    rm(working_dir, recursive=true)
 end
@@ -1,5 +1,8 @@
 #!/bin/bash
-julia -e 'using Pkg; Pkg.activate("."); Pkg.add(["Dates", "Printf", "JSON", "Plots", "UUIDs"]);'
-julia --threads=$SIM_NR_THREADS --project=. ./scanner.jl &
+julia -e 'using Pkg; Pkg.activate("."); Pkg.add(["Dates", "Printf", "JSON", "Plots", "SHA", "Sockets", "UUIDs"]);'
+# the scanner is restarted when it exits for recycling. the additional interactive thread
+# keeps it responsive to dispatch notifications while simulations are running
+while true; do julia --threads=$SIM_NR_THREADS,1 --project=. ./scanner.jl; done &
+python3 -m sim_api.retention &
 flask run --port 5000 &
 wait
\ No newline at end of file
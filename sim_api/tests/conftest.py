@@ -0,0 +1,36 @@
+"""Fixtures shared by the unit tests."""
+import pytest
+from sim_api import util, retention, metrics, api
+
+@pytest.fixture(name="tree", autouse=True)
+def fixture_tree(tmp_path, monkeypatch):
+    """Fixture pointing runs, blobs, sweeps and cached results to a temporary directory, so
+    tests never write to the working tree and the retention rules are never applied to its
+    runs."""
+    runs_path = tmp_path / "runs"
+    runs_path.mkdir()
+    monkeypatch.setattr(util, "APP_ROOT", tmp_path)
+    monkeypatch.setattr(util, "REGISTRY_PATH", runs_path / "registry")
+    monkeypatch.setattr(util, "REGISTRY_LOCK_PATH", runs_path / "registry.lock")
+    monkeypatch.setattr(util, "DISPATCH_SOCKET_PATH", runs_path / "dispatch.sock")
+    monkeypatch.setattr(util, "QUEUE_PATH", runs_path / "queue")
+    monkeypatch.setattr(util, "HEALTH_PATH", runs_path / "scanner_health")
+    monkeypatch.setattr(util, "BLOBS_PATH", tmp_path / "blobs")
+    monkeypatch.setattr(util, "SWEEPS_PATH", tmp_path / "sweeps")
+    monkeypatch.setattr(util, "RESULT_CACHE_PATH", tmp_path / "result_cache")
+    monkeypatch.setattr(retention, "APP_ROOT", tmp_path)
+    monkeypatch.setattr(retention, "RUNS_PATH", runs_path)
+    monkeypatch.setattr(retention, "REGISTRY_PATH", runs_path / "registry")
+    monkeypatch.setattr(retention, "REGISTRY_LOCK_PATH", runs_path / "registry.lock")
+    monkeypatch.setattr(retention, "BLOBS_PATH", tmp_path / "blobs")
+    monkeypatch.setattr(retention, "RESULT_CACHE_PATH", tmp_path / "result_cache")
+    monkeypatch.setattr(retention, "DISK_USAGE_PATH", runs_path / "disk_usage")
+    monkeypatch.setattr(metrics, "DURATIONS_PATH", runs_path / "durations")
+    monkeypatch.setattr(metrics, "REGISTRY_PATH", runs_path / "registry")
+    monkeypatch.setattr(metrics, "QUEUE_PATH", runs_path / "queue")
+    # the logs keep their read offsets, which belong to the files of another test
+    monkeypatch.setattr(metrics, "REGISTRY_LOG", metrics.RegistryLog())
+    monkeypatch.setattr(metrics, "DURATIONS_LOG", metrics.DurationsLog())
+    monkeypatch.setattr(api, "DURATIONS_LOG", metrics.DURATIONS_LOG)
+    monkeypatch.setattr(api, "APP_ROOT", tmp_path)
+    return tmp_path
@@ -1,11 +1,24 @@
 """Unit tests for module api."""
+import threading
+import gzip
+import zipfile
+import tarfile
 import uuid
+import json
+import hashlib
 from pathlib import Path
 from io import BytesIO
 import pytest
 from werkzeug.datastructures import FileStorage
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
 from sim_api.api import get_app
-from sim_api.util import save_file_for_run, create_run_dir, get_run_status, load_file_index
+from sim_api import api, util, metrics
+from sim_api.metrics import RegistryLog
+from sim_api.retention import compact_run
+from sim_api.util import save_file_for_run, create_run_dir, get_run_status, load_file_index, \
+    update_run_status, get_result_cache_info, store_blob, file_index_lock, \
+    write_file_index
 
 @pytest.fixture(name="app")
 def fixture_app():
@@ -59,9 +72,9 @@ def test_endpoint_start_simulation_good_input(client):
     # check config was aliased
     file_index = load_file_index(run_id)
     alias = file_index["forward"]["some_file.csv"]
-    assert Path(Path(__file__).resolve().parent.parent / "runs" / run_id / alias).exists()
+    assert Path(util.APP_ROOT / "runs" / run_id / alias).exists()
     alias_config_path = Path(
-        Path(__file__).resolve().parent.parent / "runs" / run_id / "aliased_config.json"
+        util.APP_ROOT / "runs" / run_id / "aliased_config.json"
     )
     with open(alias_config_path, "r", encoding="utf-8") as file:
         content = file.read()
@@ -95,3 +108,649 @@ def test_endpoint_download_file_good_input(client):
     # put bytestream into string and check
     content = response.data.decode("utf-8")
     assert content == "Lorem ipsum"
+
+def test_endpoint_download_file_range_and_etag(client):
+    """Tests endpoint download_file with range requests and conditional requests."""
+    # set up run
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    file_raw_str = """Lorem ipsum dolor sit amet"""
+    file_fs = FileStorage(BytesIO(file_raw_str.encode("utf8")), filename="output.txt")
+    save_file_for_run(run_id, file_fs)
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+
+    # full download via GET sets length and etag
+    response = client.get(
+        "/download_file/" + run_id, query_string={"filename": "output.txt"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == str(len(file_raw_str))
+    assert response.data.decode("utf-8") == file_raw_str
+    etag = response.headers["ETag"]
+    assert etag
+
+    # resume with a range request
+    response = client.get(
+        "/download_file/" + run_id, query_string={"filename": "output.txt"},
+        headers={**headers, "Range": "bytes=6-10"}
+    )
+    assert response.status_code == 206
+    assert response.data.decode("utf-8") == "ipsum"
+    assert response.headers["Content-Range"] == f"bytes 6-10/{len(file_raw_str)}"
+
+    # unchanged file is not sent again
+    response = client.get(
+        "/download_file/" + run_id, query_string={"filename": "output.txt"},
+        headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+
+def test_endpoint_upload_files_good_input(client):
+    """Tests endpoint upload_files with multiple files."""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+
+    response = client.post("/upload_files/" + run_id, data={
+        "files": [
+            (BytesIO(f"profile {idx}".encode("utf8")), f"profile_{idx}.csv")
+            for idx in range(5)
+        ]
+    }, headers={
+        "Authorization": "Bearer 123456789abcdef"
+    }, content_type="multipart/form-data")
+
+    assert response.status_code == 200
+    assert response.json["filenames"] == [f"profile_{idx}.csv" for idx in range(5)]
+
+    file_index = load_file_index(run_id)
+    for idx in range(5):
+        alias = file_index["forward"][f"profile_{idx}.csv"]
+        path = Path(util.APP_ROOT / "runs" / run_id / alias)
+        with open(path, "r", encoding="utf-8") as file:
+            assert file.read() == f"profile {idx}"
+
+def test_endpoint_upload_files_bad_filename(client):
+    """Tests endpoint upload_files with one invalid filename."""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+
+    response = client.post("/upload_files/" + run_id, data={
+        "files": [
+            (BytesIO(b"fine"), "fine.csv"),
+            (BytesIO(b"hidden"), ".hidden.csv")
+        ]
+    }, headers={
+        "Authorization": "Bearer 123456789abcdef"
+    }, content_type="multipart/form-data")
+
+    assert response.status_code == 400
+    assert "not valid" in response.json["error"]
+    assert load_file_index(run_id)["forward"] == {}
+
+def test_endpoints_known_hashes_and_link_files(client):
+    """Tests that uploaded content is stored once and can be linked to other runs."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    content = uuid.uuid4().hex.encode("utf8")
+    file_hash = hashlib.sha256(content).hexdigest()
+    unknown_hash = hashlib.sha256(content + b"-").hexdigest()
+    runs_dir = Path(util.APP_ROOT / "runs")
+
+    response = client.post("/known_hashes", json={"hashes": [file_hash]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json["known"] == []
+
+    # upload to a first run
+    first_run_id = uuid.uuid4().hex
+    create_run_dir(first_run_id)
+    save_file_for_run(first_run_id, FileStorage(BytesIO(content), filename="weather.csv"))
+    assert load_file_index(first_run_id)["hashes"]["weather.csv"] == file_hash
+
+    response = client.post(
+        "/known_hashes", json={"hashes": [file_hash, unknown_hash]}, headers=headers
+    )
+    assert response.json["known"] == [file_hash]
+
+    # link to a second run without uploading
+    second_run_id = uuid.uuid4().hex
+    create_run_dir(second_run_id)
+    response = client.post("/link_files/" + second_run_id, json={
+        "files": {"weather.csv": file_hash}
+    }, headers=headers)
+    assert response.status_code == 200
+
+    first_path = runs_dir / first_run_id / load_file_index(first_run_id)["forward"]["weather.csv"]
+    second_path = runs_dir / second_run_id / load_file_index(second_run_id)["forward"]["weather.csv"]
+    assert second_path.read_bytes() == content
+    assert first_path.stat().st_ino == second_path.stat().st_ino
+
+    # unknown hashes are rejected
+    response = client.post("/link_files/" + second_run_id, json={
+        "files": {"other.csv": unknown_hash}
+    }, headers=headers)
+    assert response.status_code == 400
+    assert "other.csv" not in load_file_index(second_run_id)["forward"]
+
+def test_endpoint_link_files_collected_blob(client, monkeypatch):
+    """Tests that a blob collected by the retention after it was checked is reported as
+    unknown hash, so the client uploads the file instead."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    file_hash = store_blob(BytesIO(b"collected"))
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+
+    def blob_exists_until_collected(checked_hash):
+        # the blob existed when it was checked, but is collected right after
+        (util.BLOBS_PATH / checked_hash).unlink(missing_ok=True)
+        return True
+    monkeypatch.setattr(api, "blob_exists", blob_exists_until_collected)
+
+    response = client.post("/link_files/" + run_id, json={
+        "files": {"weather.csv": file_hash}
+    }, headers=headers)
+    assert response.status_code == 400
+    assert "Unknown hash" in response.json["error"]
+    assert "weather.csv" not in load_file_index(run_id)["forward"]
+    assert list((util.APP_ROOT / "runs" / run_id).glob("*.tmp")) == []
+
+def test_endpoints_start_sweep_and_sweep_status(client):
+    """Tests starting a parameter sweep and querying its status."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    runs_dir = Path(util.APP_ROOT / "runs")
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(BytesIO(b"foo;bar"), filename="some_file.csv"))
+    config_raw_str = """{"c_re": 0.0, "c_im": 0.0, "input": {"file": "some_file.csv"}}"""
+    save_file_for_run(run_id, FileStorage(BytesIO(config_raw_str.encode("utf8")),
+                                          filename="config.json"))
+
+    response = client.post("/start_sweep/" + run_id, json={
+        "config_file": "config.json",
+        "parameters": {"c_re": [-0.7, -0.8], "c_im": [0.1, 0.2]},
+        "overrides": [{"input.scale": 2}]
+    }, headers=headers)
+    assert response.status_code == 200
+    run_ids = response.json["run_ids"]
+    assert len(run_ids) == 5
+
+    # each run has its own aliased config and shares the inputs of the base run
+    base_index = load_file_index(run_id)
+    for child_run_id in run_ids:
+        assert get_run_status(child_run_id)[0] == "waiting"
+        child_index = load_file_index(child_run_id)
+        assert child_index["hashes"]["some_file.csv"] == base_index["hashes"]["some_file.csv"]
+        with open(runs_dir / child_run_id / "aliased_config.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+        assert config["input"]["file"] == child_index["forward"]["some_file.csv"]
+    assert get_run_status(run_id)[0] == "new"
+
+    response = client.get("/sweep_status/" + response.json["sweep_id"], headers=headers)
+    assert response.status_code == 200
+    assert response.json["counts"] == {"waiting": 5}
+    variants = [run["variant"] for run in response.json["runs"]]
+    assert {(variant["c_re"], variant["c_im"]) for variant in variants[:4]} == {
+        (-0.7, 0.1), (-0.7, 0.2), (-0.8, 0.1), (-0.8, 0.2)
+    }
+    assert variants[4] == {"input.scale": 2}
+
+    # variants are applied to the config of their run
+    for child_run_id, variant in zip(run_ids, variants):
+        with open(runs_dir / child_run_id / "aliased_config.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if "c_re" in variant:
+            assert (config["c_re"], config["c_im"]) == (variant["c_re"], variant["c_im"])
+        else:
+            assert config["input"]["scale"] == 2
+
+def test_endpoint_start_sweep_bad_input(client):
+    """Tests endpoint start_sweep with bad parameters."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(BytesIO(b"{}"), filename="config.json"))
+
+    response = client.post("/start_sweep/" + run_id, json={
+        "config_file": "config.json", "parameters": {"c_re": 1.0}
+    }, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post("/start_sweep/" + run_id, json={
+        "config_file": "config.json"
+    }, headers=headers)
+    assert response.status_code == 400
+    assert "no variants" in response.json["error"]
+
+def test_endpoint_bulk_run_status(client):
+    """Tests endpoint run_status with multiple run IDs."""
+    run_ids = [uuid.uuid4().hex for _ in range(3)]
+    for run_id in run_ids:
+        create_run_dir(run_id)
+    update_run_status(run_ids[1], "finished")
+
+    response = client.post("/run_status", json={
+        "run_ids": run_ids + ["not an ID"]
+    }, headers={
+        "Authorization": "Bearer 123456789abcdef"
+    })
+    assert response.status_code == 200
+    runs = response.json["runs"]
+    assert [run["run_id"] for run in runs] == run_ids + ["not an ID"]
+    assert [run.get("code") for run in runs] == ["new", "finished", "new", None]
+    assert "error" in runs[3]
+
+def test_endpoint_run_status_events(client):
+    """Tests endpoint run_status/events for a run that finishes."""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    update_run_status(run_id, "finished")
+
+    response = client.get("/run_status/" + run_id + "/events", headers={
+        "Authorization": "Bearer 123456789abcdef"
+    })
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    # the stream ends after the event for the final status
+    events = response.data.decode("utf-8").strip().split("\n\n")
+    assert len(events) == 1
+    event_type, data = events[0].split("\n")
+    assert event_type == "event: status"
+    assert json.loads(data.removeprefix("data: "))["code"] == "finished"
+
+def test_endpoint_start_simulation_result_cache(client):
+    """Tests that endpoint start_simulation takes the results of a run with the same config
+    and inputs from the result cache."""
+    marker = uuid.uuid4().hex
+    run_ids = []
+    for data_filename in ("some_file.csv", "renamed_file.csv"):
+        run_id = uuid.uuid4().hex
+        create_run_dir(run_id)
+        save_file_for_run(run_id, FileStorage(
+            BytesIO(b"foo;bar\n0.1;0.2"), filename=data_filename
+        ))
+        config = {"marker": marker, "some_file": data_filename}
+        save_file_for_run(run_id, FileStorage(
+            BytesIO(json.dumps(config).encode("utf8")), filename="config.json"
+        ))
+        run_ids.append(run_id)
+
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    response = client.post(
+        "/start_simulation/" + run_ids[0], json={"config_file": "config.json"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert not response.json["cache_hit"]
+    assert get_run_status(run_ids[0])[0] == "waiting"
+
+    # store an output in the cache like the scanner does after the simulation
+    cache_info = get_result_cache_info(run_ids[0])
+    output_hash = store_blob(BytesIO(b"not really a png"))
+    util.RESULT_CACHE_PATH.mkdir(exist_ok=True)
+    with open(util.RESULT_CACHE_PATH / (cache_info["key"] + ".json"), "w", encoding="utf-8") as file:
+        json.dump({"outputs": {"julia_set.png": output_hash}, "size": 16}, file)
+
+    # same config and input content under another filename is a hit
+    response = client.post(
+        "/start_simulation/" + run_ids[1], json={"config_file": "config.json"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json["cache_hit"]
+    assert get_run_status(run_ids[1])[0] == "finished"
+
+    response = client.get("/run_status/" + run_ids[1], headers=headers)
+    assert response.json["cache_hit"]
+
+    response = client.get(
+        "/download_file/" + run_ids[1] + "?filename=julia_set.png", headers=headers
+    )
+    assert response.status_code == 200
+    assert response.data == b"not really a png"
+
+    # cached outputs are artifacts, the uploaded inputs are not
+    response = client.get("/artifacts/" + run_ids[1], headers=headers)
+    assert response.json["artifacts"] == [
+        {"filename": "julia_set.png", "size": 16, "sha256": output_hash}
+    ]
+
+def test_endpoint_metrics(client):
+    """Tests that endpoint metrics exposes request, run and duration metrics."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    update_run_status(run_id, "new")
+    client.get("/run_status/" + run_id, headers=headers)
+
+    with open(metrics.DURATIONS_PATH, "a", encoding="utf-8") as file:
+        file.write(f"{run_id}\t1.5\t42.0\ttrue\n")
+
+    response = client.get("/metrics", headers=headers)
+    assert response.status_code == 200
+    text = response.data.decode("utf-8")
+    assert 'sim_api_request_duration_seconds_count{endpoint="run_status",method="GET",' \
+        'status="200"}' in text
+    assert 'sim_api_runs{status="new"}' in text
+    assert "sim_api_queue_depth" in text
+    assert 'sim_api_run_simulation_seconds_count{outcome="success"}' in text
+
+    response = client.get("/metrics")
+    assert response.status_code == 403
+
+def test_registry_log(tmp_path, monkeypatch):
+    """Tests that the registry log keeps the latest status of each run and reads the
+    registry anew after it was replaced by a compacted copy."""
+    registry_path = tmp_path / "registry"
+    monkeypatch.setattr(metrics, "REGISTRY_PATH", registry_path)
+    run_ids = [uuid.uuid4().hex for _ in range(3)]
+    registry_path.write_text("".join(
+        f"{run_id}\tnew\tnow\n{run_id}\tfinished\tnow\n" for run_id in run_ids
+    ) + f"{run_ids[0]}\told\tnow\n{run_ids[1]}\twaiting")
+
+    registry_log = RegistryLog()
+    # the incomplete last line is not counted yet
+    assert registry_log.count_statuses() == {"finished": 2, "old": 1}
+    with open(registry_path, "a", encoding="utf-8") as file:
+        file.write("\tnow\n")
+    assert registry_log.count_statuses() == {"finished": 1, "old": 1, "waiting": 1}
+
+    compacted_path = tmp_path / "registry.tmp"
+    compacted_path.write_text(f"{run_ids[2]}\tfinished\tnow\n")
+    compacted_path.replace(registry_path)
+    assert registry_log.count_statuses() == {"finished": 1}
+
+def test_endpoint_run_profile(client):
+    """Tests that endpoint run_profile returns the timeline of status changes and the
+    profile written by the scanner."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    update_run_status(run_id, "waiting")
+
+    response = client.get("/run_profile/" + run_id, headers=headers)
+    assert response.status_code == 200
+    assert [entry["status"] for entry in response.json["timeline"]] == ["new", "waiting"]
+    assert response.json["timeline"][0]["duration"] >= 0
+    assert response.json["timeline"][1]["duration"] is None
+    assert response.json["profile"] is None
+
+    # the scanner writes timestamps in another format
+    run_dir = util.APP_ROOT / "runs" / run_id
+    with open(run_dir / "timeline", "a", encoding="utf-8") as file:
+        file.write("running\t2099-01-01T12:00:00.0\n")
+    with open(run_dir / "profile.json", "w", encoding="utf-8") as file:
+        json.dump({"wall_seconds": 1.5, "success": True}, file)
+
+    response = client.get("/run_profile/" + run_id, headers=headers)
+    assert response.json["timeline"][1]["duration"] > 0
+    assert response.json["profile"]["wall_seconds"] == 1.5
+
+@pytest.fixture(name="nextcloud")
+def fixture_nextcloud():
+    """Fixture for a fake WebDAV server, which serves and stores files in a dict and only
+    accepts the token `delegated`."""
+    files = {"/dav/config.json": b'{"c_re": -0.7}'}
+
+    @Request.application
+    def application(request):
+        if request.headers.get("Authorization") != "Bearer delegated":
+            return Response(status=401)
+        if request.method == "PUT":
+            files[request.path] = request.get_data()
+            return Response(status=201)
+        if request.path not in files:
+            return Response(status=404)
+        return Response(files[request.path])
+
+    server = make_server("127.0.0.1", 0, application, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/dav/", files
+    server.shutdown()
+
+def test_endpoints_import_and_export_nextcloud(app, client, nextcloud):
+    """Tests that endpoints import_from_nextcloud and export_to_nextcloud transfer files
+    with the delegated token and only from and to allowed URLs."""
+    base_url, nc_files = nextcloud
+    app.config["NEXTCLOUD_TRANSFER_BASE_URLS"] = [base_url]
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+
+    response = client.post("/import_from_nextcloud/" + run_id, json={
+        "token": "delegated", "files": {"config.json": base_url + "config.json"}
+    }, headers=headers)
+    assert response.status_code == 200
+    assert "config.json" in load_file_index(run_id)["forward"]
+
+    response = client.post("/export_to_nextcloud/" + run_id, json={
+        "token": "delegated", "files": {"config.json": base_url + "results/config.json"}
+    }, headers=headers)
+    assert response.status_code == 200
+    assert nc_files["/dav/results/config.json"] == b'{"c_re": -0.7}'
+
+    # other URLs, a rejected token and missing files are errors
+    for url in ("http://example.com/dav/config.json", base_url + "../config.json"):
+        response = client.post("/import_from_nextcloud/" + run_id, json={
+            "token": "delegated", "files": {"other.json": url}
+        }, headers=headers)
+        assert response.status_code == 403
+    response = client.post("/import_from_nextcloud/" + run_id, json={
+        "token": "expired", "files": {"other.json": base_url + "config.json"}
+    }, headers=headers)
+    assert response.status_code == 502
+    response = client.post("/import_from_nextcloud/" + run_id, json={
+        "token": "delegated", "files": {"other.json": base_url + "missing.json"}
+    }, headers=headers)
+    assert response.status_code == 502
+    assert "other.json" not in load_file_index(run_id)["forward"]
+
+def test_endpoints_upload_sessions(client):
+    """Tests a chunked upload with chunks sent out of order, a resumed missing chunk and
+    the check of the hash on finalizing."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    content = bytes(range(256)) * 100
+    chunk_size = 1000
+
+    response = client.post("/upload_sessions/" + run_id, json={
+        "filename": "profile.csv", "size": len(content)
+    }, headers=headers)
+    assert response.status_code == 200
+    session_url = "/upload_sessions/" + run_id + "/" + response.json["upload_id"]
+
+    # send all chunks but the second one in reverse order
+    offsets = list(range(0, len(content), chunk_size))
+    for offset in reversed(offsets):
+        if offset == chunk_size:
+            continue
+        response = client.put(
+            session_url + f"?offset={offset}",
+            data=content[offset:offset + chunk_size], headers=headers
+        )
+        assert response.status_code == 200
+    assert response.json["missing"] == [[chunk_size, 2 * chunk_size]]
+
+    response = client.post(session_url + "/finalize", json={
+        "sha256": hashlib.sha256(content).hexdigest()
+    }, headers=headers)
+    assert response.status_code == 409
+
+    # resume with the missing chunk
+    response = client.put(
+        session_url + f"?offset={chunk_size}",
+        data=content[chunk_size:2 * chunk_size], headers=headers
+    )
+    assert response.json["received"] == len(content)
+    assert response.json["missing"] == []
+
+    response = client.put(session_url + f"?offset={len(content)}", data=b"x", headers=headers)
+    assert response.status_code == 400
+    response = client.post(session_url + "/finalize", json={
+        "sha256": hashlib.sha256(b"other").hexdigest()
+    }, headers=headers)
+    assert response.status_code == 409
+
+    response = client.post(session_url + "/finalize", json={
+        "sha256": hashlib.sha256(content).hexdigest()
+    }, headers=headers)
+    assert response.status_code == 200
+    alias = load_file_index(run_id)["forward"]["profile.csv"]
+    with open(util.APP_ROOT / "runs" / run_id / alias, "rb") as file:
+        assert file.read() == content
+    assert client.get(session_url, headers=headers).status_code == 404
+
+def test_compressed_uploads_and_downloads(client):
+    """Tests that gzip encoded uploads are stored decompressed and that compressible
+    downloads are compressed, unless sent as range or already compressed."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    content = ("foo;bar\n" + "0.1;0.2\n" * 10000).encode("utf8")
+    boundary = "boundary"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; "
+        f"filename=\"data.csv\"\r\nContent-Type: text/csv\r\n\r\n"
+    ).encode("utf8") + content + f"\r\n--{boundary}--\r\n".encode("utf8")
+
+    response = client.post("/upload_files/" + run_id, data=gzip.compress(body), headers={
+        **headers, "Content-Encoding": "gzip",
+        "Content-Type": f"multipart/form-data; boundary={boundary}"
+    })
+    assert response.status_code == 200
+    alias = load_file_index(run_id)["forward"]["data.csv"]
+    with open(util.APP_ROOT / "runs" / run_id / alias, "rb") as file:
+        assert file.read() == content
+
+    response = client.get(
+        "/download_file/" + run_id + "?filename=data.csv",
+        headers={**headers, "Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(response.data) < len(content)
+    assert gzip.decompress(response.data) == content
+
+    # revalidating with the ETag of the compressed download skips the download
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/download_file/" + run_id + "?filename=data.csv",
+        headers={**headers, "Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    response = client.get(
+        "/download_file/" + run_id + "?filename=data.csv",
+        headers={**headers, "Accept-Encoding": "gzip", "Range": "bytes=0-6"}
+    )
+    assert response.status_code == 206
+    assert "Content-Encoding" not in response.headers
+    assert response.data == b"foo;bar"
+
+    # PNG images are compressed already
+    save_file_for_run(run_id, FileStorage(BytesIO(b"\x89PNG" * 1000), filename="image.png"))
+    response = client.get(
+        "/download_file/" + run_id + "?filename=image.png",
+        headers={**headers, "Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in response.headers
+
+    response = client.post("/upload_files/" + run_id, data=b"data", headers={
+        **headers, "Content-Encoding": "br"
+    })
+    assert response.status_code == 415
+
+def test_endpoints_artifacts_and_download_artifacts(client):
+    """Tests the manifest of artifacts written by the scanner and the bulk download of a
+    selection of them as zip archive."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(BytesIO(b"{}"), filename="config.json"))
+
+    # write outputs like the scanner does, without hashes in the file index
+    outputs = {
+        "julia_set.png": b"\x89PNG" + bytes(range(256)) * 4,
+        "results.csv": b"time;value\n" + b"0;0.5\n" * 1000,
+        "summary.json": b'{"converged": true}',
+    }
+    run_dir = util.APP_ROOT / "runs" / run_id
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        for filename, content in outputs.items():
+            alias = uuid.uuid4().hex
+            (run_dir / alias).write_bytes(content)
+            file_index["forward"][filename] = alias
+            file_index["reverse"][alias] = filename
+        write_file_index(run_id, file_index)
+
+    update_run_status(run_id, "running")
+    response = client.get("/artifacts/" + run_id, headers=headers)
+    assert response.status_code == 409
+
+    update_run_status(run_id, "finished")
+    response = client.get("/artifacts/" + run_id, headers=headers)
+    assert response.status_code == 200
+    assert response.json["artifacts"] == [
+        {
+            "filename": filename,
+            "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest()
+        }
+        for filename, content in sorted(outputs.items())
+    ]
+    assert response.json["total_size"] == sum(len(content) for content in outputs.values())
+    assert set(load_file_index(run_id)["outputs"]) == set(outputs)
+
+    response = client.post("/download_artifacts/" + run_id, json={
+        "filenames": ["julia_set.png", "results.csv"]
+    }, headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    with zipfile.ZipFile(BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == ["julia_set.png", "results.csv"]
+        assert archive.read("julia_set.png") == outputs["julia_set.png"]
+        assert archive.read("results.csv") == outputs["results.csv"]
+        # only the CSV compresses well
+        assert archive.getinfo("julia_set.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("results.csv").compress_type == zipfile.ZIP_DEFLATED
+
+    response = client.post("/download_artifacts/" + run_id, json={}, headers=headers)
+    with zipfile.ZipFile(BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == sorted(outputs)
+
+    # inputs are not artifacts
+    response = client.post("/download_artifacts/" + run_id, json={
+        "filenames": ["config.json"]
+    }, headers=headers)
+    assert response.status_code == 400
+
+def test_endpoint_download_archive(client):
+    """Tests that the archive of the artifacts of an old run can be downloaded."""
+    headers = {"Authorization": "Bearer 123456789abcdef"}
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(BytesIO(b"{}"), filename="config.json"))
+    alias = uuid.uuid4().hex
+    (util.APP_ROOT / "runs" / run_id / alias).write_bytes(b"1,2,3")
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        file_index["forward"]["out.csv"] = alias
+        file_index["reverse"][alias] = "out.csv"
+        write_file_index(run_id, file_index)
+    update_run_status(run_id, "finished")
+
+    response = client.get("/download_archive/" + run_id, headers=headers)
+    assert response.status_code == 404
+
+    compact_run(run_id, "compress")
+    update_run_status(run_id, "old")
+    response = client.get("/download_file/" + run_id + "?filename=out.csv", headers=headers)
+    assert response.status_code == 410
+
+    response = client.get("/download_archive/" + run_id, headers=headers)
+    assert response.status_code == 200
+    with tarfile.open(fileobj=BytesIO(response.data)) as archive:
+        assert archive.getnames() == ["out.csv"]
+        assert archive.extractfile("out.csv").read() == b"1,2,3"
@@ -0,0 +1,155 @@
+"""Unit tests for module retention."""
+import os
+import time
+import uuid
+import json
+import tarfile
+from io import BytesIO
+from pathlib import Path
+from werkzeug.datastructures import FileStorage
+from sim_api import util, retention
+from sim_api.util import create_run_dir, save_file_for_run, update_run_status, \
+    get_run_status, load_file_index, store_blob, alias_config_file, file_index_lock, \
+    write_file_index
+from sim_api.retention import apply_retention, get_disk_usage, ARTIFACTS_ARCHIVE_NAME
+
+def add_output(run_id: str, filename: str, content: bytes) -> None:
+    """Writes an output file to the given run and its file index, like the scanner does."""
+    alias = uuid.uuid4().hex
+    (util.APP_ROOT / "runs" / run_id / alias).write_bytes(content)
+    with file_index_lock(run_id):
+        file_index = load_file_index(run_id)
+        file_index["forward"][filename] = alias
+        file_index["reverse"][alias] = filename
+        write_file_index(run_id, file_index)
+
+def set_up_run(status: str, age: float, outputs: dict|None = None) -> str:
+    """Creates a run with an input file, a config file, the given outputs and the given
+    status, which was last changed the given number of seconds ago."""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(
+        BytesIO(f"content of {run_id}".encode("utf8")), filename="input.json"
+    ))
+    config_alias = save_file_for_run(run_id, FileStorage(
+        BytesIO(json.dumps({"run": run_id, "input": "input.json"}).encode("utf8")),
+        filename="config.json"
+    ))
+    alias_config_file(run_id, config_alias)
+    for filename, content in (outputs or {}).items():
+        add_output(run_id, filename, content)
+    update_run_status(run_id, status)
+    run_dir = Path(util.APP_ROOT / "runs" / run_id)
+    changed = time.time() - age
+    os.utime(run_dir / "status", (changed, changed))
+    os.utime(run_dir, (changed, changed))
+    return run_id
+
+def age_blob(file_hash: str, age: float) -> None:
+    """Sets the modification time of the given blob to the given number of seconds ago."""
+    changed = time.time() - age
+    os.utime(util.BLOBS_PATH / file_hash, (changed, changed))
+
+def test_apply_retention(tree):
+    """Tests that apply_retention marks, compacts and removes runs by their age."""
+    config = {
+        "RETENTION_RUN_TTL": 1000,
+        "RETENTION_OLD_RUN_ACTION": "compress",
+        "RETENTION_OLD_RUN_TTL": 1000,
+        "RETENTION_ABANDONED_RUN_TTL": 1000,
+        "RESULT_CACHE_MAX_SIZE": 100,
+    }
+    recent_run_id = set_up_run("finished", 10)
+    finished_run_id = set_up_run("finished", 2000, {"out.csv": b"1,2,3"})
+    old_run_id = set_up_run("old", 2000)
+    abandoned_run_id = set_up_run("new", 2000)
+    waiting_run_id = set_up_run("waiting", 2000)
+    for file_hash in load_file_index(old_run_id)["hashes"].values():
+        age_blob(file_hash, 2 * retention.BLOB_GRACE_SECONDS)
+    util.RESULT_CACHE_PATH.mkdir()
+    for index in range(2):
+        entry_path = util.RESULT_CACHE_PATH / f"key{index}.json"
+        entry_path.write_text(json.dumps({"outputs": {}, "size": 100}))
+        os.utime(entry_path, (1000 + index, 1000 + index))
+
+    stats = apply_retention(config)
+    assert stats["marked_old"] == 1
+    assert stats["removed_old"] == 1
+    assert stats["removed_abandoned"] == 1
+    # the least recently used entry is evicted, so the cache fits into its size
+    assert stats["evicted_cache_entries"] == 1
+    assert [path.name for path in util.RESULT_CACHE_PATH.iterdir()] == ["key1.json"]
+    # the input and config of the removed old run are not linked anymore, the ones of the
+    # abandoned run are too young to be removed
+    assert stats["removed_blobs"] == 2
+    # each run was created and set to its status, the compacted one was then marked old.
+    # the latest lines of the three remaining runs are kept
+    assert stats["registry_lines_removed"] == 5 * 2 + 1 - 3
+
+    runs_path = tree / "runs"
+    assert get_run_status(recent_run_id)[0] == "finished"
+    assert get_run_status(waiting_run_id)[0] == "waiting"
+    assert not (runs_path / old_run_id).exists()
+    assert not (runs_path / abandoned_run_id).exists()
+
+    # the old run keeps its file index, but its outputs are moved to the archive and the
+    # links to its inputs are removed, whose content stays in the blob store
+    assert get_run_status(finished_run_id)[0] == "old"
+    file_index = load_file_index(finished_run_id)
+    assert not (runs_path / finished_run_id / file_index["forward"]["input.json"]).exists()
+    assert not (runs_path / finished_run_id / file_index["forward"]["out.csv"]).exists()
+    assert (util.BLOBS_PATH / file_index["hashes"]["input.json"]).exists()
+    with tarfile.open(runs_path / finished_run_id / ARTIFACTS_ARCHIVE_NAME) as archive:
+        assert archive.getnames() == ["out.csv"]
+        content = archive.extractfile("out.csv").read()
+    assert content == b"1,2,3"
+    # the config stays in place
+    assert (runs_path / finished_run_id / file_index["forward"]["config.json"]).exists()
+    assert (runs_path / finished_run_id / "aliased_config.json").exists()
+
+    # a second pass has nothing left to do
+    stats = apply_retention(config)
+    assert stats == {
+        "marked_old": 0, "removed_old": 0, "removed_abandoned": 0, "bytes_freed": 0,
+        "evicted_cache_entries": 0, "removed_blobs": 0, "registry_lines_removed": 0
+    }
+
+    # the registry keeps the latest status of the remaining runs only
+    lines = (runs_path / "registry").read_text().splitlines()
+    assert [line.split("\t")[:2] for line in lines] == [
+        [recent_run_id, "finished"], [waiting_run_id, "waiting"], [finished_run_id, "old"]
+    ]
+
+def test_collect_blobs():
+    """Tests that collect_blobs only removes old blobs that are neither linked into a run
+    nor part of a cached result."""
+    unused_hash = store_blob(BytesIO(b"unused"))
+    young_hash = store_blob(BytesIO(b"young"))
+    cached_hash = store_blob(BytesIO(b"cached"))
+    run_id = set_up_run("finished", 0)
+    linked_hashes = list(load_file_index(run_id)["hashes"].values())
+    for file_hash in [unused_hash, cached_hash] + linked_hashes:
+        age_blob(file_hash, 2 * retention.BLOB_GRACE_SECONDS)
+    util.RESULT_CACHE_PATH.mkdir()
+    (util.RESULT_CACHE_PATH / "key.json").write_text(json.dumps({
+        "outputs": {"out.png": cached_hash}, "size": 6
+    }))
+
+    nr_removed, freed = retention.collect_blobs(time.time())
+    assert (nr_removed, freed) == (1, len(b"unused"))
+    assert sorted(path.name for path in util.BLOBS_PATH.iterdir()) == sorted(
+        [young_hash, cached_hash] + linked_hashes
+    )
+
+def test_get_disk_usage():
+    """Tests that get_disk_usage counts runs by status and blobs."""
+    run_ids = [set_up_run("finished", 0), set_up_run("finished", 0), set_up_run("new", 0)]
+    usage = get_disk_usage()
+    assert usage["runs"]["finished"]["runs"] == 2
+    assert usage["runs"]["new"]["runs"] == 1
+    # inputs linked into runs are counted for the blobs only
+    assert usage["blobs"]["files"] == 2 * len(run_ids)
+    assert usage["blobs"]["bytes"] == sum(
+        path.stat().st_size for path in util.BLOBS_PATH.iterdir()
+    )
+    assert usage["disk"]["total"] > 0
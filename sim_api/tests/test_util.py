@@ -1,10 +1,18 @@
 """Unit tests for module util."""
+import os
 import uuid
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
 from io import BytesIO
+import pytest
 from werkzeug.datastructures import FileStorage
+from sim_api import util
 from sim_api.util import validate_run_id, validate_uploaded_filename, save_file_for_run, \
-    create_run_dir, parse_key_from_auth_header
+    create_run_dir, parse_key_from_auth_header, update_run_status, notify_scanner, \
+    get_queue_position, get_scanner_health, load_file_index, alias_references
 
 def test_validate_run_id():
     """Tests for validate_run_id for common good/bad cases."""
@@ -60,7 +68,7 @@ def test_save_file_for_run():
     create_run_dir(run_id)
     file = FileStorage(BytesIO("file contents".encode("utf8")), filename="test.txt")
     filename = save_file_for_run(run_id, file)
-    assert Path(Path(__file__).resolve().parent.parent / "runs" / run_id / filename).exists
+    assert Path(util.APP_ROOT / "runs" / run_id / filename).exists
 
     # malicious file is circumvented
     run_id = uuid.uuid4().hex
@@ -70,7 +78,7 @@ def test_save_file_for_run():
         filename=("../path/traversal/" + '"' + "\n" + "escape.sh")
     )
     filename = save_file_for_run(run_id, file)
-    assert Path(Path(__file__).resolve().parent.parent / "runs" / run_id / filename).exists
+    assert Path(util.APP_ROOT / "runs" / run_id / filename).exists
 
 def test_parse_key_from_auth_header():
     """Tests for parse_key_from_auth_header"""
@@ -81,3 +89,187 @@ def test_parse_key_from_auth_header():
     assert not parse_key_from_auth_header("")
     assert not parse_key_from_auth_header("82fhj39whf")
     assert not parse_key_from_auth_header("flisdahf isuadfhsadi 92374239")
+
+def test_update_run_status_appends_to_registry():
+    """Tests that status changes are appended to the run registry"""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    update_run_status(run_id, "waiting")
+
+    with open(util.REGISTRY_PATH, "r", encoding="utf-8") as file:
+        entries = [line.split("\t") for line in file.read().splitlines()]
+    entries = [entry for entry in entries if entry[0] == run_id]
+    assert [entry[1] for entry in entries] == ["new", "waiting"]
+
+def test_notify_scanner():
+    """Tests for notify_scanner with and without a listening scanner"""
+    if util.DISPATCH_SOCKET_PATH.exists():
+        util.DISPATCH_SOCKET_PATH.unlink()
+    assert not notify_scanner()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(util.DISPATCH_SOCKET_PATH))
+        server.listen(1)
+        try:
+            assert notify_scanner()
+        finally:
+            util.DISPATCH_SOCKET_PATH.unlink()
+
+def test_get_queue_position():
+    """Tests for get_queue_position"""
+    run_ids = [uuid.uuid4().hex for _ in range(3)]
+    with open(util.QUEUE_PATH, "w", encoding="utf-8") as file:
+        file.write("".join(run_id + "\n" for run_id in run_ids))
+    try:
+        assert get_queue_position(run_ids[0]) == 1
+        assert get_queue_position(run_ids[2]) == 3
+        assert get_queue_position(uuid.uuid4().hex) is None
+    finally:
+        util.QUEUE_PATH.unlink()
+    assert get_queue_position(run_ids[0]) is None
+
+def test_get_scanner_health():
+    """Tests for get_scanner_health with recent and outdated heartbeats"""
+    started = datetime.now() - timedelta(hours=1)
+    try:
+        with open(util.HEALTH_PATH, "w", encoding="utf-8") as file:
+            file.write(f"{datetime.now().isoformat()}\n7\n{started.isoformat()}")
+        health = get_scanner_health()
+        assert health["healthy"]
+        assert health["runs_processed"] == 7
+
+        with open(util.HEALTH_PATH, "w", encoding="utf-8") as file:
+            file.write(f"{started.isoformat()}\n7\n{started.isoformat()}")
+        assert not get_scanner_health()["healthy"]
+    finally:
+        util.HEALTH_PATH.unlink()
+    assert not get_scanner_health()["healthy"]
+
+def test_save_file_for_run_concurrently():
+    """Tests that concurrent uploads to the same run don't lose file index entries"""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+
+    def upload(idx):
+        file = FileStorage(BytesIO(f"content {idx}".encode("utf8")), filename=f"{idx}.csv")
+        return save_file_for_run(run_id, file)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        aliases = list(executor.map(upload, range(32)))
+
+    file_index = load_file_index(run_id)
+    assert len(file_index["forward"]) == 32
+    for idx, alias in enumerate(aliases):
+        assert file_index["forward"][f"{idx}.csv"] == alias
+        assert file_index["reverse"][alias] == f"{idx}.csv"
+
+def test_load_file_index_sees_external_changes():
+    """Tests that the cached file index is reloaded when another process writes it"""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    save_file_for_run(run_id, FileStorage(BytesIO(b"a"), filename="input.csv"))
+    file_index = load_file_index(run_id)
+    assert "input.csv" in file_index["forward"]
+
+    # modifying the returned index does not affect the cache
+    file_index["forward"]["bogus"] = "bogus"
+    assert "bogus" not in load_file_index(run_id)["forward"]
+
+    # write as the scanner would, by replacing the file
+    file_index["forward"]["output.png"] = "some-alias"
+    index_path = util.APP_ROOT / "runs" / run_id / "file_index.json"
+    temp_path = index_path.with_name("file_index.json.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(file_index, file)
+    temp_path.replace(index_path)
+    assert "output.png" in load_file_index(run_id)["forward"]
+
+def test_file_index_cache_is_bounded():
+    """Tests that the cache of file indices keeps the most recently used ones only and
+    forgets removed runs."""
+    run_ids = []
+    for _ in range(3):
+        run_id = uuid.uuid4().hex
+        create_run_dir(run_id)
+        save_file_for_run(run_id, FileStorage(BytesIO(b"a"), filename="input.csv"))
+        run_ids.append(run_id)
+
+    cache = util._file_index_cache # pylint: disable=protected-access
+    util.set_file_index_cache_size(2)
+    try:
+        for run_id in run_ids:
+            load_file_index(run_id)
+        # using the second run again makes the third the least recently used
+        load_file_index(run_ids[1])
+        assert list(cache) == [run_ids[2], run_ids[1]]
+
+        run_dir = util.APP_ROOT / "runs" / run_ids[1]
+        for path in run_dir.iterdir():
+            path.unlink()
+        run_dir.rmdir()
+        assert load_file_index(run_ids[1]) == {"forward": {}, "reverse": {}}
+        assert list(cache) == [run_ids[2]]
+    finally:
+        util.set_file_index_cache_size(1000)
+
+def test_alias_references():
+    """Tests for alias_references"""
+    forward = {"a.csv": "alias-a", "data.csv": "alias-data", "config.json": "alias-config"}
+    config = {
+        "weather": "data.csv",
+        "profiles": ["a.csv", "input/a.csv", "missing.csv"],
+        "a.csv": {"description": "mentions a.csv in text", "value": 1.5, "flag": True},
+        "nothing": None
+    }
+    aliased = alias_references(config, forward)
+
+    # whole values and path components are replaced, the longer name is not mixed up
+    # with the shorter one it contains
+    assert aliased["weather"] == "alias-data"
+    assert aliased["profiles"] == ["alias-a", "input/alias-a", "missing.csv"]
+    # keys, free text and other types are left as is
+    assert aliased["a.csv"] == {"description": "mentions a.csv in text", "value": 1.5,
+                                "flag": True}
+    assert aliased["nothing"] is None
+    # the input is not modified
+    assert config["weather"] == "data.csv"
+
+def test_evict_result_cache(tmp_path):
+    """Tests that evict_result_cache removes the least recently used entries and their
+    blobs unless they are still linked elsewhere."""
+    util.RESULT_CACHE_PATH.mkdir()
+
+    hashes = [util.store_blob(BytesIO(f"output {index}".encode("utf8"))) for index in range(3)]
+    # the second output is still linked into a run
+    os.link(util.BLOBS_PATH / hashes[1], tmp_path / "linked")
+    for index, file_hash in enumerate(hashes):
+        entry_path = util.RESULT_CACHE_PATH / f"key{index}.json"
+        entry_path.write_text(json.dumps({"outputs": {"out.png": file_hash}, "size": 100}))
+        os.utime(entry_path, (1000 + index, 1000 + index))
+
+    assert util.evict_result_cache(300) == 0
+    assert util.evict_result_cache(100) == 2
+    assert sorted(path.name for path in util.RESULT_CACHE_PATH.iterdir()) == ["key2.json"]
+    assert not (util.BLOBS_PATH / hashes[0]).exists()
+    assert (util.BLOBS_PATH / hashes[1]).exists()
+    assert (util.BLOBS_PATH / hashes[2]).exists()
+
+def test_write_upload_chunk_rejects_before_writing():
+    """Tests that chunks exceeding the file or the chunk size are rejected before anything
+    is written, so the bytes received before stay intact."""
+    run_id = uuid.uuid4().hex
+    create_run_dir(run_id)
+    upload_id = util.create_upload_session(run_id, "profile.csv", 100)
+    data_path = util.upload_session_path(run_id, upload_id) / "data"
+    assert util.write_upload_chunk(run_id, upload_id, 0, BytesIO(b"a" * 100), 100, 50) == 100
+
+    # the chunks overlap the received bytes and go past the end of the file
+    for length in (60, None):
+        with pytest.raises(ValueError):
+            util.write_upload_chunk(run_id, upload_id, 50, BytesIO(b"b" * 60), length, 100)
+    # chunks of unknown length are limited to the chunk size
+    with pytest.raises(ValueError):
+        util.write_upload_chunk(run_id, upload_id, 0, BytesIO(b"c" * 60), None, 50)
+
+    assert data_path.read_bytes() == b"a" * 100
+    assert util.get_upload_session(run_id, upload_id)["received"] == 100
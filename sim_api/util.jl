@@ -1,20 +1,122 @@
 using UUIDs
 using JSON
+using SHA
+
+const LOCK_SH = 1
+const LOCK_EX = 2
+const LOCK_UN = 8
+const BLOBS_PATH = "blobs"
+const RESULT_CACHE_PATH = "result_cache"
+
+function with_file_lock(f, lock_path, operation=LOCK_EX)
+    # same lock as used by the API, so read-modify-write cycles of both do not overlap
+    open(lock_path, "a") do lock_file
+        ccall(:flock, Cint, (Cint, Cint), fd(lock_file), operation)
+        try
+            return f()
+        finally
+            ccall(:flock, Cint, (Cint, Cint), fd(lock_file), LOCK_UN)
+        end
+    end
+end
 
 function update_file_index(working_dir, filename)
     file_index_path = joinpath(working_dir, "file_index.json")
     alias = string(UUIDs.uuid4()) # lowercase is important to differentiate constructor from conversion
 
-    try
-        file_index = JSON.parsefile(file_index_path)
-        file_index["forward"][filename] = alias
-        file_index["reverse"][alias] = filename
-        open(file_index_path, "w") do f
-            JSON.print(f, file_index, 4)
+    with_file_lock(joinpath(working_dir, "file_index.lock")) do
+        try
+            file_index = JSON.parsefile(file_index_path)
+            file_index["forward"][filename] = alias
+            file_index["reverse"][alias] = filename
+            # replace the index by renaming, so readers never see it half-written
+            temp_path = file_index_path * "." * string(UUIDs.uuid4()) * ".tmp"
+            open(temp_path, "w") do f
+                JSON.print(f, file_index)
+            end
+            mv(temp_path, file_index_path, force=true)
+        catch e
+            println("Error: Could not parse file index JSON: $e")
         end
-    catch e
-        println("Error: Could not parse file index JSON: $e")
     end
 
     return alias
-end
\ No newline at end of file
+end
+
+function output_files(working_dir)
+    # outputs are all files in the index that were not uploaded, which the API records
+    # with their hash. returns the paths of the outputs by filename
+    file_index = with_file_lock(joinpath(working_dir, "file_index.lock")) do
+        JSON.parsefile(joinpath(working_dir, "file_index.json"))
+    end
+    inputs = get(file_index, "hashes", Dict())
+    outputs = Dict{String, String}()
+    for (filename, alias) in file_index["forward"]
+        file_path = joinpath(working_dir, alias)
+        if !haskey(inputs, filename) && isfile(file_path)
+            outputs[filename] = file_path
+        end
+    end
+    return outputs
+end
+
+function record_output_hashes(working_dir, hashes)
+    # the API lists the outputs with their hashes in the manifest of artifacts and only
+    # calculates hashes that are not recorded yet
+    file_index_path = joinpath(working_dir, "file_index.json")
+    with_file_lock(joinpath(working_dir, "file_index.lock")) do
+        file_index = JSON.parsefile(file_index_path)
+        merge!(get!(file_index, "outputs", Dict()), hashes)
+        temp_path = file_index_path * "." * string(UUIDs.uuid4()) * ".tmp"
+        open(temp_path, "w") do f
+            JSON.print(f, file_index)
+        end
+        mv(temp_path, file_index_path, force=true)
+    end
+end
+
+function store_in_result_cache(working_dir)
+    # the API writes the cache key when the run is started, if results are cached at all.
+    # the outputs are added to the blob store, from which the API links them into later
+    # runs with the same key
+    info_path = joinpath(working_dir, "result_cache.json")
+    if !isfile(info_path)
+        return
+    end
+    info = JSON.parsefile(info_path)
+    if info["hit"]
+        return
+    end
+
+    outputs = Dict{String, String}()
+    total_size = 0
+    mkpath(BLOBS_PATH)
+    for (filename, file_path) in output_files(working_dir)
+        file_hash = open(file_path, "r") do f
+            bytes2hex(sha256(f))
+        end
+        blob_path = joinpath(BLOBS_PATH, file_hash)
+        if !isfile(blob_path)
+            # blobs are shared between runs, so they must never be modified
+            temp_path = blob_path * "." * string(UUIDs.uuid4()) * ".tmp"
+            try
+                hardlink(file_path, temp_path)
+            catch
+                cp(file_path, temp_path)
+            end
+            chmod(temp_path, 0o444)
+            mv(temp_path, blob_path, force=true)
+        end
+        outputs[filename] = file_hash
+        total_size += filesize(file_path)
+    end
+    record_output_hashes(working_dir, outputs)
+
+    mkpath(RESULT_CACHE_PATH)
+    entry_path = joinpath(RESULT_CACHE_PATH, info["key"] * ".json")
+    temp_path = entry_path * "." * string(UUIDs.uuid4()) * ".tmp"
+    open(temp_path, "w") do f
+        JSON.print(f, Dict("outputs" => outputs, "size" => total_size))
+    end
+    mv(temp_path, entry_path, force=true)
+end
@@ -0,0 +1,108 @@
+"""Load test of the proxy routes of the webapp.
+
+Sends many concurrent requests to a route of a running webapp and reports the throughput
+and latency percentiles. To compare serving modes independent of the real sim API, the
+script can also run a fake sim API, which answers status requests after a fixed delay
+like a slow upstream would.
+
+Usage:
+    # terminal 1: fake sim API answering after 0.5 s on port 5000
+    python benchmarks/load_test.py upstream --port 5000 --delay 0.5
+
+    # terminal 2: the webapp with `sim_api.endpoint` pointing to the fake sim API, e.g.
+    WEBAPP_SERVER=gunicorn ./start.sh
+
+    # terminal 3: 2000 requests, 200 at a time
+    python benchmarks/load_test.py run --url http://localhost:5001/run_status/<run_id> \\
+        --requests 2000 --concurrency 200
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+def run_upstream(port: int, delay: float):
+    """Runs a fake sim API, which answers every request with a finished run status after
+    the given delay in seconds."""
+
+    @Request.application
+    def application(request):
+        time.sleep(delay)
+        run_id = request.path.rstrip("/").split("/")[-1]
+        return Response(
+            '{"run_id": "' + run_id + '", "code": "finished", '
+            '"timestamp": "2015-01-01 12:00:00", "queue_position": null}',
+            mimetype="application/json"
+        )
+
+    server = make_server("0.0.0.0", port, application, threaded=True)
+    print(f"Fake sim API listening on port {port} with a delay of {delay} s")
+    server.serve_forever()
+
+def run_load(url: str, nr_requests: int, concurrency: int, timeout: float):
+    """Sends the given number of GET requests to the URL with the given number of them in
+    flight at a time and prints the results."""
+    local = threading.local()
+
+    def get_session() -> requests.Session:
+        # one session per client thread, so connections are reused like a browser would
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.mount("http://", HTTPAdapter(pool_maxsize=1))
+        return local.session
+
+    def send(_) -> tuple[bool,float]:
+        started = time.perf_counter()
+        try:
+            response = get_session().get(url, timeout=timeout)
+            success = response.ok
+        except requests.RequestException:
+            success = False
+        return success, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(nr_requests)))
+    duration = time.perf_counter() - started
+
+    latencies = sorted(latency for success, latency in results if success)
+    nr_failed = sum(1 for success, _ in results if not success)
+    print(f"requests:    {nr_requests} ({nr_failed} failed), {concurrency} concurrent")
+    print(f"duration:    {duration:.2f} s")
+    print(f"throughput:  {nr_requests / duration:.1f} requests/s")
+    if len(latencies) > 0:
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 \
+            else [latencies[0]] * 99
+        print(
+            f"latency:     p50 {quantiles[49]:.3f} s, p90 {quantiles[89]:.3f} s, "
+            f"p99 {quantiles[98]:.3f} s, max {latencies[-1]:.3f} s"
+        )
+
+def main():
+    """Parses the command line arguments and runs the chosen command."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upstream = commands.add_parser("upstream", help="run a fake sim API")
+    upstream.add_argument("--port", type=int, default=5000)
+    upstream.add_argument("--delay", type=float, default=0.5)
+
+    load = commands.add_parser("run", help="send requests to the webapp")
+    load.add_argument("--url", required=True)
+    load.add_argument("--requests", type=int, default=1000)
+    load.add_argument("--concurrency", type=int, default=100)
+    load.add_argument("--timeout", type=float, default=60)
+
+    args = parser.parse_args()
+    if args.command == "upstream":
+        run_upstream(args.port, args.delay)
+    else:
+        run_load(args.url, args.requests, args.concurrency, args.timeout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark of the WebDAV PROPFIND response parsers in `simon_webapp.util`.
+
+Compares the runtime and peak memory of `parse_webdav_files_response`, which builds the whole
+element tree of a buffered response, with `iter_webdav_files`, which parses a streamed
+response incrementally, for synthetic directory listings of different sizes. Both keep the
+list of parsed entries, as `list_directory` does, so the difference is the memory of the
+buffered body and of the element tree.
+
+Usage (from the webapp directory with the package installed):
+    python benchmarks/webdav_parser.py [nr_entries ...]
+"""
+import io
+import sys
+import time
+import tracemalloc
+from simon_webapp.util import parse_webdav_files_response, iter_webdav_files
+
+USERNAME = "benchmark"
+CHUNK_SIZE = 64 * 1024
+
+HEADER = (
+    '<?xml version="1.0"?>\n'
+    '<d:multistatus xmlns:d="DAV:" xmlns:s="http://sabredav.org/ns"'
+    ' xmlns:oc="http://owncloud.org/ns" xmlns:nc="http://nextcloud.org/ns">'
+)
+FOOTER = "</d:multistatus>"
+ENTRY = (
+    "<d:response><d:href>/remote.php/dav/files/" + USERNAME + "/data/file_{0}.json</d:href>"
+    "<d:propstat><d:prop><d:getcontenttype>application/json</d:getcontenttype>"
+    "<d:resourcetype/><d:getetag>&quot;{0:032x}&quot;</d:getetag></d:prop>"
+    "<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+)
+
+def generate_listing(nr_entries: int):
+    """Yields the XML of a listing with the given number of entries chunk-wise, like a
+    streamed response body arrives."""
+    buffer = [HEADER]
+    size = len(HEADER)
+    for index in range(nr_entries):
+        entry = ENTRY.format(index)
+        buffer.append(entry)
+        size += len(entry)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+    buffer.append(FOOTER)
+    yield "".join(buffer).encode()
+
+class ChunkStream(io.RawIOBase):
+    """Minimal file-like object reading from an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.rest = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.rest) == 0:
+            try:
+                self.rest = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.rest))
+        buffer[:size] = self.rest[:size]
+        self.rest = self.rest[size:]
+        return size
+
+def measure(function) -> tuple[float,float,int]:
+    """Runs the given function and returns its runtime in seconds, its peak memory in MiB
+    and its result."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1024 / 1024, result
+
+def buffered(nr_entries: int) -> int:
+    # the whole body is downloaded before parsing, like with `response.content`
+    content = b"".join(generate_listing(nr_entries))
+    _, files = parse_webdav_files_response(content, USERNAME)
+    return len(files)
+
+def streamed(nr_entries: int) -> int:
+    # the entries are kept like `list_directory` does, which caches the whole listing
+    stream = ChunkStream(generate_listing(nr_entries))
+    files = list(iter_webdav_files(stream, USERNAME))
+    return len(files)
+
+def main(sizes: list[int]):
+    print(f"{'entries':>10} {'parser':>10} {'time [s]':>10} {'peak [MiB]':>12}")
+    for nr_entries in sizes:
+        for name, parser in (("buffered", buffered), ("streamed", streamed)):
+            duration, peak, count = measure(lambda: parser(nr_entries))
+            assert count == nr_entries
+            print(f"{nr_entries:>10} {name:>10} {duration:>10.3f} {peak:>12.1f}")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
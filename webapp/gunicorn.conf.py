@@ -0,0 +1,21 @@
+"""Configuration of gunicorn for serving the webapp in production, see start.sh.
+
+Most routes of the webapp wait for responses of the sim API or NextCloud. With the gevent
+worker class, gunicorn patches blocking I/O so that a waiting request yields to others
+instead of pinning a thread, which lets a single process hold hundreds of concurrent
+status polls, event streams and file transfers. One process is the default, as access
+tokens, NextCloud sessions and cached directory listings are kept per process.
+"""
+import os
+
+bind = "0.0.0.0:" + os.environ.get("WEBAPP_PORT", "5001")
+worker_class = os.environ.get("WEBAPP_WORKER_CLASS", "gevent")
+workers = int(os.environ.get("WEBAPP_WORKERS", "1"))
+# max. number of concurrent requests per worker with the gevent worker class
+worker_connections = int(os.environ.get("WEBAPP_WORKER_CONNECTIONS", "1000"))
+# event streams and file transfers can be open for a long time, so workers are only
+# restarted if they do not report back at all
+timeout = int(os.environ.get("WEBAPP_WORKER_TIMEOUT", "120"))
+# the app must be loaded after the worker patched blocking I/O
+preload_app = False
+accesslog = "-"
@@ -4,17 +4,28 @@
 from __future__ import annotations
 
 from pathlib import Path
-import io
+from contextlib import ExitStack
+from functools import partial
+import mimetypes
+import tempfile
+import zipfile
 import uuid
 import os
+import hmac
 from urllib.parse import urlencode, quote
-import requests
 import yaml
 import debugpy
-from flask import Flask, render_template, jsonify, request, session, url_for, redirect
+from flask import Flask, Response, render_template, jsonify, request, session, url_for, \
+    redirect
 from flask_session import Session
-from .nc_requests import ensure_request, fetch_access_token, WEBDAV_REQUEST_PROPFIND_DATA
-from .util import parse_webdav_files_response, filename_from_nc_path, encode_nc_path
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from .metrics import init_metrics, REGISTRY
+from .compression import init_compression, gzip_chunks
+from .nc_requests import ensure_request, fetch_access_token, store_tokens, forget_user, \
+    list_directory, get_delegated_token, put_files
+from .sim_api_client import sim_api_request
+from .util import filename_from_nc_path, encode_nc_path, \
+    stream_multipart_files, SizedStream, TRANSFER_CHUNK_SIZE
 
 if os.environ.get("FLASK_ENV") == "development":
     debugpy.listen(("0.0.0.0", 5002))
@@ -45,6 +56,12 @@ def get_app():
 # set session to be managed server-side
 Session(app)
 
+# record metrics of every request
+init_metrics(app)
+
+# compress responses the browser accepts compressed
+init_compression(app)
+
 # ---------------------------------------------------------------------------
 # Routes
 # ---------------------------------------------------------------------------
@@ -62,6 +79,30 @@ def index():
         session["nextcloud_authorized"] = False
     return render_template("index.html", session=session), 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Metrics route, which is served only if `METRICS_ENABLED` is set. If `METRICS_TOKEN`
+    is set too, the token must be sent as bearer token in the authorization header.
+
+    Request body: None
+
+    Response (text): The metrics in the Prometheus text format, which are:
+        - webapp_request_duration_seconds: histogram of the response time by endpoint,
+            method and status code
+        - webapp_request_bytes_total and webapp_response_bytes_total: bytes received and
+            sent by endpoint
+        - webapp_sim_api_request_duration_seconds: histogram of the latency of requests to
+            the sim API by route
+    """
+    if not app.config.get("METRICS_ENABLED", False):
+        return jsonify({"error": "Metrics are disabled"}), 404
+    token = app.config.get("METRICS_TOKEN", "")
+    if token != "" and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), "Bearer " + token
+    ):
+        return jsonify({"error": "Metrics token is missing or not valid"}), 403
+    return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST), 200
+
 @app.route("/nextcloud_login", methods=["GET"])
 def nextcloud_login():
     """NextCloud login route.
@@ -96,10 +137,12 @@ def nextcloud_logout():
     if not ("nextcloud_authorized" in session and session["nextcloud_authorized"]):
         return redirect(url_for("index"))
 
+    forget_user(session["user_id"])
     session["user_id"] = "__anonymous__"
     session["nextcloud_authorized"] = False
     session["nextcloud_access_token"] = None
     session["nextcloud_refresh_token"] = None
+    session["nextcloud_token_expires_at"] = None
 
     return redirect(url_for("index"))
 
@@ -139,10 +182,9 @@ def callback_nextcloud():
     if not refresh_token:
         return jsonify({"error": "Could not find refresh token in reponse"}), 400
 
-    session["nextcloud_access_token"] = access_token
-    session["nextcloud_refresh_token"] = refresh_token
-    session["nextcloud_authorized"] = True
     session["user_id"] = response_data.get("user_id")
+    store_tokens(response_data)
+    session["nextcloud_authorized"] = True
 
     return redirect(url_for("index"))
 
@@ -171,11 +213,7 @@ def get_run_id():
         }
     """
     run_id = None
-    response = requests.get(
-        app.config["sim_api"]["endpoint"] + "get_run_id",
-        timeout=app.config["sim_api"]["timeout"],
-        headers={"Authorization": "Bearer " + app.config["sim_api"]["api_key"]}
-    )
+    response = sim_api_request(app, "GET", "get_run_id")
     if response.ok:
         data = response.json()
         run_id = data["run_id"] if "run_id" in data else None
@@ -226,11 +264,9 @@ def start_simulation_from_form(run_id):
         return jsonify({"error": "Must be given value for selected config file"}), 500
 
     # start simulation
-    response = requests.post(
-        app.config["sim_api"]["endpoint"] + "start_simulation/" + run_id,
-        json={"config_file": input_file},
-        timeout=app.config["sim_api"]["timeout"],
-        headers={"Authorization": "Bearer " + app.config["sim_api"]["api_key"]}
+    response = sim_api_request(
+        app, "POST", "start_simulation/" + run_id,
+        json={"config_file": input_file}
     )
     if not response.ok:
         return jsonify({"error": "Could not start simulation"}), 500
@@ -250,15 +286,14 @@ def run_status(run_id):
             "code": "new",                                # status code, one of:
                                                           # [new, waiting, running,
                                                           # finished, old]
-            "timestamp": "2015-01-01 12:00:00"            # server time (default UTC), when
+            "timestamp": "2015-01-01 12:00:00",           # server time (default UTC), when
                                                           # the status was written
+            "queue_position": 3                           # position in the queue of
+                                                          # waiting runs, starting at 1,
+                                                          # or null if not queued (yet)
         }
     """
-    response = requests.get(
-        app.config["sim_api"]["endpoint"] + "run_status/" + run_id,
-        timeout=app.config["sim_api"]["timeout"],
-        headers={"Authorization": "Bearer " + app.config["sim_api"]["api_key"]}
-    )
+    response = sim_api_request(app, "GET", "run_status/" + run_id)
     if response.ok:
         data = response.json()
         if "error" in data:
@@ -267,44 +302,209 @@ def run_status(run_id):
     else:
         return jsonify({"error": "Could not get run status from sim API"}), 501
 
+@app.route('/run_status', methods=['POST'])
+def bulk_run_status():
+    """Endpoint: POST /run_status
+
+    Request arguments (JSON):
+        - run_ids -> list[str]: The IDs of the runs to which the status is requested
+
+    Response (JSON):
+        {
+            "runs": [...] # the status of each run as for endpoint run_status
+        }
+    """
+    args = request.json
+    if not isinstance(args.get("run_ids"), list):
+        return jsonify({"error": "Must be given list of run IDs"}), 400
+
+    response = sim_api_request(
+        app, "POST", "run_status",
+        json={"run_ids": args["run_ids"]}
+    )
+    if not response.ok:
+        return jsonify({"error": "Could not get run status from sim API"}), 501
+    return response.json(), 200
+
+@app.route('/run_status/<run_id>/events', methods=['GET'])
+def run_status_events(run_id):
+    """Endpoint: GET /run_status/<str:run_id>/events
+
+    Relays the server-sent events of the run status from the sim API. An event is sent
+    immediately and then whenever the status changes.
+
+    Request arguments:
+        - run_id -> str: The ID of the run to which the status is requested
+
+    Response (text/event-stream): Events of type `status` with data as in the response of
+    endpoint run_status
+    """
+    sim_response = sim_api_request(
+        app, "GET", "run_status/" + run_id + "/events",
+        stream=True
+    )
+    if not sim_response.ok:
+        sim_response.close()
+        return jsonify({"error": "Could not get run status from sim API"}), 501
+
+    def events():
+        with sim_response:
+            yield from sim_response.iter_content(chunk_size=None)
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache"
+    })
+
 @app.route('/fetch_results/<run_id>', methods=['POST'])
 def fetch_results(run_id):
     """Endpoint: POST /fetch_results/<str:run_id>
 
+    Transfers the artifacts of the run to NC in one pass. The artifacts are listed in the
+    manifest of the sim API, fetched as one zip archive and uploaded to NC in parallel.
+
     Request arguments (route):
         - run_id -> str: The ID of the run for which to fetch results
     Request arguments (json):
         - destination_dir -> str: The directory path on NC to where the results should
             be uploaded. This should be a NC-encoded path.
+        - filenames -> list[str]: (Optional) The artifacts to transfer. Defaults to all.
 
-    Response (ByteStream): The results file
+    Response (JSON):
+        {
+            "artifacts": [       # the transferred artifacts, which can be fetched for
+                {                # display with route result_file
+                    "filename": "julia_set.png",
+                    "size": 345678,
+                    "sha256": "..."
+                }
+            ]
+        }
+
+    If `NEXTCLOUD_DIRECT_TRANSFER` is enabled, the sim API uploads the results to NC
+    itself, so they do not pass through the webapp.
     """
-    file_name = "julia_set.png" # will be dynamic later
     if "destination_dir" not in request.json:
         return jsonify({"error": "No destination specified"}), 400
 
-    # fetch file from sim API
-    sim_response = requests.post(
-        app.config["sim_api"]["endpoint"] + "download_file/" + run_id,
-        json={"filename": file_name},
-        timeout=app.config["sim_api"]["timeout"],
-        headers={"Authorization": "Bearer " + app.config["sim_api"]["api_key"]}
+    manifest_response = sim_api_request(app, "GET", "artifacts/" + run_id)
+    if not manifest_response.ok:
+        return jsonify({"error": "Could not get artifacts from sim API: "
+                        + f"{manifest_response.status_code} {manifest_response.reason}"}), 500
+    artifacts = manifest_response.json()["artifacts"]
+    if "filenames" in request.json:
+        filenames = request.json["filenames"]
+        unknown = set(filenames) - {artifact["filename"] for artifact in artifacts}
+        if len(unknown) > 0:
+            return jsonify({"error": f"Unknown artifacts: {', '.join(sorted(unknown))}"}), 400
+        artifacts = [artifact for artifact in artifacts if artifact["filename"] in filenames]
+    if len(artifacts) == 0:
+        return jsonify({"artifacts": []}), 200
+
+    user = quote(session["user_id"])
+    urls = {
+        artifact["filename"]: app.config["NEXTCLOUD_API_BASE_URL"] + "remote.php/dav/files/"
+            + user + "/" + encode_nc_path(
+                request.json["destination_dir"] + "/" + artifact["filename"]
+            )
+        for artifact in artifacts
+    }
+
+    if app.config.get("NEXTCLOUD_DIRECT_TRANSFER", False):
+        token = get_delegated_token(app)
+        if token is None:
+            return jsonify({"error": "Login to NextCloud has expired"}), 401
+        export_response = sim_api_request(
+            app, "POST", "export_to_nextcloud/" + run_id,
+            json={"token": token, "files": urls}
+        )
+        if not export_response.ok:
+            return jsonify({"error": "Could not upload results to NextCloud"}), 500
+        return jsonify({"artifacts": artifacts}), 200
+
+    sim_response = sim_api_request(
+        app, "POST", "download_artifacts/" + run_id,
+        json={"filenames": list(urls)},
+        stream=True
     )
     if not sim_response.ok:
+        sim_response.close()
         return jsonify({"error": "Could not fetch results from sim API"}), 500
 
-    # upload to NC
-    user = quote(session["user_id"])
-    destination = request.json["destination_dir"] + "/" + file_name
-    url = app.config["NEXTCLOUD_API_BASE_URL"] + "remote.php/dav/files/" + user \
-        + "/" + encode_nc_path(destination)
-    nc_response = ensure_request(url, app, method="PUT", data=sim_response.content)
+    # the archive is relayed chunk-wise into a temporary file, as reading the members of a
+    # zip archive requires seeking. only one chunk is held in memory regardless of its size
+    with tempfile.TemporaryFile() as archive_file:
+        with sim_response:
+            for chunk in sim_response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE):
+                archive_file.write(chunk)
+        archive_file.seek(0)
+
+        def open_member(archive, info):
+            return SizedStream(archive.open(info), info.file_size)
+
+        try:
+            with zipfile.ZipFile(archive_file) as archive:
+                failed = put_files(app, {
+                    url: partial(open_member, archive, archive.getinfo(filename))
+                    for filename, url in urls.items()
+                })
+        except (zipfile.BadZipFile, KeyError):
+            return jsonify({"error": "Received a broken archive from sim API"}), 502
+
+    if len(failed) > 0:
+        return jsonify({"error": "Could not upload results to NextCloud: "
+                        + ", ".join(str(code) for code in sorted(set(failed.values())))}), 500
+    return jsonify({"artifacts": artifacts}), 200
+
+@app.route('/result_file/<run_id>', methods=['GET'])
+def result_file(run_id):
+    """Endpoint: GET /result_file/<str:run_id>
+
+    Relays a result file from the sim API, e.g. for displaying images in the frontend.
+    Conditional requests with `If-None-Match` are passed on, so browsers can cache files.
 
-    if not nc_response.ok:
-        return jsonify({"error": "Could not upload results to NextCloud"}), 500
+    Request arguments (route):
+        - run_id -> str: The ID of the run of which the file is requested
+    Request arguments (query):
+        - filename -> str: The name of the file
 
-    # return results so the frontend can display them too
-    return sim_response.content, 200
+    Response (ByteStream): The file
+    """
+    filename = request.args.get("filename")
+    if not filename:
+        return jsonify({"error": "Missing argument `filename`"}), 400
+
+    headers = {}
+    if "If-None-Match" in request.headers:
+        headers["If-None-Match"] = request.headers["If-None-Match"]
+    sim_response = sim_api_request(
+        app, "GET", "download_file/" + run_id,
+        params={"filename": filename},
+        headers=headers,
+        stream=True
+    )
+    # the body is decoded while relayed, so it gets the ETag of the uncompressed file. the
+    # webapp compresses the relayed file itself if the browser accepts it
+    etag = sim_response.headers.get("ETag", "").replace('-gzip"', '"')
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if sim_response.status_code == 304:
+        sim_response.close()
+        return Response(status=304, mimetype=mimetype, headers={"ETag": etag})
+    if not sim_response.ok:
+        sim_response.close()
+        return jsonify({"error": "Could not fetch file from sim API"}), 404
+
+    def relay():
+        with sim_response:
+            yield from sim_response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE)
+
+    response = Response(relay(), mimetype=mimetype)
+    if etag:
+        response.headers["ETag"] = etag
+    # a compressed response is decoded while relayed, so its length differs
+    if "Content-Length" in sim_response.headers \
+            and "Content-Encoding" not in sim_response.headers:
+        response.content_length = int(sim_response.headers["Content-Length"])
+    return response, 200
 
 @app.route('/get_files', methods=['POST'])
 def get_files(dir_path=""):
@@ -313,14 +513,29 @@ def get_files(dir_path=""):
     Request arguments (JSON):
         - dir_path -> str: The path to the directory for which the contents should be
             listed. This path is relative to the user's root directory.
+        - offset -> int: (Optional) The number of entries to skip. Defaults to 0.
+        - limit -> int: (Optional) The maximum number of entries to return. Defaults to
+            the configured `NEXTCLOUD_LISTING_PAGE_SIZE`.
 
-    Response (JSON): The file list
+    Response (JSON):
+        {
+            "files": [...], # the requested page of the file list, directories first
+            "total": 1234,  # the number of entries in the directory
+            "offset": 0,
+            "limit": 200
+        }
     """
     if not session["nextcloud_authorized"]:
         return jsonify({"error": "Must be logged in to NextCloud"}), 401
 
     args = request.json
     dir_path = args.get("dir_path")
+    page_size = app.config.get("NEXTCLOUD_LISTING_PAGE_SIZE", 200)
+    try:
+        offset = max(0, int(args.get("offset", 0)))
+        limit = min(max(1, int(args.get("limit", page_size))), 10 * page_size)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Arguments offset and limit must be integers"}), 400
 
     if dir_path != "":
         dir_path = encode_nc_path(dir_path)
@@ -328,24 +543,39 @@ def get_files(dir_path=""):
     user = quote(session["user_id"])
     url = app.config["NEXTCLOUD_API_BASE_URL"] + "remote.php/dav/files/" + user \
         + "/" + dir_path
-    response = ensure_request(url, app, method="PROPFIND", data=WEBDAV_REQUEST_PROPFIND_DATA)
-    success, files = parse_webdav_files_response(response.content, session["user_id"])
+    success, files = list_directory(app, url)
 
-    if response.ok and success:
-        return jsonify(files), 200
-    else:
+    if not success:
+        if not session.get("nextcloud_authorized"):
+            return jsonify({"error": "Login to NextCloud has expired"}), 401
         return jsonify({"error": "Could not fetch files from nextcloud"}), 500
 
+    # sorting on the server keeps pages consistent
+    files = sorted(files, key=lambda item: (not item["is_dir"], item["name"].lower()))
+    return jsonify({
+        "files": files[offset:offset + limit],
+        "total": len(files),
+        "offset": offset,
+        "limit": limit
+    }), 200
+
 @app.route('/upload_file_to_sim_run/<run_id>', methods=['POST'])
 def upload_file_to_sim_run(run_id):
     """Endpoint: POST /upload_file_to_sim_run/<run_id>
 
+    All given files are uploaded to the sim API in one request.
+
     Request arguments (HTTP):
         - run_id -> str: The ID of the run to which to upload to the file
     Request arguments (JSON):
         - file_path -> str: The NC-relative path of the file to upload
+        - file_paths -> list[str]: (Optional) The NC-relative paths of multiple files to
+            upload, instead of `file_path`
 
-    Response (JSON): The file list
+    Response: None
+
+    If `NEXTCLOUD_DIRECT_TRANSFER` is enabled, the sim API downloads the files from NC
+    itself, so they do not pass through the webapp.
     """
     if not session["nextcloud_authorized"]:
         return jsonify({"error": "Must be logged in to NextCloud"}), 401
@@ -355,25 +585,59 @@ def upload_file_to_sim_run(run_id):
                         + "a new run ID with the corresponding endpoint."}), 409
 
     args = request.json
-    file_path = encode_nc_path(args.get("file_path"))
-    filename = filename_from_nc_path(file_path)
+    file_paths = args.get("file_paths") or [args.get("file_path")]
+    if any(not file_path for file_path in file_paths):
+        return jsonify({"error": "Must be given path of file to upload"}), 400
 
     user = quote(session["user_id"])
-    url = app.config["NEXTCLOUD_API_BASE_URL"] + "remote.php/dav/files/" + user \
-        + "/" + file_path
-    response = ensure_request(url, app, method="GET")
-
-    if not response.ok:
-        return jsonify({"error": "Could not fetch file from NextCloud: "
-                       + f"{response.status_code} {response.reason}"}), 404
-
-    file_obj = io.BytesIO(response.content)
-    response = requests.post(
-        app.config["sim_api"]["endpoint"] + "upload_file/" + run_id,
-        files={"file": (filename, file_obj)},
-        timeout=app.config["sim_api"]["timeout"],
-        headers={"Authorization": "Bearer " + app.config["sim_api"]["api_key"]}
-    )
+    if app.config.get("NEXTCLOUD_DIRECT_TRANSFER", False):
+        urls = {}
+        for file_path in file_paths:
+            file_path = encode_nc_path(file_path)
+            urls[filename_from_nc_path(file_path)] = app.config["NEXTCLOUD_API_BASE_URL"] \
+                + "remote.php/dav/files/" + user + "/" + file_path
+        token = get_delegated_token(app)
+        if token is None:
+            return jsonify({"error": "Login to NextCloud has expired"}), 401
+        response = sim_api_request(
+            app, "POST", "import_from_nextcloud/" + run_id,
+            json={"token": token, "files": urls}
+        )
+        if not response.ok:
+            return jsonify({"error": "Could not import file from NextCloud: "
+                           + f"{response.status_code} {response.reason}"}), 500
+        return ("", 204)
+
+    with ExitStack() as stack:
+        # open all downloads from NC before uploading, so errors can be reported before
+        # anything is sent to the sim API. the content itself is not read yet
+        files = []
+        for file_path in file_paths:
+            file_path = encode_nc_path(file_path)
+            url = app.config["NEXTCLOUD_API_BASE_URL"] + "remote.php/dav/files/" + user \
+                + "/" + file_path
+            nc_response = stack.enter_context(
+                ensure_request(url, app, method="GET", stream=True)
+            )
+            if not nc_response.ok:
+                return jsonify({"error": "Could not fetch file from NextCloud: "
+                               + f"{nc_response.status_code} {nc_response.reason}"}), 404
+            files.append((
+                filename_from_nc_path(file_path),
+                nc_response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE)
+            ))
+
+        # relay the files chunk-wise from NC to the sim API without buffering them
+        content_type, body = stream_multipart_files("files", files)
+        headers = {"Content-Type": content_type}
+        if app.config["sim_api"].get("compress_uploads", False):
+            body = gzip_chunks(body)
+            headers["Content-Encoding"] = "gzip"
+        response = sim_api_request(
+            app, "POST", "upload_files/" + run_id,
+            data=body,
+            headers=headers
+        )
     if not response.ok:
         return jsonify({"error": "Could not upload file to sim API"}), 500
 
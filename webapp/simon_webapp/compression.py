@@ -0,0 +1,120 @@
+"""Compression of response bodies and of uploads to the sim API with gzip.
+
+Responses are compressed if the browser accepts gzip, the body is at least
+`COMPRESSION_MIN_SIZE` bytes and of a type that compresses well, e.g. the JSON of large
+directory listings. Already compressed types like PNG are sent as they are, and range
+requests and event streams are never compressed.
+
+Uploads to the sim API are compressed while they are streamed if `compress_uploads` is set
+in the sim API config. The sim API decompresses them before storing the files.
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import zlib
+from typing import Iterable, Iterator
+from flask import Flask, Response, request
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+# gzip format instead of the raw zlib format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def strip_gzip_etags(environ: dict) -> None:
+    """Removes the suffix of ETags of compressed responses from the conditional headers of
+    the given request, so views compare them with the ETag of the uncompressed content,
+    which they know, and answer with 304 or a range for compressed responses too."""
+    for key in ("HTTP_IF_NONE_MATCH", "HTTP_IF_RANGE"):
+        if key in environ:
+            environ[key] = environ[key].replace('-gzip"', '"')
+
+class GzipETagMiddleware:
+    """WSGI middleware stripping the suffix of compressed ETags from conditional headers,
+    see `strip_gzip_etags`."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        strip_gzip_etags(environ)
+        return self.wsgi_app(environ, start_response)
+
+def is_compressible(response: Response) -> bool:
+    """Checks if the type of the response body compresses well. Files are sent as
+    `application/octet-stream` at times, so their type is guessed from their filename."""
+    mimetype = response.mimetype or ""
+    if mimetype == "application/octet-stream":
+        filename = response.headers.get("Content-Disposition", "").rpartition("filename=")[2]
+        guessed_type, guessed_encoding = mimetypes.guess_type(filename.strip('"'))
+        if guessed_encoding is not None:
+            return False
+        mimetype = guessed_type or ""
+    if mimetype == "text/event-stream":
+        return False
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresses the given chunks with gzip while they are iterated."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def compress_response(response: Response, min_size: int) -> Response:
+    """Compresses the body of the given response with gzip if the browser accepts it and
+    the body is large enough and compressible."""
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code == 304
+        and "gzip" in request.accept_encodings
+        and is_compressible(response)
+    ):
+        # not modified responses carry the ETag of the response the client would get
+        etag, is_weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag + "-gzip", weak=is_weak)
+        return response
+    if (
+        "gzip" not in request.accept_encodings
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or request.headers.get("Range") is not None
+        or (response.content_length is not None and response.content_length < min_size)
+        or not is_compressible(response)
+    ):
+        return response
+
+    if response.direct_passthrough:
+        chunks = response.response
+        response.direct_passthrough = False
+    else:
+        chunks = response.iter_encoded()
+    response.response = gzip_chunks(chunks)
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers.pop("Content-Length", None)
+    # the compressed body differs from the plain one, so it must not share its ETag. the
+    # suffix is stripped from conditional headers of later requests by `strip_gzip_etags`
+    etag, is_weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(etag + "-gzip", weak=is_weak)
+    return response
+
+def init_compression(app: Flask) -> None:
+    """Registers the compression of responses with the given app. The minimum size of
+    compressed responses is set by `COMPRESSION_MIN_SIZE`."""
+    app.wsgi_app = GzipETagMiddleware(app.wsgi_app)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config.get("COMPRESSION_MIN_SIZE", 1024))
@@ -0,0 +1,58 @@
+"""Metrics of the webapp in the Prometheus text format.
+
+Request metrics are recorded by hooks around every request. The latency of requests to
+the sim API is recorded by the sim API client.
+"""
+
+from __future__ import annotations
+
+import time
+from flask import Flask, g, request
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+REGISTRY = CollectorRegistry()
+
+REQUEST_DURATION = Histogram(
+    "webapp_request_duration_seconds",
+    "Time until the response of a request was returned, by endpoint",
+    ["endpoint", "method", "status"],
+    registry=REGISTRY,
+)
+REQUEST_BYTES = Counter(
+    "webapp_request_bytes",
+    "Bytes received in request bodies by endpoint",
+    ["endpoint"],
+    registry=REGISTRY,
+)
+RESPONSE_BYTES = Counter(
+    "webapp_response_bytes",
+    "Bytes sent in response bodies with known length, e.g. fetched results, by endpoint",
+    ["endpoint"],
+    registry=REGISTRY,
+)
+SIM_API_REQUEST_DURATION = Histogram(
+    "webapp_sim_api_request_duration_seconds",
+    "Time until the response headers of requests to the sim API were received, by route",
+    ["route"],
+    registry=REGISTRY,
+)
+
+def init_metrics(app: Flask) -> None:
+    """Registers hooks with the given app that record metrics of every request."""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or "unknown"
+        if "request_started" in g:
+            REQUEST_DURATION.labels(
+                endpoint, request.method, str(response.status_code)
+            ).observe(time.perf_counter() - g.request_started)
+        if request.content_length:
+            REQUEST_BYTES.labels(endpoint).inc(request.content_length)
+        if response.content_length:
+            RESPONSE_BYTES.labels(endpoint).inc(response.content_length)
+        return response
@@ -1,40 +1,200 @@
 """Functions for performing requests to NextCloud using oauth authentication."""
+import threading
+import time
+from collections import OrderedDict
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Callable
 import requests
-from flask import session, url_for
+from requests.adapters import HTTPAdapter
+from flask import session, url_for, copy_current_request_context
+from .util import parse_webdav_files_response, iter_webdav_files
 
 WEBDAV_REQUEST_PROPFIND_DATA = """<?xml version="1.0" encoding="UTF-8"?>
     <d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns" xmlns:nc="http://nextcloud.org/ns">
       <d:prop>
         <d:getcontenttype/>
         <d:resourcetype/>
+        <d:getetag/>
       </d:prop>
     </d:propfind>"""
 
-def refresh_access_token(app, timeout=10):
+WEBDAV_REQUEST_PROPFIND_ETAG_DATA = """<?xml version="1.0" encoding="UTF-8"?>
+    <d:propfind xmlns:d="DAV:">
+      <d:prop>
+        <d:getetag/>
+      </d:prop>
+    </d:propfind>"""
+
+# sessions with kept-alive connections to NC by user ID, the least recently used first
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+# the newest tokens of each user by user ID. the flask session of a request is a copy, so
+# concurrent requests of a user pick up tokens refreshed by another request from here
+_tokens = {}
+_refresh_locks = {}
+_tokens_lock = threading.Lock()
+
+# directory listings by user ID and URL together with the ETag of the directory, the least
+# recently used first
+_listings = OrderedDict()
+_listings_lock = threading.Lock()
+
+def get_nc_session(app, user_id) -> requests.Session:
+    """Gets the session for requests of the given user to NC, creating it if necessary.
+
+    Each user has their own session, so connections are reused across their requests. The
+    number of sessions is limited by setting `NEXTCLOUD_MAX_SESSIONS`, closing the least
+    recently used ones.
+
+    Args:
+    -`app`: The flask app, used for settings
+    -`user_id:str`: The ID of the user
+    Returns:
+    -`requests.Session`: The session of the user
+    """
+    with _sessions_lock:
+        if user_id in _sessions:
+            _sessions.move_to_end(user_id)
+            return _sessions[user_id]
+
+        nc_session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=app.config.get("NEXTCLOUD_POOL_SIZE", 4))
+        nc_session.mount("http://", adapter)
+        nc_session.mount("https://", adapter)
+        _sessions[user_id] = nc_session
+
+        while len(_sessions) > app.config.get("NEXTCLOUD_MAX_SESSIONS", 100):
+            _, old_session = _sessions.popitem(last=False)
+            old_session.close()
+        return nc_session
+
+def store_tokens(response_data):
+    """Stores the tokens from the response to a token request in the session.
+
+    The expiry time of the access token is stored too, so it can be refreshed before it
+    expires. The tokens are also made available to concurrent requests of the same user.
+
+    Args:
+    -`response_data:dict`: The parsed JSON of the response to the token request
+    """
+    expires_in = response_data.get("expires_in")
+    session["nextcloud_access_token"] = response_data.get("access_token")
+    session["nextcloud_refresh_token"] = response_data.get("refresh_token")
+    session["nextcloud_token_expires_at"] = (
+        time.time() + float(expires_in) if expires_in is not None else None
+    )
+    with _tokens_lock:
+        _tokens[session["user_id"]] = {
+            "nextcloud_access_token": session["nextcloud_access_token"],
+            "nextcloud_refresh_token": session["nextcloud_refresh_token"],
+            "nextcloud_token_expires_at": session["nextcloud_token_expires_at"],
+        }
+
+def forget_user(user_id):
+    """Removes the tokens and session of the given user, e.g. after logging out."""
+    with _tokens_lock:
+        _tokens.pop(user_id, None)
+    with _sessions_lock:
+        nc_session = _sessions.pop(user_id, None)
+    if nc_session is not None:
+        nc_session.close()
+
+def _adopt_newest_tokens(user_id):
+    """Copies tokens refreshed by a concurrent request of the user into the session."""
+    with _tokens_lock:
+        tokens = _tokens.get(user_id)
+    if tokens is not None and tokens["nextcloud_access_token"] != session.get(
+        "nextcloud_access_token"
+    ):
+        for key, value in tokens.items():
+            session[key] = value
+
+def _token_expires_soon(app) -> bool:
+    """Checks if the access token in the session expires within the configured margin."""
+    expires_at = session.get("nextcloud_token_expires_at")
+    if expires_at is None:
+        return False
+    return expires_at - app.config.get("NEXTCLOUD_TOKEN_REFRESH_MARGIN", 60) < time.time()
+
+def refresh_access_token(app, timeout=10, rejected_token=None):
     """Fetches a new access token using the refresh token.
 
     The required tokens are stored in the session and the new token values are being written
     back to the session.
 
+    Refreshes are coalesced per user: Concurrent requests wait for the one refreshing the
+    tokens and then use its result. This is necessary as a refresh token can only be used
+    once.
+
     Args:
     -`app`: The flask app, used for accessing settings and the session
     -`timeout:int`: (Optional) Timeout in seconds for waiting for a response. Defaults to
         10 seconds.
+    -`rejected_token:str|None`: (Optional) The access token that was rejected by NC. If
+        given, the tokens are refreshed unless another request already replaced this token.
+        If not given, they are refreshed only if the access token expires soon.
+    Returns:
+    -`bool`: If the session holds a usable access token. If the refresh failed, e.g. as
+        the refresh token was revoked, the user is logged out and has to log in again
     """
-    response = requests.post(
-        app.config['NEXTCLOUD_ACCESS_TOKEN_URL'],
-        data={
-            'client_id': app.config['NEXTCLOUD_CLIENT_ID'],
-            'client_secret': app.config['NEXTCLOUD_SECRET'],
-            'grant_type': 'refresh_token',
-            'refresh_token': session['nextcloud_refresh_token'],
-        },
-        headers={'Accept': 'application/json'},
-        timeout=timeout
-    )
-    response_data = response.json()
-    session["nextcloud_access_token"] = response_data.get('access_token')
-    session["nextcloud_refresh_token"] = response_data.get('refresh_token')
+    user_id = session["user_id"]
+    with _tokens_lock:
+        refresh_lock = _refresh_locks.setdefault(user_id, threading.Lock())
+
+    with refresh_lock:
+        _adopt_newest_tokens(user_id)
+        if session.get("nextcloud_access_token") is None:
+            return False
+        if rejected_token is not None:
+            if session["nextcloud_access_token"] != rejected_token:
+                return True
+        elif not _token_expires_soon(app):
+            return True
+
+        response = requests.post(
+            app.config['NEXTCLOUD_ACCESS_TOKEN_URL'],
+            data={
+                'client_id': app.config['NEXTCLOUD_CLIENT_ID'],
+                'client_secret': app.config['NEXTCLOUD_SECRET'],
+                'grant_type': 'refresh_token',
+                'refresh_token': session['nextcloud_refresh_token'],
+            },
+            headers={'Accept': 'application/json'},
+            timeout=timeout
+        )
+        try:
+            response_data = response.json() if response.ok else {}
+        except ValueError:
+            response_data = {}
+        if "access_token" not in response_data:
+            # storing the tokens of a failed refresh would hand them to concurrent requests
+            forget_user(user_id)
+            session["nextcloud_authorized"] = False
+            session["nextcloud_access_token"] = None
+            session["nextcloud_refresh_token"] = None
+            session["nextcloud_token_expires_at"] = None
+            return False
+        store_tokens(response_data)
+        return True
+
+def get_delegated_token(app) -> str:
+    """Gets the access token of the user of the session for the sim API, which transfers
+    files from and to NC on behalf of the user.
+
+    Access tokens of NC are short-lived, so the token is refreshed first if it expires
+    within the configured margin. The sim API only uses it for one request.
+
+    Args:
+    -`app`: The flask app, used for settings
+    Returns:
+    -`str|None`: The access token, or None if it could not be refreshed and the user has to
+        log in again
+    """
+    if not refresh_access_token(app):
+        return None
+    return session["nextcloud_access_token"]
 
 def fetch_access_token(app, auth_code, timeout=10):
     """Performs the request to get the access and refresh tokens during the oauth login
@@ -62,7 +222,18 @@ def fetch_access_token(app, auth_code, timeout=10):
         timeout=timeout
     )
 
-def ensure_request(url, app, method="GET", data=None, json=None, headers=None, timeout=10):
+def unauthorized_response(url: str) -> requests.Response:
+    """Creates a response with status code 401 for a request to the given URL, which was
+    not sent as the user has no valid access token anymore."""
+    response = requests.Response()
+    response.status_code = 401
+    response.reason = "Unauthorized"
+    response.url = url
+    response._content = b""
+    return response
+
+def ensure_request(url, app, method="GET", data=None, json=None, headers=None, timeout=10,
+                   stream=False):
     """Performs a request to the configured NextCloud instance, ensuring the request is
     not being rejected due to an expired access token.
 
@@ -72,6 +243,9 @@ def ensure_request(url, app, method="GET", data=None, json=None, headers=None, t
     rejected with status code 401 or the response to the re-sent request if a new token was
     fetched in between.
 
+    Access tokens known to expire soon are refreshed before sending the request. Requests
+    are sent over the user's session from `get_nc_session`, which reuses connections.
+
     Args:
     -`url:str`: The URL of the request
     -`app`: The flask app, used for settings
@@ -87,31 +261,135 @@ def ensure_request(url, app, method="GET", data=None, json=None, headers=None, t
         headers are given. Defaults to None`.
     -`timeout:int`: (Optional) Timeout in seconds for waiting for a response. Defaults to
         10 seconds.
+    -`stream:bool`: (Optional) If true, the response body is not downloaded immediately
+        and can be consumed in chunks with `iter_content`. Defaults to `False`.
     Returns:
     -`HtmlResponse`: The response to the request.
     """
-    # ensure authorization header is set if not done so already
+    # ensure authorization header is set if not done so already. the access token is
+    # refreshed beforehand if it is about to expire, which saves a rejected request
     if headers is None:
         headers = {}
     if "Authorization" not in headers:
+        if not refresh_access_token(app):
+            return unauthorized_response(url)
         headers["Authorization"] = "Bearer " + session["nextcloud_access_token"]
 
     # try to fetch, refresh access token if necessary, and try again.
+    nc_session = get_nc_session(app, session["user_id"])
     for try_idx in range(0,2):
-        response = requests.request(
+        response = nc_session.request(
             method=method,
             url=url,
             data=data,
             json=json,
             timeout=timeout,
-            headers=headers
+            headers=headers,
+            stream=stream
         )
         if try_idx == 0 and response.status_code == 401:
             # assuming the 401 was due to an expired access token, we refresh it and try again
-            refresh_access_token(app)
+            if not refresh_access_token(
+                app, rejected_token=headers["Authorization"][len("Bearer "):]
+            ):
+                return response
+            response.close()
             headers["Authorization"] = "Bearer " + session["nextcloud_access_token"]
+            # file-like data has been consumed by the first try and must be rewound
+            if hasattr(data, "seek"):
+                data.seek(0)
             continue
         else:
             # we're either on the first try and didn't get a 401 or we still got a 401 after
             # refreshing the access token. either case, we return the response as is
             return response
+
+def put_files(app, uploads: dict[str,Callable[[], IO[bytes]]]) -> dict[str,int]:
+    """Uploads files to NC in parallel for the user of the session.
+
+    At most `NEXTCLOUD_POOL_SIZE` files are uploaded at a time, which is the number of
+    kept-alive connections of the user's session, so each upload has its own connection.
+    The access token is refreshed once beforehand instead of in each upload.
+
+    Args:
+    -`app`: The flask app, used for settings
+    -`uploads:dict[str,Callable[[], IO[bytes]]]`: Maps the WebDAV URLs to functions opening
+        the file to upload there. Files are opened when their upload starts
+    Returns:
+    -`dict[str,int]`: Maps the URLs of failed uploads to the status code of the response
+    """
+    if not refresh_access_token(app):
+        return {url: 401 for url in uploads}
+
+    def upload(url: str) -> int:
+        with uploads[url]() as file:
+            response = ensure_request(url, app, method="PUT", data=file)
+        response.close()
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=app.config.get("NEXTCLOUD_POOL_SIZE", 4)) as executor:
+        # each upload gets its own copy of the request context, as a context can not be
+        # pushed in several threads at once
+        futures = {
+            url: executor.submit(copy_current_request_context(upload), url)
+            for url in uploads
+        }
+        status_codes = {url: future.result() for url, future in futures.items()}
+    return {url: code for url, code in status_codes.items() if code >= 400}
+
+def list_directory(app, url) -> tuple[bool,list]:
+    """Lists the contents of the NC directory at the given URL for the user of the session.
+
+    Listings are cached per user and directory. As NC changes the ETag of a directory
+    whenever its contents change, a cached listing is revalidated with a PROPFIND of depth
+    0 requesting only the ETag, which is much cheaper than listing the directory again.
+    The number of cached listings is limited by setting `NEXTCLOUD_LISTING_CACHE_SIZE`.
+
+    Args:
+    -`app`: The flask app, used for settings
+    -`url:str`: The WebDAV URL of the directory
+    Returns:
+    -`bool`: If the listing was successful
+    -`list`: The entries of the directory as returned by `parse_webdav_files_response`
+    """
+    user_id = session["user_id"]
+    key = (user_id, url)
+    with _listings_lock:
+        cached = _listings.get(key)
+
+    if cached is not None:
+        response = ensure_request(
+            url, app, method="PROPFIND", data=WEBDAV_REQUEST_PROPFIND_ETAG_DATA,
+            headers={"Depth": "0"}
+        )
+        success, entries = parse_webdav_files_response(response.content, user_id)
+        if response.ok and success and len(entries) == 1 and entries[0]["etag"] == cached[0]:
+            with _listings_lock:
+                if key in _listings:
+                    _listings.move_to_end(key)
+            return True, cached[1]
+
+    response = ensure_request(
+        url, app, method="PROPFIND", data=WEBDAV_REQUEST_PROPFIND_DATA, headers={"Depth": "1"},
+        stream=True
+    )
+    with response:
+        if not response.ok:
+            return False, []
+        # parse the listing while it is downloaded instead of buffering the whole document
+        # and its element tree. the entries are kept, as they are cached and paginated
+        response.raw.decode_content = True
+        try:
+            files = list(iter_webdav_files(response.raw, user_id))
+        except ET.ParseError:
+            return False, []
+
+    # the directory itself is the first entry of the response
+    etag = files[0]["etag"] if len(files) > 0 else ""
+    if etag != "":
+        with _listings_lock:
+            _listings[key] = (etag, files)
+            _listings.move_to_end(key)
+            while len(_listings) > app.config.get("NEXTCLOUD_LISTING_CACHE_SIZE", 1000):
+                _listings.popitem(last=False)
+    return True, files
@@ -0,0 +1,73 @@
+"""Functions for performing requests to the simulation API over pooled connections."""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .metrics import SIM_API_REQUEST_DURATION
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(app) -> requests.Session:
+    """Gets the session shared by all requests to the sim API, creating it on first use.
+
+    The session keeps connections to the sim API alive and reuses them, so requests don't
+    pay for connection setup. Idempotent requests are retried with exponential backoff if
+    the sim API is unreachable or responds with a temporary error.
+
+    Args:
+    -`app`: The flask app, used for settings
+    Returns:
+    -`requests.Session`: The shared session
+    """
+    global _session # pylint: disable=global-statement
+    with _session_lock:
+        if _session is None:
+            config = app.config["sim_api"]
+            retry = Retry(
+                total=config.get("retries", 3),
+                backoff_factor=config.get("backoff_factor", 0.5),
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"GET", "HEAD"}),
+                # the last response is returned once the retries are used up, so routes
+                # relay the error instead of failing with a RetryError
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config.get("pool_size", 10),
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Authorization"] = "Bearer " + config["api_key"]
+            _session = session
+        return _session
+
+def sim_api_request(app, method, route, **kwargs) -> requests.Response:
+    """Performs a request to the configured sim API using the shared session.
+
+    The latency until the response headers are received is recorded in the metrics for
+    the first segment of the route, e.g. `run_status` for `run_status/<run_id>`.
+
+    Args:
+    -`app`: The flask app, used for settings
+    -`method:str`: The method of the request
+    -`route:str`: The route of the request relative to the sim API endpoint
+    -`kwargs`: Further arguments for `request` of the `requests` package. The timeout
+        defaults to the configured timeout.
+    Returns:
+    -`requests.Response`: The response to the request
+    """
+    kwargs.setdefault("timeout", app.config["sim_api"]["timeout"])
+    start = time.perf_counter()
+    try:
+        return get_session(app).request(
+            method, app.config["sim_api"]["endpoint"] + route, **kwargs
+        )
+    finally:
+        seconds = time.perf_counter() - start
+        SIM_API_REQUEST_DURATION.labels(route.split("/")[0]).observe(seconds)
+        app.logger.debug("Request %s %s to sim API took %.3f s", method, route, seconds)
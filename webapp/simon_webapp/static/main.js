@@ -78,6 +78,10 @@ function add_error(message) {
     by_id("error-label").classList.remove("hidden")
 }
 
+const IMAGE_EXTENSIONS = ["png", "jpg", "jpeg", "gif", "svg"]
+// same as FINAL_STATUS_CODES of the sim API
+const FINAL_STATUS_CODES = ["finished", "old"]
+
 async function fetch_results(run_id) {
     let element = by_id("config-file-selection")
     let input_file_dir = element.options[element.selectedIndex].dataset.dirname
@@ -86,19 +90,55 @@ async function fetch_results(run_id) {
         body: JSON.stringify({"destination_dir": input_file_dir}),
         headers: {"Content-Type": "application/json"}
     })
-    let result = response.status >= 400 ? await response.json() : {}
+    let result = await response.json()
     add_to_query_list('fetch_results', response, result)
+    if (response.status >= 400) {
+        return
+    }
 
-    let blob = await response.blob();
-    let img = document.createElement('img');
-    img.src = URL.createObjectURL(blob);
-    img.alt = 'Simulation Result';
-    img.className = 'simulation-results';
-    img.width = 900;
-    img.height = 533;
+    // images are displayed, other artifacts are listed with a link to download them
     let results_div = by_id('simulation-results');
     results_div.innerHTML = '';
-    results_div.appendChild(img);
+    let list = document.createElement('ul');
+    for (const artifact of result["artifacts"]) {
+        let url = API_ROOT + 'result_file/' + run_id
+            + '?filename=' + encodeURIComponent(artifact["filename"])
+        let extension = artifact["filename"].split(".").pop().toLowerCase()
+        if (IMAGE_EXTENSIONS.includes(extension)) {
+            let img = document.createElement('img');
+            img.src = url;
+            img.alt = artifact["filename"];
+            img.className = 'simulation-results';
+            img.width = 900;
+            img.height = 533;
+            results_div.appendChild(img);
+        }
+        let item = document.createElement('li');
+        let link = document.createElement('a');
+        link.href = url;
+        link.download = artifact["filename"];
+        link.innerText = artifact["filename"] + " (" + artifact["size"] + " bytes)";
+        item.appendChild(link);
+        list.appendChild(item);
+    }
+    results_div.appendChild(list);
+}
+
+async function update_status(run_id, result) {
+    run_status["status"] = result["code"]
+    by_id('run-status').innerText = run_status["status"]
+    if (result["queue_position"]) {
+        by_id('run-status').innerText += " (position " + result["queue_position"] + " in queue)"
+    }
+
+    // the status of a run does not change anymore after these, so the server ends the
+    // event stream, which must not be reconnected
+    if (FINAL_STATUS_CODES.includes(run_status["status"])) {
+        stop_watching_status()
+    }
+    if (run_status["status"] === "finished") {
+        await fetch_results(run_id)
+    }
 }
 
 async function check_status(run_id) {
@@ -108,16 +148,49 @@ async function check_status(run_id) {
     )
     let result = await response.json()
     add_to_query_list('run_status', response, result)
+    await update_status(run_id, result)
+}
 
-    run_status["status"] = result["code"]
-    by_id('run-status').innerText = run_status["status"]
-
-    if (run_status["status"] === "finished") {
+function stop_watching_status() {
+    if (run_status["event_source"]) {
+        run_status["event_source"].close()
+        run_status["event_source"] = undefined
+    }
+    if (run_status["interval_id"]) {
         clearInterval(run_status["interval_id"])
-        await fetch_results(run_id)
+        run_status["interval_id"] = undefined
     }
 }
 
+function watch_status(run_id) {
+    stop_watching_status()
+
+    // without support for server-sent events we fall back to polling
+    if (window.EventSource === undefined) {
+        poll_status(run_id)
+        return
+    }
+
+    let source = new EventSource(API_ROOT + 'run_status/' + run_id + '/events')
+    source.addEventListener("status", async function(event) {
+        await update_status(run_id, JSON.parse(event.data))
+    })
+    // the browser reconnects by itself when the stream ends before the run finished. if
+    // the stream failed instead, e.g. as the sim API is not reachable, it closes the
+    // source for good, so we fall back to polling
+    source.onerror = function() {
+        if (source.readyState === EventSource.CLOSED && run_status["event_source"] === source) {
+            stop_watching_status()
+            poll_status(run_id)
+        }
+    }
+    run_status["event_source"] = source
+}
+
+function poll_status(run_id) {
+    run_status["interval_id"] = setInterval(check_status, 10 * 1000, run_id)
+}
+
 async function switch_directory(item) {
     let new_val = item.dataset.dirname
     if (new_val == "..") {
@@ -171,7 +244,7 @@ async function upload_file(item) {
     }
 }
 
-async function fetch_nc_file_list() {
+async function fetch_nc_file_list(offset = 0) {
     by_id("nc-file-list-blocker").classList.remove("hidden")
 
     let curr_dir = by_id("nc-current-dir").dataset.dirname
@@ -180,20 +253,28 @@ async function fetch_nc_file_list() {
         API_ROOT + "get_files",
         {
             method: "POST",
-            body: JSON.stringify({"dir_path": curr_dir}),
+            body: JSON.stringify({"dir_path": curr_dir, "offset": offset}),
             headers: {
                 "Content-Type": "application/json"
             }
         }
     )
-    let files = await response.json()
-    add_to_query_list("get_files", response, files)
+    let page = await response.json()
+    add_to_query_list("get_files", response, page)
+
+    // the tokens could not be refreshed, so the user has to log in again
+    if (response.status === 401) {
+        window.location.href = API_ROOT + "nextcloud_login"
+        return
+    }
+    if (!response.ok) {
+        by_id("nc-file-list-blocker").classList.add("hidden")
+        return
+    }
 
+    // the entries arrive sorted with directories first
     let items = []
-    files.sort((a, b) => {
-        if (a.is_dir !== b.is_dir) return a.is_dir ? -1 : 1
-        return a.name.localeCompare(b.name)
-    }).forEach(item => {
+    page.files.forEach(item => {
         if (item.name != "/" && item.name != curr_dir) {
             let prefix = item.is_dir ? "|\>&nbsp;" : "|&nbsp;&nbsp;"
             items.push(
@@ -207,11 +288,27 @@ async function fetch_nc_file_list() {
         }
     })
 
-    by_id('nc-file-list-items').innerHTML = (
-        '<ul class="no-bullet">'
-        + '<li class="nc-file-list-dir" data-dirname="..">|\>&nbsp;..</li>'
-        + items.join("\n") + "</ul>"
-    )
+    let next_offset = page.offset + page.files.length
+    if (next_offset < page.total) {
+        items.push(
+            "<li class='nc-file-list-more' data-offset='" + next_offset + "'>"
+            + "|&nbsp;&nbsp;... load more (" + (page.total - next_offset) + " remaining)"
+            + "</li>"
+        )
+    }
+
+    if (offset == 0) {
+        by_id('nc-file-list-items').innerHTML = (
+            '<ul class="no-bullet">'
+            + '<li class="nc-file-list-dir" data-dirname="..">|\>&nbsp;..</li>'
+            + items.join("\n") + "</ul>"
+        )
+    } else {
+        by_cl("nc-file-list-more").forEach(item => item.remove())
+        by_id('nc-file-list-items').querySelector("ul").insertAdjacentHTML(
+            "beforeend", items.join("\n")
+        )
+    }
 
     by_cl("nc-file-list-dir").forEach(item => {
         item.onclick = async function(event) {
@@ -227,6 +324,13 @@ async function fetch_nc_file_list() {
         }
     })
 
+    by_cl("nc-file-list-more").forEach(item => {
+        item.onclick = async function(event) {
+            event.preventDefault()
+            fetch_nc_file_list(parseInt(item.dataset.offset))
+        }
+    })
+
     by_id("nc-file-list-blocker").classList.add("hidden")
 }
 
@@ -248,10 +352,7 @@ async function start_simulation_from_form(form_element) {
         return
     }
 
-    if (run_status["interval_id"]) {
-        clearInterval(run_status["interval_id"]);
-    }
-    run_status["interval_id"] = setInterval(check_status, 10 * 1000, run_status["run_id"])
+    watch_status(run_status["run_id"])
 }
 
 function main() {
@@ -1,8 +1,13 @@
 """Various utility functions for the webapp."""
 
 from __future__ import annotations
+from typing import IO, Iterable, Iterator
 from urllib.parse import quote, unquote
 import xml.etree.ElementTree as ET
+from urllib3.fields import format_multipart_header_param
+from urllib3.filepost import choose_boundary
+
+TRANSFER_CHUNK_SIZE = 1024 * 1024 # 1 MiB
 
 def name_from_href(href: str, username: str) -> str:
     """Extracts the file/directory name from the given response href.
@@ -20,6 +25,52 @@ def name_from_href(href: str, username: str) -> str:
         return href
     return splitted[1]
 
+WEBDAV_NAMESPACES = {
+    "d": "DAV:",
+    "s": "http://sabredav.org/ns",
+    "oc": "http://owncloud.org/ns",
+    "nc": "http://nextcloud.org/ns"
+}
+
+def parse_webdav_response_element(response_tag: ET.Element, username: str) -> dict:
+    """Extracts file or directory information from a single `d:response` element of a WebDAV
+    PROPFIND response.
+
+    Args:
+    -`response_tag:ET.Element`: The `d:response` element
+    -`username:str`: The username of the WebDAV index, used for extracting file/directory names.
+    Returns:
+    -`dict`: The information about the file or directory
+    """
+    namespaces = WEBDAV_NAMESPACES
+    href = response_tag.findtext("d:href", "", namespaces)
+    content_type = ""
+    resource_type = ""
+    etag = ""
+    is_dir = False
+
+    for propstat in response_tag.findall("d:propstat", namespaces):
+        status = propstat.findtext("d:status", "", namespaces)
+        if status == "HTTP/1.1 404 Not Found":
+            continue
+
+        prop = propstat.find("d:prop", namespaces)
+        content_type = prop.findtext("d:getcontenttype", "", namespaces)
+        etag = prop.findtext("d:getetag", "", namespaces)
+        resource_type = prop.find("d:resourcetype", namespaces)
+        if (
+            resource_type is not None and resource_type != ""
+            and len(resource_type.findall("d:collection", namespaces)) > 0
+        ):
+            is_dir = True
+
+    return {
+        "name": name_from_href(href, username),
+        "is_dir": is_dir,
+        "content_type": content_type,
+        "etag": etag
+    }
+
 def parse_webdav_files_response(content: str, username: str) -> tuple[bool,list]:
     """Parses the XML response from a WebDAV PROPFIND request and extracts file and directory
     information.
@@ -35,42 +86,43 @@ def parse_webdav_files_response(content: str, username: str) -> tuple[bool,list]
     except ET.ParseError:
         return False, []
 
-    namespaces = {
-        "d": "DAV:",
-        "s": "http://sabredav.org/ns",
-        "oc": "http://owncloud.org/ns",
-        "nc": "http://nextcloud.org/ns"
-    }
-
     files = []
-    for response_tag in root.findall("d:response", namespaces):
-        href = response_tag.findtext("d:href", "", namespaces)
-        content_type = ""
-        resource_type = ""
-        is_dir = False
-
-        for propstat in response_tag.findall("d:propstat", namespaces):
-            status = propstat.findtext("d:status", "", namespaces)
-            if status == "HTTP/1.1 404 Not Found":
-                continue
-
-            prop = propstat.find("d:prop", namespaces)
-            content_type = prop.findtext("d:getcontenttype", "", namespaces)
-            resource_type = prop.find("d:resourcetype", namespaces)
-            if (
-                resource_type is not None and resource_type != ""
-                and len(resource_type.findall("d:collection", namespaces)) > 0
-            ):
-                is_dir = True
-
-        files.append({
-            "name": name_from_href(href, username),
-            "is_dir": is_dir,
-            "content_type": content_type
-        })
+    for response_tag in root.findall("d:response", WEBDAV_NAMESPACES):
+        files.append(parse_webdav_response_element(response_tag, username))
 
     return True, files
 
+def iter_webdav_files(stream: IO[bytes], username: str) -> Iterator[dict]:
+    """Parses the XML response from a WebDAV PROPFIND request incrementally while reading it
+    from the given stream and yields the information of each file or directory as soon as
+    its `d:response` element is complete.
+
+    Elements are discarded after they were parsed, so the memory used does not grow with the
+    number of entries like with `parse_webdav_files_response`.
+
+    Args:
+    -`stream:IO[bytes]`: A file-like object with the XML content, e.g. the raw body of a
+        streamed response
+    -`username:str`: The username of the WebDAV index, used for extracting file/directory names.
+    Returns:
+    -`Iterator[dict]`: The information about the files and directories, same as the entries
+        returned by `parse_webdav_files_response`
+    Raises:
+    -`ET.ParseError`: If the content is not valid XML
+    """
+    response_tag_name = "{DAV:}response"
+    root = None
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+
+        if element.tag == response_tag_name:
+            yield parse_webdav_response_element(element, username)
+            # the root would otherwise keep references to all parsed responses
+            root.clear()
+
 def filename_from_nc_path(file_path: str) -> str:
     """Extracts a file's name from its full NC-like path.
 
@@ -93,3 +145,76 @@ def encode_nc_path(path: str) -> str:
     parts = unquote(path).split("/")
     parts = [quote(p) for p in parts if p != ""]
     return "/".join(parts)
+
+def stream_multipart_files(
+    field_name: str,
+    files: Iterable[tuple[str,Iterable[bytes]]]
+) -> tuple[str,Iterator[bytes]]:
+    """Encodes files as multipart/form-data body without loading them into memory.
+
+    The `requests` package reads files given with `files=` completely before sending them,
+    so this builds the body as generator instead, which results in a chunked upload.
+
+    Args:
+    -`field_name:str`: The name of the form field the files are sent as
+    -`files:Iterable[tuple[str,Iterable[bytes]]]`: Pairs of filename and file content in
+        chunks, e.g. from `iter_content` of a streamed response
+    Returns:
+    -`str`: The value for the Content-Type header, which includes the boundary
+    -`Iterator[bytes]`: The body of the request
+    """
+    boundary = choose_boundary()
+
+    def body():
+        for filename, chunks in files:
+            yield (
+                f"--{boundary}\r\n"
+                + "Content-Disposition: form-data; "
+                + format_multipart_header_param("name", field_name) + "; "
+                + format_multipart_header_param("filename", filename) + "\r\n"
+                + "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode("utf-8")
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode("utf-8")
+
+    return f"multipart/form-data; boundary={boundary}", body()
+
+class SizedStream:
+    """File-like object reading from the given stream and reporting the given size as its
+    length.
+
+    The `requests` package determines the length of file-like bodies without one by
+    seeking to their end, which decompresses a compressed member of a zip archive twice.
+    With a known length the body is sent with `Content-Length` in one pass instead.
+    """
+
+    def __init__(self, stream: IO[bytes], size: int):
+        self.stream = stream
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __enter__(self) -> SizedStream:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(lambda: self.read(TRANSFER_CHUNK_SIZE), b"")
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to the given number of bytes, or all remaining if negative."""
+        return self.stream.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """Moves to the given position, e.g. to rewind the body for a retry."""
+        return self.stream.seek(offset, whence)
+
+    def close(self) -> None:
+        """Closes the underlying stream."""
+        self.stream.close()
@@ -0,0 +1,8 @@
+#!/bin/bash
+# the flask development server is used unless the webapp is served with gunicorn and
+# the gevent worker class, which handles many concurrent requests in one process
+if [ "$WEBAPP_SERVER" == "gunicorn" ]; then
+    exec gunicorn --config gunicorn.conf.py simon_webapp.app:app
+else
+    exec python -Xfrozen_modules=off -m flask run --port 5001
+fi